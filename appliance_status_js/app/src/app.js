@@ -24,10 +24,46 @@ function extendFormBehavior(form, form_error){
             }
         }
 
-        req.open("POST", "/update");
+        req.open("POST", form.getAttribute("action"));
         req.send(new FormData(form));
     });
     return form;
 }
 
-export {extendButtonBehavior, extendFormBehavior};
+function extendSectionBehavior(details, form_error){
+    const extendForm = () => {
+        const form = details.querySelector("form");
+        extendButtonBehavior(form.querySelector("input[type='submit']"), form);
+        extendFormBehavior(form, form_error);
+    };
+    // The link opens the section without javascript, with it the title toggles
+    const link = details.querySelector("summary a");
+    if (link) {
+        link.addEventListener("click", (event) => {
+            event.preventDefault();
+            details.open = !details.open;
+        });
+    }
+    if (details.querySelector("form")) {
+        extendForm();
+        return details;
+    }
+    details.addEventListener("toggle", () => {
+        if (!details.open || details.dataset.loading) {
+            return;
+        }
+        details.dataset.loading = "true";
+        fetch(details.dataset.src)
+            .then((response) => response.text())
+            .then((html) => {
+                details.insertAdjacentHTML("beforeend", html);
+                extendForm();
+            })
+            .catch(() => {
+                delete details.dataset.loading;
+            });
+    });
+    return details;
+}
+
+export {extendButtonBehavior, extendFormBehavior, extendSectionBehavior};
@@ -1,5 +1,5 @@
 import {expect} from "chai";
-import { extendButtonBehavior, extendFormBehavior } from "../src/app";
+import { extendButtonBehavior, extendFormBehavior, extendSectionBehavior } from "../src/app";
 
 const jsdom = require("jsdom");
 const { JSDOM } = jsdom;
@@ -27,3 +27,32 @@ describe("extendFormBehavior", function(){
         // I see the light now. No more jquery. 
     });
 })
+
+describe("extendSectionBehavior", function(){
+    it("extends forms of sections rendered with the page", function(){
+        const doc = new JSDOM(
+            "<details open><form action='/config/sections/0'><input type='submit'></form></details>"
+        ).window.document;
+        const details = doc.querySelector('details');
+        extendSectionBehavior(details, doc.createElement('div'));
+        expect(doc.querySelector('input').getAttribute('disabled')).to.equal("disabled");
+    });
+    it("does not load closed sections", function(){
+        const dom = new JSDOM("<details data-src='/config/sections/1'></details>");
+        const details = dom.window.document.querySelector('details');
+        extendSectionBehavior(details, dom.window.document.createElement('div'));
+        details.dispatchEvent(new dom.window.Event("toggle"));
+        expect(details.dataset.loading).to.equal(undefined);
+    });
+    it("toggles the section instead of following the title link", function(){
+        const dom = new JSDOM(
+            "<details data-src='/config/sections/1'><summary><a href='?section=1'>Network</a></summary></details>"
+        );
+        const details = dom.window.document.querySelector('details');
+        extendSectionBehavior(details, dom.window.document.createElement('div'));
+        const click = new dom.window.MouseEvent("click", {bubbles: true, cancelable: true});
+        details.querySelector('a').dispatchEvent(click);
+        expect(click.defaultPrevented).to.equal(true);
+        expect(details.open).to.equal(true);
+    });
+})
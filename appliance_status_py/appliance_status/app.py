@@ -7,11 +7,28 @@ import json
 import os
 
 import structlog
-from flask import Flask, abort, render_template, request
+from flask import (
+    Flask,
+    abort,
+    jsonify,
+    render_template,
+    request,
+    stream_template,
+)
 
-from appliance_status import network
-from appliance_status.config_manager import ConfigManager
-from appliance_status.leases_manager import LeasesManager
+from appliance_status import resolver
+from appliance_status.config_manager import (
+    ConfigManager,
+    StaleConfigError,
+    is_plain_value,
+)
+from appliance_status.file_watcher import FileWatcher
+from appliance_status.gateway_monitor import GatewayMonitor
+from appliance_status.interface_index import KINDS, PER_PAGE
+from appliance_status.interface_stats import InterfaceStats
+from appliance_status.leases_manager import LeasesManager, interface_name
+from appliance_status.network_watcher import NetworkWatcher
+from appliance_status.scheduler import ProbeScheduler, ScheduledResult
 from appliance_status.test_manager import ATestManager
 
 app = Flask(__name__)
@@ -23,23 +40,310 @@ config_manager = ConfigManager.make_one(
 )
 test_manager = ATestManager(json.load(open(os.path.abspath(app.config["TESTS"]))))
 leases_manager = LeasesManager(os.path.abspath(app.config["LEASES"]))
+probe_scheduler = ProbeScheduler(test_manager)
+network_watcher = NetworkWatcher()
+file_watcher = FileWatcher()
+interface_stats = InterfaceStats()
+gateway_monitor = GatewayMonitor(network_watcher.get_default_route)
+
+
+def _get_interface_page(default_if):
+    """
+    Return the page of interfaces the query parameters ask for.
+
+    `name` (repeatable) selects interfaces by name, `kind` is one of
+    main, physical, virtual and all, `default=true` selects the default
+    interface, `family` interfaces with inet or inet6 addresses. `page` and
+    `per_page` select the page. Without names, only the main interfaces,
+    physical ones and the default one, get shown.
+    """
+    args = request.args
+    names = args.getlist("name")
+    try:
+        return network_watcher.get_interface_index(default_if).query(
+            names=names,
+            kind=args.get("kind", "all" if names else "main"),
+            default=args.get("default") == "true",
+            family=args.get("family"),
+            page=args.get("page", 1, type=int),
+            per_page=args.get("per_page", PER_PAGE, type=int),
+        )
+    except ValueError as exc:
+        abort(400, str(exc))
+
+
+def _config_changed(path):
+    """Let this worker see configurations saved by the other workers."""
+    config_manager.config_on_disk.invalidate()
+
+
+def _schema_changed(path):
+    """Use the changed schema, keep the old one if the new one is invalid."""
+    global config_manager
+    try:
+        with open(path) as file_:
+            config_manager = ConfigManager.make_one(
+                config_manager.config_on_disk.config_file, json.load(file_)
+            )
+    except (OSError, ValueError, KeyError, TypeError):
+        structlog.get_logger().exception("Keeping the schema, the new one is invalid")
+
+
+def _tests_changed(path):
+    """Run the changed tests, keep the old ones if the new ones are invalid."""
+    global test_manager, probe_scheduler
+    try:
+        with open(path) as file_:
+            new_test_manager = ATestManager(json.load(file_))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        structlog.get_logger().exception("Keeping the tests, the new ones are invalid")
+        return
+    old_probe_scheduler = probe_scheduler
+    test_manager = new_test_manager
+    probe_scheduler = ProbeScheduler(new_test_manager)
+    old_probe_scheduler.stop()
+    probe_scheduler.start()
+
+
+file_watcher.watch(app.config["CONFIG_FILE_OUT"], _config_changed)
+file_watcher.watch(app.config["SCHEMA"], _schema_changed)
+file_watcher.watch(app.config["TESTS"], _tests_changed)
+# The configuration form, with what it was rendered for
+_config_form = [None]
+
+
+def _render_config_form():
+    """
+    Render the configuration form, reuse it until a watched file changed.
+
+    Only the section in the query parameter `section`, by default the first
+    one, gets rendered. The page loads the others when they get opened.
+    Without a running file watcher, the form gets rendered every time.
+    """
+    file_watcher.start()
+    open_section = request.args.get("section", 0, type=int)
+    key = (file_watcher.get_generation(), config_manager, open_section)
+    cached = _config_form[0]
+    if key[0] is not None and cached is not None and cached[0] == key:
+        return cached[1]
+    sections = [
+        (name, config_manager.get_section(name) if number == open_section else None)
+        for number, name in enumerate(config_manager.get_sections())
+    ]
+    config_form = render_template(
+        "config_form.j2", form_schema=config_manager.form_schema, sections=sections
+    )
+    _config_form[0] = (key, config_form)
+    return config_form
 
 
 @app.route("/")
 def status():
-    """Show status information, test results and the form to edit configuration."""
-    log = structlog.get_logger()
-    default_route = network.get_default_route()
-    network_info = network.get_network_information(default_if=default_route["IF"])
-    network_tests = test_manager.perform_network_tests(log)
-    form_schema = config_manager.get_schema_with_config()
+    """
+    Show status information, test results and the form to edit configuration.
+
+    Test results come from the background scheduler, the page does not wait
+    for any test to finish. Network information comes from the snapshot of
+    the network watcher. Only interfaces matching the query parameters get
+    shown, see `_get_interface_page`.
+    """
+    network_watcher.start()
+    default_route = network_watcher.get_default_route()
+    interface_page = _get_interface_page(default_route["IF"])
+    interface_stats.start()
+    interface_rates = interface_stats.get_rates(
+        entry["ifname"] for entry in interface_page.interfaces
+    )
+    gateway_monitor.start()
+    probe_scheduler.start()
+    network_tests = probe_scheduler.get_results()
+    config_form = _render_config_form()
     return render_template(
         "status.j2",
-        network_info=network_info,
+        network_info=interface_page.interfaces,
+        interface_page=interface_page,
+        interface_rates=interface_rates,
+        interface_kinds=KINDS,
+        interface_query=request.args.to_dict(flat=False),
+        default_route=default_route,
+        gateway_status=gateway_monitor.get_status(),
+        network_tests=network_tests,
+        config_form=config_form,
+    )
+
+
+@app.route("/live")
+def status_live():
+    """
+    Show the status page, running all network tests right now.
+
+    The page gets streamed. Everything up to the network tests is sent right
+    away, every test result is sent as soon as its test finishes.
+    """
+    log = structlog.get_logger()
+    network_watcher.start()
+    default_route = network_watcher.get_default_route()
+    interface_page = _get_interface_page(default_route["IF"])
+    interface_stats.start()
+    interface_rates = interface_stats.get_rates(
+        entry["ifname"] for entry in interface_page.interfaces
+    )
+    gateway_monitor.start()
+    network_tests = (
+        ScheduledResult(result, 0.0, test_manager.intervals[index])
+        for index, result in test_manager.iter_network_tests(
+            log, deadline=app.config.get("LIVE_DEADLINE")
+        )
+    )
+    config_form = _render_config_form()
+    return stream_template(
+        "status.j2",
+        network_info=interface_page.interfaces,
+        interface_page=interface_page,
+        interface_rates=interface_rates,
+        interface_kinds=KINDS,
+        interface_query=request.args.to_dict(flat=False),
         default_route=default_route,
+        gateway_status=gateway_monitor.get_status(),
         network_tests=network_tests,
-        form_schema=form_schema,
+        config_form=config_form,
+        live=True,
+    )
+
+
+@app.route("/network")
+def network_state():
+    """
+    Return interfaces and default route as json.
+
+    The version of the network snapshot is the ETag, clients sending it in
+    `If-None-Match` get a 304 until the network changes.
+    """
+    network_watcher.start()
+    version = network_watcher.get_version()
+    default_route = network_watcher.get_default_route()
+    response = jsonify(
+        version=version,
+        default_route=default_route,
+        interfaces=network_watcher.get_network_information(
+            default_if=default_route["IF"]
+        ),
     )
+    if version is not None:
+        response.set_etag(str(version))
+    return response.make_conditional(request)
+
+
+@app.route("/interfaces")
+def interfaces():
+    """Return a page of interfaces as json, filtered like on the status page."""
+    network_watcher.start()
+    interface_page = _get_interface_page(network_watcher.get_default_route()["IF"])
+    return jsonify(
+        interfaces=interface_page.interfaces,
+        total=interface_page.total,
+        page=interface_page.page,
+        per_page=interface_page.per_page,
+        pages=interface_page.pages,
+    )
+
+
+@app.route("/gateway")
+def gateway():
+    """Return loss and RTT percentiles of the default gateway as json."""
+    gateway_monitor.start()
+    return jsonify(gateway_monitor.get_status())
+
+
+@app.route("/latency")
+def latency():
+    """Return rolling latency histograms per test and phase as json."""
+    probe_scheduler.start()
+    return jsonify(probe_scheduler.get_latency())
+
+
+@app.route("/history")
+def history():
+    """Return pass rate, latency percentiles and latest results per test as json."""
+    probe_scheduler.start()
+    return jsonify(probe_scheduler.get_history())
+
+
+@app.route("/dns")
+def dns():
+    """Return hit and miss counters of the shared dns cache as json."""
+    return jsonify(resolver.cache.stats())
+
+
+@app.route("/config", methods=["GET", "PATCH"])
+def configuration():
+    """
+    Return the stored values as json, or change some of them.
+
+    PATCH takes a json object of keys and new values, only they get
+    validated. The ETag depends on the stored config. Changes sent with an
+    `If-Match` of another ETag fail with 412, somebody else saved first.
+    """
+    if request.method == "GET":
+        values, etag = config_manager.get_values()
+        response = jsonify(values)
+        response.set_etag(etag)
+        return response.make_conditional(request)
+    log = structlog.get_logger()
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict):
+        abort(400, "Expected a json object of keys and values")
+    if not all(is_plain_value(value) for value in changes.values()):
+        abort(400, "Values must be strings or integers")
+    try:
+        values, etag = config_manager.patch_config(changes, request.if_match or None)
+    except StaleConfigError:
+        abort(412, "The configuration changed, get it again")
+    except ValueError:
+        log.exception("Value Error while changing configuration")
+        abort(400, "The provided data is invalid")
+    except KeyError:
+        log.exception("Value Error while changing configuration")
+        abort(400, "You need to provide a value for all keys")
+    file_watcher.check()
+    response = jsonify(values)
+    response.set_etag(etag)
+    return response
+
+
+@app.route("/config/sections/<int:number>", methods=["GET", "POST"])
+def config_section(number):
+    """
+    Return the form of one section of the configuration, or save it.
+
+    The status page loads sections when they get opened. POST takes the
+    form of the section, other values stay as they are.
+    """
+    try:
+        name = config_manager.get_sections()[number]
+    except IndexError:
+        abort(404)
+    if request.method == "GET":
+        return render_template(
+            "config_section.j2", number=number, fields=config_manager.get_section(name)
+        )
+    log = structlog.get_logger()
+    try:
+        config_manager.patch_config(request.form.to_dict())
+    except ValueError:
+        log.exception("Value Error while saving configuration")
+        abort(400, "The provided data is invalid")
+    except KeyError:
+        log.exception("Value Error while saving configuration")
+        abort(400, "You need to provide a value for all keys")
+    file_watcher.check()
+    return "", 204
+
+
+@app.route("/config/cache")
+def config_cache():
+    """Return hit and miss counters of the parsed configuration file as json."""
+    return jsonify(config_manager.config_on_disk.stats())
 
 
 @app.route("/leases")
@@ -50,9 +354,14 @@ def leases():
     Since this application is intended to be run within docker, what gets
     shown depends fully on the directories mounted into the docker container!
     """
-    retval = leases_manager.get_leases()
+    retval, records = leases_manager.get_leases_and_records()
 
-    return render_template("leases.j2", leases=retval)
+    return render_template(
+        "leases.j2",
+        leases=retval,
+        records=records,
+        interface_names={ifindex: interface_name(ifindex) for ifindex in records},
+    )
 
 
 @app.route("/update", methods=["POST"])
@@ -73,4 +382,6 @@ def update():
             400,
             "You need to provide a value for all keys",
         )
+    # Show the new values right away, not only after the watcher noticed
+    file_watcher.check()
     return "", 204
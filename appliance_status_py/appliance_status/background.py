@@ -0,0 +1,78 @@
+"""
+Responsible for running work in the background, once per process.
+
+Threads do not survive a fork, and gunicorn forks its workers after loading
+the application. Background work therefore remembers the process that
+started it. Starting it again in that process is a no-op, starting it in a
+forked process starts it anew. Start it in the process serving requests.
+"""
+import concurrent.futures
+import os
+import threading
+from typing import Callable, List, Optional
+
+
+def start_thread(target, name) -> Callable[[], None]:
+    """
+    Run `target` in a daemon thread named `name`.
+
+    `target` gets an event, set when it should return. Return a function
+    setting that event and waiting until the thread is gone.
+    """
+    stopping = threading.Event()
+    thread = threading.Thread(target=target, args=(stopping,), name=name, daemon=True)
+    thread.start()
+
+    def stop():
+        stopping.set()
+        thread.join()
+
+    return stop
+
+
+def cancel_futures(futures: List[concurrent.futures.Future]) -> Callable[[], None]:
+    """Return a function cancelling `futures` and waiting until they are done."""
+
+    def stop():
+        for future in futures:
+            future.cancel()
+        concurrent.futures.wait(futures)
+
+    return stop
+
+
+class Background:
+    """Implements all responsibilities of the module."""
+
+    def __init__(self):
+        """Create background work that is not running."""
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop: Optional[Callable[[], None]] = None
+
+    def start(self, launch) -> bool:
+        """
+        Call `launch`, unless it got called in this process already.
+
+        `launch` starts the work and returns a function stopping it, like
+        `start_thread` and `cancel_futures` do. Return whether it got called.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return False
+            self._stop = launch()
+            self._pid = os.getpid()
+            return True
+
+    def stop(self):
+        """Stop the work and wait until it stopped."""
+        with self._lock:
+            stop, self._stop = self._stop, None
+            self._pid = None
+        if stop is not None:
+            stop()
+
+    @property
+    def running(self) -> bool:
+        """Tell whether the work got started in this process."""
+        return self._pid == os.getpid()
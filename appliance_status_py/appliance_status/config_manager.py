@@ -5,12 +5,29 @@ Retrieving configuration
 Validating new configuration
 Updating configuration
 """
+import errno
+import fcntl
+import hashlib
 import json
+import os
+import re
+import stat
 import string
+import tempfile
+import threading
+from collections import ChainMap
+from functools import lru_cache
+from time import monotonic_ns
+from contextlib import contextmanager
 from copy import deepcopy
-from typing import Dict, Union, List
+from types import MappingProxyType
+from typing import Callable, Dict, FrozenSet, Union, List, Mapping, Optional, Tuple
 import attr
 
+# Section of schema fields that do not name one
+DEFAULT_SECTION = "General"
+_ASCII_LETTERS = re.compile("[{}]*".format(string.ascii_letters))
+
 
 class _Normalizers:
     """Normalize values, also fail with ValueError if not normalizable."""
@@ -42,12 +59,165 @@ class _Normalizers:
         value = str(value)
         if len(value) > 1000:
             raise ValueError("Too large")
-        for key in value:
-            if key not in string.ascii_letters:
-                raise ValueError("Character not ascii letter")
+        if _ASCII_LETTERS.fullmatch(value) is None:
+            raise ValueError("Character not ascii letter")
         return value
 
 
+def is_plain_value(value) -> bool:
+    """Tell whether `value` is a string or an integer, booleans are not."""
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
+
+
+@attr.s(frozen=True)
+class _ValidationPlan:
+    """
+    The form schema, compiled once into what validating a form needs.
+
+    Normalizers are resolved to callables, keys are kept as a set, so
+    unknown and missing fields are found without walking the schema.
+    """
+
+    version: int = attr.ib()
+    fields: Tuple[Tuple[str, Callable], ...] = attr.ib()
+    keys: FrozenSet[str] = attr.ib()
+    normalizers: Mapping[str, Callable] = attr.ib()
+
+    @classmethod
+    def compile(cls, form_schema, normalizers):
+        """Compile `form_schema`, fail with ValueError on unknown normalizers."""
+        fields = []
+        for schema_field in form_schema["schema"]:
+            name = schema_field.get("type_normalizer")
+            normalizer = getattr(normalizers, name, None) if name else None
+            if name is None or name.startswith("_") or not callable(normalizer):
+                raise ValueError(
+                    "Unknown type normalizer {!r} of field {!r}".format(
+                        name, schema_field.get("key")
+                    )
+                )
+            fields.append((schema_field["key"], normalizer))
+        return cls(
+            form_schema["version"],
+            tuple(fields),
+            frozenset(key for key, _ in fields),
+            MappingProxyType(dict(fields)),
+        )
+
+    def apply(self, form):
+        """
+        Return the config for the values of `form`.
+
+        Missing fields raise KeyError, unknown fields and bad values ValueError.
+        """
+        for key, _normalizer in self.fields:
+            if key not in form:
+                raise KeyError(key)
+        if len(form) > len(self.keys) or not self.keys.issuperset(form):
+            raise ValueError("Form contained unknown fields")
+        return {
+            "version": self.version,
+            "schema": [
+                {"key": key, "value": normalizer(form[key])}
+                for key, normalizer in self.fields
+            ],
+        }
+
+    def apply_changes(self, values, changes):
+        """
+        Return the config for `values`, with only `changes` normalized.
+
+        Unknown fields and bad values raise ValueError, so do values other
+        than strings and integers. Fields without a value are left out,
+        sections of the form get saved one at a time.
+        """
+        if not self.keys.issuperset(changes):
+            raise ValueError("Changes contained unknown fields")
+        for key, value in changes.items():
+            if not is_plain_value(value):
+                raise ValueError("Value of {!r} is no string or integer".format(key))
+        values = dict(values)
+        for key, value in changes.items():
+            values[key] = self.normalizers[key](value)
+        return {
+            "version": self.version,
+            "schema": [
+                {"key": key, "value": values[key]}
+                for key, _ in self.fields
+                if key in values
+            ],
+        }
+
+
+@attr.s(frozen=True)
+class _SchemaIndex:
+    """Fields of the schema by key, and their keys by section, in schema order."""
+
+    by_key: Mapping[str, Mapping] = attr.ib()
+    sections: Mapping[str, Tuple[str, ...]] = attr.ib()
+
+    @classmethod
+    def build(cls, schema_fields):
+        """Index `schema_fields`, fields without section go to DEFAULT_SECTION."""
+        by_key = {}
+        sections: Dict[str, List[str]] = {}
+        for schema_field in schema_fields:
+            by_key[schema_field["key"]] = schema_field
+            sections.setdefault(
+                schema_field.get("section", DEFAULT_SECTION), []
+            ).append(schema_field["key"])
+        return cls(
+            MappingProxyType(by_key),
+            MappingProxyType({name: tuple(keys) for name, keys in sections.items()}),
+        )
+
+
+def config_etag(config):
+    """Return an ETag for the contents of `config`."""
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:32]
+
+
+class StaleConfigError(Exception):
+    """The config changed, since the client read it."""
+
+
+def _fsync_directory(directory):
+    """Make a rename in `directory` survive a crash."""
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@lru_cache(maxsize=None)
+def _boot_id():
+    """Return the id of this boot, monotonic clocks only compare within one."""
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as file_:
+            return file_.read().strip()
+    except OSError:
+        return ""
+
+
+def _written_request(lock_file):
+    """Return when the value on disk got requested, or None if unknown."""
+    lock_file.seek(0)
+    boot_id, _, requested = lock_file.read().strip().partition(" ")
+    if boot_id != _boot_id() or not requested.isdigit():
+        return None
+    return int(requested)
+
+
+def _record_request(lock_file, requested):
+    """Remember when the value just written got requested, for all processes."""
+    lock_file.truncate(0)
+    lock_file.write("{} {}\n".format(_boot_id(), requested))
+    lock_file.flush()
+
+
 @attr.s
 class ConfigOnDisk:
     """
@@ -57,21 +227,175 @@ class ConfigOnDisk:
     The `config` attribute represents the file contents as json.
     When the file does not exist or has invalid json, return a minimum valid
     object.
+    The parsed contents are kept until inode, mtime or size of the file
+    change, which costs one `os.stat` per access.
+    New contents get written to a temporary file and renamed over the config,
+    under an advisory lock, so readers never see a half written file.
+    The lock file also tells when the value on disk got requested, so
+    workers skip writing values that were requested earlier.
     """
 
     config_file: str = attr.ib(validator=attr.validators.matches_re(r"^(/|[A-Z]:).*"))
+    hits: int = attr.ib(default=0, init=False, eq=False)
+    misses: int = attr.ib(default=0, init=False, eq=False)
+    _cached: Optional[tuple] = attr.ib(default=None, init=False, eq=False, repr=False)
+    _lock: threading.Lock = attr.ib(
+        factory=threading.Lock, init=False, eq=False, repr=False
+    )
+    _write_lock: threading.Lock = attr.ib(
+        factory=threading.Lock, init=False, eq=False, repr=False
+    )
+    _pending: object = attr.ib(default=None, init=False, eq=False, repr=False)
+    _generation: int = attr.ib(default=0, init=False, eq=False, repr=False)
+    _written: int = attr.ib(default=0, init=False, eq=False, repr=False)
+
+    def _stat_key(self):
+        try:
+            stat_result = os.stat(self.config_file)
+        except FileNotFoundError:
+            return None
+        return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+
+    @contextmanager
+    def _flock(self, operation):
+        """
+        Hold an advisory lock on a file next to the config, shared by processes.
+
+        Yield the lock file, None if there is none.
+        """
+        try:
+            lock_file = open(self.config_file + ".lock", "a+")
+        except OSError:
+            # Without a writable directory, nobody can write the config either
+            yield None
+            return
+        with lock_file:
+            fcntl.flock(lock_file, operation)
+            yield lock_file
 
     @property
     def config(self):
-        """JSON representation of the contents of the config file."""
+        """
+        JSON representation of the contents of the config file.
+
+        The object is shared between accesses, do not modify it.
+        """
+        key = self._stat_key()
+        with self._lock:
+            if self._cached is not None and self._cached[0] == key:
+                self.hits += 1
+                return self._cached[1]
+            self.misses += 1
+        with self._flock(fcntl.LOCK_SH):
+            key = self._stat_key()
+            config = self._read()
+        with self._lock:
+            self._cached = (key, config)
+        return config
+
+    def _read(self):
         try:
-            return json.load(open(self.config_file))
+            with open(self.config_file) as file_:
+                return json.load(file_)
         except (FileNotFoundError, json.decoder.JSONDecodeError):
             return {"schema": [], "version": -1}
 
     @config.setter
     def config(self, value):
-        json.dump(value, open(self.config_file, "w"))
+        """
+        Write `value`, replacing the file at once.
+
+        Writes waiting for a running one get coalesced, the latest value wins.
+        Within a process, waiting writes are done as one write of the latest
+        value. Across processes, a value requested earlier than the one on
+        disk does not get written.
+        """
+        with self._lock:
+            self._pending = (value, monotonic_ns())
+            self._generation += 1
+            generation = self._generation
+        with self._write_lock:
+            with self._lock:
+                if self._written >= generation:
+                    # A later value got written, while this one was waiting
+                    return
+                (value, requested), generation = self._pending, self._generation
+            self._write(json.dumps(value), requested)
+            with self._lock:
+                self._written = generation
+            self.invalidate()
+
+    def update(self, change):
+        """
+        Write `change(config)` and return it.
+
+        Reading and writing happen under one lock, no process writes in
+        between. Exceptions of `change` leave the file alone.
+        """
+        with self._write_lock:
+            with self._flock(fcntl.LOCK_EX) as lock_file:
+                value = change(self._read())
+                self._replace(json.dumps(value))
+                if lock_file is not None:
+                    _record_request(lock_file, monotonic_ns())
+            self.invalidate()
+        return value
+
+    def invalidate(self):
+        """Parse the file again on the next access."""
+        with self._lock:
+            self._cached = None
+
+    def _write(self, contents, requested):
+        with self._flock(fcntl.LOCK_EX) as lock_file:
+            if lock_file is None:
+                self._replace(contents)
+                return
+            written = _written_request(lock_file)
+            if written is not None and written > requested:
+                # Another worker wrote a value requested later
+                return
+            self._replace(contents)
+            _record_request(lock_file, requested)
+
+    def _replace(self, contents):
+        """Replace the file with `contents`. Caller must hold the exclusive lock."""
+        try:
+            with open(self.config_file) as file_:
+                if file_.read() == contents:
+                    return
+                mode = stat.S_IMODE(os.fstat(file_.fileno()).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        directory, name = os.path.split(self.config_file)
+        fd, temp_file = tempfile.mkstemp(dir=directory, prefix="." + name)
+        try:
+            with open(fd, "w") as file_:
+                file_.write(contents)
+                file_.flush()
+                os.fsync(file_.fileno())
+            os.chmod(temp_file, mode)
+            try:
+                os.replace(temp_file, self.config_file)
+            except OSError as exc:
+                if exc.errno not in (errno.EBUSY, errno.EXDEV):
+                    raise
+                # A file mounted into a container can not be replaced,
+                # readers are kept out by the lock instead
+                with open(self.config_file, "w") as file_:
+                    file_.write(contents)
+                    file_.flush()
+                    os.fsync(file_.fileno())
+            else:
+                _fsync_directory(directory)
+        finally:
+            if os.path.exists(temp_file):
+                os.unlink(temp_file)
+
+    def stats(self):
+        """Return hit and miss counters of the parsed config, ready for json."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
 
 
 @attr.s(frozen=True)
@@ -81,6 +405,30 @@ class ConfigManager:
     config_on_disk: ConfigOnDisk = attr.ib()
     form_schema: Dict[str, Union[str, int, List[Dict[str, str]]]] = attr.ib()
     normalizers = _Normalizers()
+    plan: _ValidationPlan = attr.ib(init=False)
+
+    @plan.default
+    def _compile_plan(self):
+        return _ValidationPlan.compile(self.form_schema, self.normalizers)
+
+    _base_schema: Mapping = attr.ib(init=False, eq=False, repr=False)
+    # The config last merged, and the fields merged with it
+    _merged: list = attr.ib(factory=lambda: [None], init=False, eq=False, repr=False)
+
+    @_base_schema.default
+    def _freeze_schema(self):
+        schema = deepcopy(self.form_schema)
+        if "schema" in schema:
+            schema["schema"] = tuple(
+                MappingProxyType(schema_field) for schema_field in schema["schema"]
+            )
+        return MappingProxyType(schema)
+
+    _index: "_SchemaIndex" = attr.ib(init=False, eq=False, repr=False)
+
+    @_index.default
+    def _build_index(self):
+        return _SchemaIndex.build(self._base_schema.get("schema", ()))
 
     @classmethod
     def make_one(cls, config_file, form_schema):
@@ -91,46 +439,88 @@ class ConfigManager:
         If it doesn't exist, it will be created, on demand.
         The directory must exit.
         `schema` must be the schema definition as json. The syntax is described
-        in the documentation
+        in the documentation. Unknown type normalizers raise ValueError.
         """
         config_on_disk = ConfigOnDisk(config_file)
         return cls(config_on_disk, form_schema)
 
     def get_schema_with_config(self):
-        """Return the schema, together with already stored values, if they exist."""
-        extended_schema = deepcopy(self.form_schema)
+        """
+        Return the schema, together with already stored values, if they exist.
+
+        Fields are read-only views of the schema, with the stored value on
+        top. They get merged again only after the stored config changed.
+        """
+        return ChainMap(
+            {"schema": list(self._merged_fields().values())}, self._base_schema
+        )
+
+    def get_sections(self) -> List[str]:
+        """Return the names of the sections, in the order of the schema."""
+        return list(self._index.sections)
+
+    def get_section(self, name):
+        """
+        Return the fields of section `name`, like `get_schema_with_config`.
+
+        Costs the size of the section, not of the schema. Raises KeyError on
+        unknown sections.
+        """
+        keys = self._index.sections[name]
+        merged = self._merged_fields()
+        return [merged[key] for key in keys]
+
+    def _merged_fields(self):
+        """Return the merged fields by key, merged once per stored config."""
+        written_config = self.config_on_disk.config
+        merged = self._merged[0]
+        if merged is None or merged[0] is not written_config:
+            merged = (written_config, self._merge(written_config))
+            self._merged[0] = merged
+        return merged[1]
+
+    def _merge(self, written_config):
+        values = self._stored_values(written_config)
+        return {
+            key: ChainMap({"value": values[key]}, schema_field)
+            if key in values
+            else schema_field
+            for key, schema_field in self._index.by_key.items()
+        }
+
+    def _stored_values(self, written_config):
+        """Return the stored values by key, if they match the schema version."""
         try:
-            written_config = self.config_on_disk.config
-            written_values = {}
-            for written_schema_field in written_config["schema"]:
-                written_values[written_schema_field["key"]] = written_schema_field[
-                    "value"
-                ]
-
-            if written_config["version"] == self.form_schema["version"]:
-                for schema_field in extended_schema["schema"]:
-                    schema_field["value"] = written_values[schema_field["key"]]
+            if written_config["version"] != self.plan.version:
+                return {}
+            return {
+                written_schema_field["key"]: written_schema_field["value"]
+                for written_schema_field in written_config["schema"]
+            }
         except KeyError:
-            pass
-        return extended_schema
+            return {}
+
+    def get_values(self):
+        """Return the stored values by key, and the ETag of the stored config."""
+        written_config = self.config_on_disk.config
+        return self._stored_values(written_config), config_etag(written_config)
+
+    def patch_config(self, changes, if_match=None):
+        """
+        Change only the values of the keys in `changes`, a dict.
+
+        With `if_match`, a container of ETags, a config with another ETag
+        raises StaleConfigError. Returns values and ETag like `get_values`.
+        """
+
+        def change(written_config):
+            if if_match is not None and config_etag(written_config) not in if_match:
+                raise StaleConfigError()
+            return self.plan.apply_changes(self._stored_values(written_config), changes)
+
+        written_config = self.config_on_disk.update(change)
+        return self._stored_values(written_config), config_etag(written_config)
 
     def update_config(self, form):
         """Update the configuration. Form must be a flask.request.form instance."""
-        new_data = []
-        written_fields = set()
-        for schema_field in self.form_schema["schema"]:
-            written_fields.add(schema_field["key"])
-            new_data.append(
-                {
-                    "key": schema_field["key"],
-                    "value": getattr(self.normalizers, schema_field["type_normalizer"])(
-                        form[schema_field["key"]]
-                    ),
-                }
-            )
-        if set(form.keys()) - set(written_fields):
-            raise ValueError("Form contained unknown fields")
-        self.config_on_disk.config = {
-            "version": self.form_schema["version"],
-            "schema": new_data,
-        }
+        self.config_on_disk.config = self.plan.apply(form)
@@ -0,0 +1,184 @@
+"""
+Responsible for noticing changes of configuration files, also by other workers.
+
+A daemon thread waits for inotify events on the watched files and their
+directories, the directories see files replaced by a rename. Without
+inotify, it checks the files every few seconds. Either way, a file counts
+as changed when its inode, mtime or size changed, and its callback runs.
+
+Every round of changes increases a generation, so views can keep what
+they rendered from these files until the generation changes.
+"""
+import ctypes
+import errno
+import os
+import select
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import structlog
+
+from appliance_status.background import Background, start_thread
+
+# Seconds between two checks, without inotify
+POLL_INTERVAL = 2
+# Seconds to wait for events, before checking whether to stop
+INOTIFY_TIMEOUT = 1
+
+# Events of inotify(7) that can mean a changed file
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_FILE_EVENTS = (
+    _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_DELETE_SELF | _IN_MOVE_SELF
+)
+_DIRECTORY_EVENTS = _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+
+def _stat_key(path):
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+
+
+class _Inotify:
+    """The few calls of inotify(7) needed, through the C library."""
+
+    def __init__(self):
+        """Create an inotify instance, raise OSError if there is none."""
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            init = libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError("inotify is not available")
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask):
+        """Watch `path`, missing paths get ignored."""
+        if self._add_watch(self.fd, os.fsencode(path), mask) < 0:
+            error = ctypes.get_errno()
+            if error != errno.ENOENT:
+                raise OSError(error, os.strerror(error), path)
+
+    def wait(self, timeout):
+        """Return whether events arrived within `timeout`, and drop them."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        """Stop watching anything."""
+        os.close(self.fd)
+
+
+class FileWatcher:
+    """Implements all responsibilities of the module."""
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        """
+        Create a watcher without files.
+
+        Nothing gets watched until `start` gets called.
+        """
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._background = Background()
+        self._files: Dict[str, Tuple[Optional[tuple], List[Callable]]] = {}
+        self._generation = 0
+
+    def watch(self, path, callback):
+        """Call `callback` with `path` whenever the file at `path` changes."""
+        path = os.path.abspath(path)
+        with self._check_lock:
+            key, callbacks = self._files.get(path, (_stat_key(path), []))
+            self._files[path] = (key, callbacks + [callback])
+
+    def start(self):
+        """Start watching in a daemon thread, see `background`."""
+        self._background.start(lambda: start_thread(self._run, "file-watcher"))
+
+    def stop(self):
+        """Stop watching and wait until the thread is gone."""
+        self._background.stop()
+
+    def _run(self, stopping):
+        log = structlog.get_logger().bind(component="file-watcher")
+        try:
+            inotify = _Inotify()
+        except OSError:
+            log.warning("Could not use inotify, checking files regularly")
+            while not stopping.wait(self.poll_interval):
+                self._check(log)
+            return
+        try:
+            self._add_watches(inotify)
+            # Changes before the watches existed
+            self._check(log)
+            while not stopping.is_set():
+                if inotify.wait(INOTIFY_TIMEOUT):
+                    # Replaced files need a new watch
+                    self._add_watches(inotify)
+                    self._check(log)
+        finally:
+            inotify.close()
+
+    def _add_watches(self, inotify):
+        paths = list(self._files)
+        for directory in {os.path.dirname(path) for path in paths}:
+            inotify.add_watch(directory, _DIRECTORY_EVENTS)
+        for path in paths:
+            inotify.add_watch(path, _FILE_EVENTS)
+
+    def _check(self, log):
+        try:
+            self.check()
+        except Exception:
+            log.exception("Could not handle changed files")
+
+    def check(self):
+        """
+        Run the callbacks of files that changed since the last check.
+
+        Return whether any did. Checks run one at a time, the generation
+        increases after all callbacks ran.
+        """
+        with self._check_lock:
+            changed = []
+            for path, (key, callbacks) in self._files.items():
+                new_key = _stat_key(path)
+                if new_key != key:
+                    self._files[path] = (new_key, callbacks)
+                    changed.append((path, callbacks))
+            try:
+                for path, callbacks in changed:
+                    for callback in callbacks:
+                        callback(path)
+            finally:
+                if changed:
+                    with self._lock:
+                        self._generation += 1
+            return bool(changed)
+
+    def get_generation(self) -> Optional[int]:
+        """Return the generation of the files, None while not watching."""
+        with self._lock:
+            return self._generation if self._background.running else None
@@ -0,0 +1,201 @@
+"""
+Responsible for watching whether the default gateway responds, and how fast.
+
+Every few seconds, a probe on the process wide test loop connects to a TCP
+port of the gateway. An accepted as well as a refused connection is an
+answer. Many gateways silently drop TCP on that port, so at the same time
+the probe sends a DNS query over UDP to it, an answer or an ICMP port
+unreachable is an answer as well. Only without any answer within the
+timeout, the probe counts as lost. This needs no privileges, unlike ICMP
+echo. Probes without TCP answer get counted separately. The probe also
+reads the state of the ARP entry of the gateway from `/proc/net/arp`.
+
+The gateway gets looked up before every probe, so the monitor follows route
+changes. A new gateway starts with an empty history.
+"""
+import asyncio
+from time import monotonic, time
+from typing import Optional
+
+import structlog
+
+from appliance_status.background import Background, cancel_futures
+from appliance_status.history import ProbeHistory
+from appliance_status.test_manager import ATestManager
+
+# Seconds between two probes
+INTERVAL = 2
+# Seconds to wait for an answer
+TIMEOUT = 1
+# TCP port to connect to, DNS is open on most gateways
+PORT = 53
+# Number of probes the statistics cover
+HISTORY_SIZE = 150
+PROC_ARP = "/proc/net/arp"
+
+# DNS query for the name servers of the root zone, recursion desired
+_DNS_QUERY = b"\x12\x34\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x02\x00\x01"
+
+# Flags of /proc/net/arp
+_ATF_COM = 0x2
+_ATF_PERM = 0x4
+
+
+def read_arp_state(address):
+    """Return state and hardware address of the ARP entry of `address`."""
+    try:
+        with open(PROC_ARP) as file_:
+            # The first line holds the column names
+            lines = file_.read().splitlines()[1:]
+    except OSError:
+        return "unknown", None
+    for line in lines:
+        fields = line.split()
+        if fields[0] != address:
+            continue
+        flags = int(fields[2], 16)
+        if flags & _ATF_PERM:
+            return "permanent", fields[3]
+        if flags & _ATF_COM:
+            return "reachable", fields[3]
+        return "incomplete", None
+    return "missing", None
+
+
+async def measure_rtt(address, port=PORT, timeout=TIMEOUT) -> Optional[float]:
+    """Return the ms until `address` accepted or refused a connection, or None."""
+    started = monotonic()
+    try:
+        _reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(address, port), timeout
+        )
+    except ConnectionRefusedError:
+        pass
+    except (asyncio.TimeoutError, OSError):
+        return None
+    else:
+        writer.close()
+    return (monotonic() - started) * 1000
+
+
+class _AnswerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, answered):
+        self.answered = answered
+
+    def datagram_received(self, data, addr):
+        if not self.answered.done():
+            self.answered.set_result(None)
+
+    def error_received(self, exc):
+        # An ICMP port unreachable is an answer too
+        if isinstance(exc, ConnectionRefusedError) and not self.answered.done():
+            self.answered.set_result(None)
+
+
+async def measure_udp_rtt(address, port=PORT, timeout=TIMEOUT) -> Optional[float]:
+    """Return the ms until `address` answered or refused a DNS query, or None."""
+    loop = asyncio.get_running_loop()
+    answered = loop.create_future()
+    started = monotonic()
+    try:
+        transport, _protocol = await loop.create_datagram_endpoint(
+            lambda: _AnswerProtocol(answered), remote_addr=(address, port)
+        )
+    except OSError:
+        return None
+    try:
+        transport.sendto(_DNS_QUERY)
+        await asyncio.wait_for(answered, timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        transport.close()
+    return (monotonic() - started) * 1000
+
+
+class GatewayMonitor:
+    """Implements all responsibilities of the module."""
+
+    def __init__(self, get_default_route, interval=INTERVAL, port=PORT):
+        """
+        Create a monitor for the gateway `get_default_route` returns.
+
+        Nothing runs until `start` gets called.
+        """
+        self.get_default_route = get_default_route
+        self.interval = interval
+        self.port = port
+        self._background = Background()
+        self._route: Optional[dict] = None
+        self._arp = ("unknown", None)
+        self.history = ProbeHistory(HISTORY_SIZE)
+        # Whether and how fast the TCP connections got answered
+        self.tcp_history = ProbeHistory(HISTORY_SIZE)
+
+    def start(self):
+        """Start probing on the process wide test loop, see `background`."""
+        self._background.start(self._launch)
+
+    def _launch(self):
+        log = structlog.get_logger().bind(component="gateway-monitor")
+        return cancel_futures([ATestManager.submit(self._probe_forever(log))])
+
+    def stop(self):
+        """Stop probing and wait until it stopped."""
+        self._background.stop()
+
+    async def _probe_forever(self, log):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = monotonic()
+            try:
+                route = await loop.run_in_executor(None, self.get_default_route)
+            except Exception:
+                log.warning("No default route to probe", exc_info=True)
+            else:
+                await self.probe(route)
+            await asyncio.sleep(max(0.0, self.interval - (monotonic() - started)))
+
+    async def probe(self, route):
+        """Probe the gateway of `route` once."""
+        if self._route is None or self._route["GW"] != route["GW"]:
+            self.history = ProbeHistory(HISTORY_SIZE)
+            self.tcp_history = ProbeHistory(HISTORY_SIZE)
+        self._route = route
+        tcp_rtt, udp_rtt = await asyncio.gather(
+            measure_rtt(route["GW"], self.port), measure_udp_rtt(route["GW"], self.port)
+        )
+        rtt = udp_rtt if tcp_rtt is None else tcp_rtt
+        finished = time()
+        self.tcp_history.append(tcp_rtt is not None, tcp_rtt, finished)
+        self.history.append(rtt is not None, rtt, finished)
+        self._arp = await asyncio.get_running_loop().run_in_executor(
+            None, read_arp_state, route["GW"]
+        )
+
+    def get_status(self):
+        """
+        Return gateway, ARP state, loss and RTT percentiles, None before probing.
+
+        `no_tcp_answer` is the share of probes without a TCP answer, answered
+        over UDP or lost.
+        """
+        route, history, tcp_history = self._route, self.history, self.tcp_history
+        if route is None or not len(history):
+            return None
+        summary = history.summary()
+        tcp_pass_rate = tcp_history.pass_rate()
+        samples = history.samples()
+        arp_state, hardware_address = self._arp
+        return {
+            "gateway": route["GW"],
+            "interface": route["IF"],
+            "arp_state": arp_state,
+            "hardware_address": hardware_address,
+            "samples": summary["samples"],
+            "loss": 1 - summary["pass_rate"],
+            "no_tcp_answer": None if tcp_pass_rate is None else 1 - tcp_pass_rate,
+            "last_rtt_ms": samples[-1]["latency_ms"],
+            "p50_ms": summary["p50_ms"],
+            "p95_ms": summary["p95_ms"],
+        }
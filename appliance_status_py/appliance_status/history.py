@@ -0,0 +1,160 @@
+"""
+Responsible for keeping the history of test results.
+
+For every test, a ring buffer keeps whether the latest results passed and
+how long they took. Memory does not grow with uptime, the buffers hold plain
+numbers in arrays instead of result objects.
+"""
+from array import array
+from math import ceil, isnan, nan
+from typing import List, Optional
+
+# How many results of a test the history covers
+HISTORY_SIZE = 120
+# Bars of a sparkline, from fast to slow
+SPARKS = "▁▂▃▄▅▆▇█"
+
+
+def _percentile(ordered, percent):
+    """Return the nearest rank percentile of the sorted values."""
+    if not ordered:
+        return None
+    return ordered[max(0, ceil(len(ordered) * percent / 100) - 1)]
+
+
+class ProbeHistory:
+    """
+    Ring buffer of the latest `size` results of a test.
+
+    Appending is O(1), the pass rate is kept up to date on every append.
+    Latency percentiles sort at most `size` values.
+    """
+
+    __slots__ = (
+        "size",
+        "_finished",
+        "_latency",
+        "_passed",
+        "_next",
+        "_count",
+        "_passes",
+        "last_change",
+    )
+
+    def __init__(self, size=HISTORY_SIZE):
+        """Create an empty history."""
+        self.size = size
+        self._finished = array("d", bytes(8 * size))
+        self._latency = array("d", bytes(8 * size))
+        self._passed = array("b", bytes(size))
+        self._next = 0
+        self._count = 0
+        self._passes = 0
+        self.last_change: Optional[float] = None
+
+    def append(self, passed, latency_ms, finished):
+        """
+        Add a result, finished at unix time `finished`.
+
+        `latency_ms` may be None, for results without timing.
+        """
+        passed = int(bool(passed))
+        if self._count:
+            if self._passed[(self._next - 1) % self.size] != passed:
+                self.last_change = finished
+            if self._count == self.size:
+                self._passes -= self._passed[self._next]
+        self._finished[self._next] = finished
+        self._latency[self._next] = nan if latency_ms is None else latency_ms
+        self._passed[self._next] = passed
+        self._passes += passed
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def __len__(self):
+        """Tell how many results the history covers."""
+        return self._count
+
+    def _positions(self):
+        """Return the buffer positions, from the oldest to the latest result."""
+        start = (self._next - self._count) % self.size
+        return [(start + offset) % self.size for offset in range(self._count)]
+
+    def pass_rate(self):
+        """Return the share of passed results, None without any result."""
+        if not self._count:
+            return None
+        return self._passes / self._count
+
+    def percentiles(self, *percents):
+        """Return latency percentiles in ms, leaving out results without timing."""
+        ordered = sorted(
+            value
+            for value in (self._latency[position] for position in self._positions())
+            if not isnan(value)
+        )
+        return [_percentile(ordered, percent) for percent in percents]
+
+    def samples(self):
+        """Return finish time, pass and latency of every result, oldest first."""
+        return [
+            {
+                "finished": self._finished[position],
+                "passed": bool(self._passed[position]),
+                "latency_ms": (
+                    None if isnan(self._latency[position]) else self._latency[position]
+                ),
+            }
+            for position in self._positions()
+        ]
+
+    def sparkline(self):
+        """
+        Return a bar and whether the result passed, for every result.
+
+        Bars scale between the fastest and the slowest result. Results
+        without timing get the lowest bar.
+        """
+        latencies = [self._latency[position] for position in self._positions()]
+        timed = [value for value in latencies if not isnan(value)]
+        low = min(timed, default=0.0)
+        spread = max(timed, default=0.0) - low
+        line = []
+        for position, value in zip(self._positions(), latencies):
+            if isnan(value) or not spread:
+                bar = SPARKS[0]
+            else:
+                bar = SPARKS[round((value - low) / spread * (len(SPARKS) - 1))]
+            line.append((bar, bool(self._passed[position])))
+        return line
+
+    def summary(self):
+        """Return pass rate, percentiles and last change, ready for json."""
+        p50, p95 = self.percentiles(50, 95)
+        return {
+            "samples": len(self),
+            "pass_rate": self.pass_rate(),
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "last_change": self.last_change,
+        }
+
+
+class ProbeHistories:
+    """Implements all responsibilities of the module."""
+
+    def __init__(self, number_of_tests, size=HISTORY_SIZE):
+        """Create empty histories for `number_of_tests` tests."""
+        self._histories: List[ProbeHistory] = [
+            ProbeHistory(size) for _ in range(number_of_tests)
+        ]
+
+    def add(self, index, result, finished):
+        """Add a `result` of the test at `index`, finished at unix time."""
+        self._histories[index].append(
+            result.passed, getattr(result, "timings", {}).get("total"), finished
+        )
+
+    def get(self, index) -> ProbeHistory:
+        """Return the history of the test at `index`."""
+        return self._histories[index]
@@ -0,0 +1,110 @@
+"""
+Responsible for finding interfaces, without going through all of them.
+
+Hosts running containers can have thousands of virtual interfaces. An index
+over the output of `network.get_network_information` finds interfaces by
+name, by kind, by being the default interface and by address family, and
+returns them page by page.
+"""
+from typing import Dict, List, Optional
+
+import attr
+
+# Kinds of interfaces to show. `main` are physical and default interfaces.
+KINDS = ("main", "physical", "virtual", "all")
+FAMILIES = ("inet", "inet6")
+PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+
+@attr.s(frozen=True)
+class InterfacePage:
+    """A page of interfaces, together with the number of matching ones."""
+
+    interfaces: List[dict] = attr.ib()
+    total: int = attr.ib()
+    page: int = attr.ib()
+    per_page: int = attr.ib()
+
+    @property
+    def pages(self):
+        """Tell how many pages the matching interfaces fill, at least one."""
+        return max(1, -(-self.total // self.per_page))
+
+
+class InterfaceIndex:
+    """
+    Implements all responsibilities of the module.
+
+    Selections map positions of interfaces to None. They keep the order of
+    the interfaces and tell in O(1), whether they contain an interface.
+    """
+
+    def __init__(self, interfaces):
+        """Index `interfaces`, as returned by `get_network_information`."""
+        self.interfaces = interfaces
+        self.by_name: Dict[str, int] = {}
+        self.by_kind: Dict[str, Dict[int, None]] = {kind: {} for kind in KINDS}
+        self.default: Dict[int, None] = {}
+        self.by_family: Dict[str, Dict[int, None]] = {family: {} for family in FAMILIES}
+        for position, entry in enumerate(interfaces):
+            self.by_name[entry["ifname"]] = position
+            self.by_kind["all"][position] = None
+            kind = "physical" if entry["is_physical"] else "virtual"
+            self.by_kind[kind][position] = None
+            if entry["is_physical"] or entry["default"]:
+                self.by_kind["main"][position] = None
+            if entry["default"]:
+                self.default[position] = None
+            for addr_info in entry["addr_info"]:
+                self.by_family.setdefault(addr_info["family"], {})[position] = None
+
+    def query(
+        self,
+        names=(),
+        kind="main",
+        default=False,
+        family: Optional[str] = None,
+        page=1,
+        per_page=PER_PAGE,
+    ) -> InterfacePage:
+        """
+        Return a page of the interfaces matching all given filters.
+
+        Interfaces keep the order of the index. Raises ValueError on unknown
+        kinds and families, and on pages out of range.
+        """
+        if kind not in KINDS:
+            raise ValueError("Unknown kind of interface: {}".format(kind))
+        if family is not None and family not in self.by_family:
+            raise ValueError("Unknown address family: {}".format(family))
+        if page < 1 or not 1 <= per_page <= MAX_PER_PAGE:
+            raise ValueError("Page out of range")
+        selections = [self.by_kind[kind]]
+        if names:
+            selections.append(
+                dict.fromkeys(
+                    sorted(self.by_name[name] for name in names if name in self.by_name)
+                )
+            )
+        if default:
+            selections.append(self.default)
+        if family is not None:
+            selections.append(self.by_family[family])
+        # Go through the shortest selection, look up the others
+        selections.sort(key=len)
+        positions = [
+            position
+            for position in selections[0]
+            if all(position in other for other in selections[1:])
+        ]
+        start = (page - 1) * per_page
+        return InterfacePage(
+            [
+                self.interfaces[position]
+                for position in positions[start : start + per_page]
+            ],
+            len(positions),
+            page,
+            per_page,
+        )
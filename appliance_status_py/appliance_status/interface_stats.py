@@ -0,0 +1,162 @@
+"""
+Responsible for sampling traffic and error counters of interfaces.
+
+A daemon thread reads the counters of all interfaces every few seconds and
+keeps the differences between samples in a short ring buffer per interface.
+Pages show the rates of the latest sample and the average over the buffer.
+
+The counters are those of `/sys/class/net/*/statistics`. They get read
+from `/proc/net/dev`, which holds them for all interfaces in a single file,
+instead of opening eight files per interface.
+"""
+import os
+import threading
+from collections import deque
+from time import monotonic
+from typing import Deque, Dict, Optional, Tuple
+
+import structlog
+
+from appliance_status.background import Background, start_thread
+
+COUNTERS = (
+    "rx_bytes",
+    "rx_packets",
+    "rx_errors",
+    "rx_dropped",
+    "tx_bytes",
+    "tx_packets",
+    "tx_errors",
+    "tx_dropped",
+)
+# Seconds between two samples
+SAMPLE_INTERVAL = 5
+# Number of differences kept per interface
+WINDOW = 12
+PROC_NET_DEV = "/proc/net/dev"
+SYSFS_NET = "/sys/class/net"
+
+# Columns of /proc/net/dev holding the COUNTERS
+_PROC_COLUMNS = (0, 1, 2, 3, 8, 9, 10, 11)
+
+
+def _read_proc_net_dev():
+    with open(PROC_NET_DEV) as file_:
+        # The first two lines hold the column names
+        lines = file_.read().splitlines()[2:]
+    counters = {}
+    for line in lines:
+        name, _, values = line.partition(":")
+        values = values.split()
+        counters[name.strip()] = tuple(int(values[column]) for column in _PROC_COLUMNS)
+    return counters
+
+
+def _read_sysfs_statistics():
+    counters = {}
+    for name in os.listdir(SYSFS_NET):
+        path = os.path.join(SYSFS_NET, name, "statistics")
+        try:
+            values = []
+            for counter in COUNTERS:
+                with open(os.path.join(path, counter)) as file_:
+                    values.append(int(file_.read()))
+        except OSError:
+            # The interface is gone already
+            continue
+        counters[name] = tuple(values)
+    return counters
+
+
+def read_counters() -> Dict[str, Tuple[int, ...]]:
+    """Return the COUNTERS of every interface, by interface name."""
+    try:
+        return _read_proc_net_dev()
+    except FileNotFoundError:
+        return _read_sysfs_statistics()
+
+
+def _rates(seconds, deltas):
+    return {counter: delta / seconds for counter, delta in zip(COUNTERS, deltas)}
+
+
+class InterfaceStats:
+    """Implements all responsibilities of the module."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL, window=WINDOW):
+        """
+        Create a sampler without samples.
+
+        Nothing gets sampled until `start` gets called.
+        """
+        self.interval = interval
+        self.window = window
+        self._lock = threading.Lock()
+        self._background = Background()
+        self._previous: Optional[Tuple[float, Dict[str, Tuple[int, ...]]]] = None
+        self._deltas: Dict[str, Deque[Tuple[float, Tuple[int, ...]]]] = {}
+
+    def start(self):
+        """Start sampling in a daemon thread, see `background`."""
+        self._background.start(lambda: start_thread(self._run, "interface-stats"))
+
+    def stop(self):
+        """Stop sampling and wait until the thread is gone."""
+        self._background.stop()
+
+    def _run(self, stopping):
+        log = structlog.get_logger().bind(component="interface-stats")
+        while True:
+            try:
+                self.sample()
+            except OSError:
+                log.warning("Could not read interface counters", exc_info=True)
+            if stopping.wait(self.interval):
+                return
+
+    def sample(self):
+        """Read the counters and keep the differences to the previous sample."""
+        counters = read_counters()
+        now = monotonic()
+        with self._lock:
+            previous, self._previous = self._previous, (now, counters)
+            if previous is None:
+                return
+            seconds = now - previous[0]
+            if seconds <= 0:
+                return
+            for name in self._deltas.keys() - counters.keys():
+                del self._deltas[name]
+            for name, values in counters.items():
+                old = previous[1].get(name)
+                if old is None:
+                    continue
+                deltas = tuple(new - old for new, old in zip(values, old))
+                if min(deltas) < 0:
+                    # Counters got reset, the interface was created anew
+                    continue
+                self._deltas.setdefault(name, deque(maxlen=self.window)).append(
+                    (seconds, deltas)
+                )
+
+    def get_rates(self, names):
+        """
+        Return current and average rates per second of the interfaces `names`.
+
+        Interfaces without two samples yet are left out.
+        """
+        rates = {}
+        with self._lock:
+            for name in names:
+                deltas = self._deltas.get(name)
+                if not deltas:
+                    continue
+                seconds, latest = deltas[-1]
+                rates[name] = {
+                    "current": _rates(seconds, latest),
+                    "average": _rates(
+                        sum(seconds for seconds, _ in deltas),
+                        [sum(column) for column in zip(*(d for _, d in deltas))],
+                    ),
+                }
+        return rates
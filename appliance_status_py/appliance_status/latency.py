@@ -0,0 +1,77 @@
+"""
+Responsible for keeping latency statistics of tests.
+
+For every test, a rolling histogram per phase covers the timings of the
+latest results.
+"""
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, List
+
+from appliance_status.test_types import PHASES
+
+# Upper bounds of the histogram buckets in milliseconds, the last one is open
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+# How many results of a test the histograms cover
+WINDOW = 100
+
+
+class RollingHistogram:
+    """
+    Histogram over the latest `window` samples.
+
+    Adding a sample and dropping the oldest one are O(1), the bucket counts
+    are always up to date.
+    """
+
+    def __init__(self, window=WINDOW, bounds=BUCKET_BOUNDS_MS):
+        """Create an empty histogram."""
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self._buckets: deque = deque(maxlen=window)
+
+    def add(self, value_ms):
+        """Add a sample in milliseconds."""
+        if len(self._buckets) == self._buckets.maxlen:
+            self.counts[self._buckets[0]] -= 1
+        bucket = bisect_left(self.bounds, value_ms)
+        self._buckets.append(bucket)
+        self.counts[bucket] += 1
+
+    def __len__(self):
+        """Tell how many samples the histogram covers."""
+        return len(self._buckets)
+
+    def as_dict(self):
+        """Return bucket bounds and counts, ready to be serialized to json."""
+        return {
+            "le_ms": list(self.bounds) + [None],
+            "counts": list(self.counts),
+            "samples": len(self),
+        }
+
+
+class LatencyHistograms:
+    """Implements all responsibilities of the module."""
+
+    def __init__(self, number_of_tests, window=WINDOW):
+        """Create empty histograms for `number_of_tests` tests."""
+        self._histograms: List[Dict[str, RollingHistogram]] = [
+            {phase: RollingHistogram(window) for phase in PHASES}
+            for _ in range(number_of_tests)
+        ]
+
+    def add(self, index, timings):
+        """Add the `timings` of a result of the test at `index`."""
+        histograms = self._histograms[index]
+        for phase, value_ms in timings.items():
+            if phase in histograms:
+                histograms[phase].add(value_ms)
+
+    def get(self, index):
+        """Return the histograms of the test at `index`, for phases with samples."""
+        return {
+            phase: histogram.as_dict()
+            for phase, histogram in self._histograms[index].items()
+            if len(histogram)
+        }
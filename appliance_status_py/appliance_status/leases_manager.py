@@ -1,9 +1,91 @@
-"""Responsible for accessing leases."""
-from typing import List
+"""
+Responsible for accessing leases.
+
+systemd-networkd writes one lease per interface, into a file named after
+the index of the interface, as lines of `KEY=VALUE`. Leases get parsed
+into records. Files only get read again, when their inode, mtime or size
+changed.
+"""
+from typing import Dict, List, Optional, Tuple
 import os
+import socket
+import threading
 import attr
 
 
+def _seconds(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@attr.s(frozen=True)
+class Lease:
+    """A DHCP lease of systemd-networkd. Lifetimes are in seconds."""
+
+    ifindex: Optional[int] = attr.ib()
+    acquired: float = attr.ib()
+    address: Optional[str] = attr.ib()
+    netmask: Optional[str] = attr.ib()
+    routers: Tuple[str, ...] = attr.ib()
+    dns: Tuple[str, ...] = attr.ib()
+    ntp: Tuple[str, ...] = attr.ib()
+    server_address: Optional[str] = attr.ib()
+    domain_name: Optional[str] = attr.ib()
+    lifetime: Optional[int] = attr.ib()
+    t1: Optional[int] = attr.ib()
+    t2: Optional[int] = attr.ib()
+    values: Dict[str, str] = attr.ib()
+
+    @property
+    def expires(self) -> Optional[float]:
+        """Tell when the lease expires, as unix time, None if unknown."""
+        if self.lifetime is None:
+            return None
+        return self.acquired + self.lifetime
+
+
+def parse_lease(text, ifindex=None, acquired=0.0) -> Lease:
+    """
+    Parse the lease file contents `text`.
+
+    Comments, empty lines and lines without `=` get skipped, unknown keys
+    are kept in `values`. `acquired` is the unix time the lease got written.
+    """
+    values = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        key, separator, value = line.partition("=")
+        if separator:
+            values[key.strip()] = value.strip()
+    return Lease(
+        ifindex=ifindex,
+        acquired=acquired,
+        address=values.get("ADDRESS"),
+        netmask=values.get("NETMASK"),
+        routers=tuple(values.get("ROUTER", "").split()),
+        dns=tuple(values.get("DNS", "").split()),
+        ntp=tuple(values.get("NTP", "").split()),
+        server_address=values.get("SERVER_ADDRESS"),
+        domain_name=values.get("DOMAINNAME"),
+        lifetime=_seconds(values.get("LIFETIME")),
+        t1=_seconds(values.get("T1")),
+        t2=_seconds(values.get("T2")),
+        values=values,
+    )
+
+
+def interface_name(ifindex) -> Optional[str]:
+    """Return the name of the interface with index `ifindex`, None if unknown."""
+    try:
+        return socket.if_indextoname(ifindex)
+    except OSError:
+        return None
+
+
 @attr.s(frozen=True)
 class LeasesManager:
     """
@@ -14,6 +96,47 @@ class LeasesManager:
     """
 
     leases_directory: str = attr.ib(validator=attr.validators.matches_re(r"^(/|[A-Z]:).*"))
+    # By file name: inode, mtime and size, the contents, and the lease
+    _cache: Dict[str, Tuple[tuple, str, Lease]] = attr.ib(
+        factory=dict, init=False, eq=False, repr=False
+    )
+    _lock: threading.Lock = attr.ib(
+        factory=threading.Lock, init=False, eq=False, repr=False
+    )
+
+    def _read(self) -> List[Tuple[str, str, Lease]]:
+        """Return name, contents and lease of every file, reading changed ones."""
+        try:
+            entries = sorted(os.scandir(self.leases_directory), key=lambda e: e.name)
+        except FileNotFoundError:
+            entries = []
+        files = []
+        with self._lock:
+            cache = {}
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    cache[entry.name] = self._read_file(entry)
+                except FileNotFoundError:
+                    # The lease got removed, while reading the directory
+                    continue
+                _key, text, lease = cache[entry.name]
+                files.append((entry.name, text, lease))
+            self._cache.clear()
+            self._cache.update(cache)
+        return files
+
+    def _read_file(self, entry):
+        stat_result = entry.stat()
+        key = (stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size)
+        cached = self._cache.get(entry.name)
+        if cached is not None and cached[0] == key:
+            return cached
+        with open(entry.path) as file_:
+            text = file_.read()
+        ifindex = int(entry.name) if entry.name.isdigit() else None
+        return key, text, parse_lease(text, ifindex, stat_result.st_mtime)
 
     def get_leases(self) -> List[str]:
         """
@@ -21,12 +144,24 @@ class LeasesManager:
 
         provide an absolute path to the `leases_directory`
         """
-        leases = []
-        try:
-            for filename in os.listdir(self.leases_directory):
-                file_with_path = os.path.join(self.leases_directory, filename)
-                if os.path.isfile(file_with_path):
-                    leases.append(open(file_with_path).read())
-        except FileNotFoundError:
-            pass
-        return leases
+        return self.get_leases_and_records()[0]
+
+    def get_lease_records(self) -> Dict[int, Lease]:
+        """
+        Return the parsed leases by interface index.
+
+        Files not named after an interface index are left out.
+        """
+        return self.get_leases_and_records()[1]
+
+    def get_leases_and_records(self) -> Tuple[List[str], Dict[int, Lease]]:
+        """Return what `get_leases` and `get_lease_records` do, reading once."""
+        files = self._read()
+        return (
+            [text for _name, text, _lease in files],
+            {
+                lease.ifindex: lease
+                for _name, _text, lease in files
+                if lease.ifindex is not None
+            },
+        )
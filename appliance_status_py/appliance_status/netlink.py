@@ -0,0 +1,370 @@
+"""
+Responsible for reading interfaces, addresses and routes over rtnetlink.
+
+The kernel answers dump requests on a netlink socket with the same data
+`ip` prints, without forking a program. Results use the structure of
+`ip --json addr`, limited to the keys this application needs.
+Reading fails with an OSError, if netlink is not available.
+
+A subscribed socket receives every change of links, addresses and routes,
+so that a copy of the state can be kept up to date without reading it again.
+"""
+import os
+import socket
+import struct
+from collections import namedtuple
+from itertools import count
+
+NETLINK_ROUTE = 0
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+
+IFLA_ADDRESS = 1
+IFLA_BROADCAST = 2
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_OPERSTATE = 16
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_BROADCAST = 4
+IFA_CACHEINFO = 6
+IFA_FLAGS = 8
+IFA_F_PERMANENT = 0x80
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_TABLE = 15
+RT_TABLE_MAIN = 254
+RTN_UNICAST = 1
+
+_NLMSGHDR = struct.Struct("=LHHLL")
+_IFINFOMSG = struct.Struct("=BxHiII")
+_IFADDRMSG = struct.Struct("=BBBBI")
+_RTMSG = struct.Struct("=BBBBBBBBI")
+_RTATTR = struct.Struct("=HH")
+_U32 = struct.Struct("=L")
+_CACHEINFO = struct.Struct("=LLLL")
+
+# Interface flags, in the order `ip` prints them
+_IFF_NAMES = (
+    (0x8, "LOOPBACK"),
+    (0x2, "BROADCAST"),
+    (0x10, "POINTOPOINT"),
+    (0x1000, "MULTICAST"),
+    (0x80, "NOARP"),
+    (0x200, "ALLMULTI"),
+    (0x100, "PROMISC"),
+    (0x20, "NOTRAILERS"),
+    (0x4, "DEBUG"),
+    (0x8000, "DYNAMIC"),
+    (0x4000, "AUTOMEDIA"),
+    (0x2000, "PORTSEL"),
+    (0x400, "MASTER"),
+    (0x800, "SLAVE"),
+    (0x1, "UP"),
+    (0x10000, "LOWER_UP"),
+    (0x20000, "DORMANT"),
+    (0x40000, "ECHO"),
+)
+_IFF_UP = 0x1
+_IFF_RUNNING = 0x40
+_OPERSTATES = (
+    "UNKNOWN",
+    "NOTPRESENT",
+    "DOWN",
+    "LOWERLAYERDOWN",
+    "TESTING",
+    "DORMANT",
+    "UP",
+)
+_SCOPES = {0: "global", 200: "site", 253: "link", 254: "host", 255: "nowhere"}
+_FAMILIES = {socket.AF_INET: "inet", socket.AF_INET6: "inet6"}
+# Seconds to wait for the kernel
+TIMEOUT = 2
+
+_sequence = count(1)
+
+# A change reported by the kernel. `kind` is link, address or route, `data`
+# the entry or addr_info the change is about, None for routes.
+Event = namedtuple("Event", "kind deleted index data")
+
+
+def flag_names(flags):
+    """Return the names of interface `flags` the way `ip` prints them."""
+    names = ["NO-CARRIER"] if flags & _IFF_UP and not flags & _IFF_RUNNING else []
+    names.extend(name for flag, name in _IFF_NAMES if flags & flag)
+    return names
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _attributes(data, offset):
+    """Return the rtattr attributes from `offset` on, as a dict by type."""
+    attributes = {}
+    while offset + _RTATTR.size <= len(data):
+        length, type_ = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attributes[type_] = data[offset + _RTATTR.size : offset + length]
+        offset += _align(length)
+    return attributes
+
+
+def _string(value):
+    return value.rstrip(b"\0").decode("utf-8", "replace")
+
+
+def _mac(value):
+    return ":".join("{:02x}".format(byte) for byte in value)
+
+
+def _dump(sock, message_type, family_header):
+    """Send a dump request, return type and payload of every answer."""
+    sequence = next(_sequence) & 0xFFFFFFFF
+    sock.send(
+        _NLMSGHDR.pack(
+            _NLMSGHDR.size + len(family_header),
+            message_type,
+            NLM_F_REQUEST | NLM_F_DUMP,
+            sequence,
+            0,
+        )
+        + family_header
+    )
+    messages = []
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            raise OSError("Netlink socket closed unexpectedly")
+        offset = 0
+        while offset + _NLMSGHDR.size <= len(data):
+            length, type_, _flags, message_sequence, _pid = _NLMSGHDR.unpack_from(
+                data, offset
+            )
+            if length < _NLMSGHDR.size:
+                raise OSError("Malformed netlink message")
+            payload = data[offset + _NLMSGHDR.size : offset + length]
+            offset += _align(length)
+            if message_sequence != sequence:
+                continue
+            if type_ == NLMSG_DONE:
+                return messages
+            if type_ == NLMSG_ERROR:
+                (error,) = struct.unpack_from("=i", payload)
+                if error:
+                    raise OSError(-error, os.strerror(-error))
+                continue
+            messages.append((type_, payload))
+
+
+def _open():
+    sock = socket.socket(
+        socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_CLOEXEC, NETLINK_ROUTE
+    )
+    try:
+        sock.settimeout(TIMEOUT)
+        sock.bind((0, 0))
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def _parse_link(payload):
+    _family, _type, index, flags, _change = _IFINFOMSG.unpack_from(payload)
+    attributes = _attributes(payload, _IFINFOMSG.size)
+    entry = {"ifindex": index, "ifname": _string(attributes.get(IFLA_IFNAME, b""))}
+    entry["flags"] = flag_names(flags)
+    if IFLA_MTU in attributes:
+        (entry["mtu"],) = _U32.unpack(attributes[IFLA_MTU][:4])
+    if IFLA_OPERSTATE in attributes:
+        operstate = attributes[IFLA_OPERSTATE][0]
+        entry["operstate"] = (
+            _OPERSTATES[operstate] if operstate < len(_OPERSTATES) else "UNKNOWN"
+        )
+    if IFLA_ADDRESS in attributes:
+        entry["address"] = _mac(attributes[IFLA_ADDRESS])
+    if IFLA_BROADCAST in attributes:
+        entry["broadcast"] = _mac(attributes[IFLA_BROADCAST])
+    entry["addr_info"] = []
+    return entry
+
+
+def _parse_address(payload):
+    family, prefixlen, flags, scope, index = _IFADDRMSG.unpack_from(payload)
+    if family not in _FAMILIES:
+        return None, None
+    attributes = _attributes(payload, _IFADDRMSG.size)
+    if IFA_FLAGS in attributes:
+        (flags,) = _U32.unpack(attributes[IFA_FLAGS][:4])
+    local = attributes.get(IFA_LOCAL, attributes.get(IFA_ADDRESS))
+    if local is None:
+        return None, None
+    addr_info = {
+        "family": _FAMILIES[family],
+        "local": socket.inet_ntop(family, local),
+        "prefixlen": prefixlen,
+    }
+    if IFA_BROADCAST in attributes:
+        addr_info["broadcast"] = socket.inet_ntop(family, attributes[IFA_BROADCAST])
+    addr_info["scope"] = _SCOPES.get(scope, str(scope))
+    if not flags & IFA_F_PERMANENT:
+        addr_info["dynamic"] = True
+    if IFA_LABEL in attributes:
+        addr_info["label"] = _string(attributes[IFA_LABEL])
+    if IFA_CACHEINFO in attributes:
+        preferred, valid, _created, _updated = _CACHEINFO.unpack(
+            attributes[IFA_CACHEINFO][:16]
+        )
+        addr_info["valid_life_time"] = valid
+        addr_info["preferred_life_time"] = preferred
+    return index, addr_info
+
+
+def get_interfaces():
+    """Return all interfaces with their addresses, like `ip --json addr`."""
+    with _open() as sock:
+        links = _dump(sock, RTM_GETLINK, _IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0))
+        addresses = _dump(
+            sock, RTM_GETADDR, _IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        )
+    interfaces = {}
+    for type_, payload in links:
+        if type_ == RTM_NEWLINK:
+            entry = _parse_link(payload)
+            interfaces[entry["ifindex"]] = entry
+    for type_, payload in addresses:
+        if type_ == RTM_NEWADDR:
+            index, addr_info = _parse_address(payload)
+            if index in interfaces:
+                interfaces[index]["addr_info"].append(addr_info)
+    return [interfaces[index] for index in sorted(interfaces)]
+
+
+def _default_route(payload):
+    """Return metric, gateway and interface index of a default route, or None."""
+    (
+        _family,
+        dst_len,
+        _src_len,
+        _tos,
+        table,
+        _protocol,
+        _scope,
+        kind,
+        _flags,
+    ) = _RTMSG.unpack_from(payload)
+    attributes = _attributes(payload, _RTMSG.size)
+    if RTA_TABLE in attributes:
+        (table,) = _U32.unpack(attributes[RTA_TABLE][:4])
+    if (
+        dst_len
+        or table != RT_TABLE_MAIN
+        or kind != RTN_UNICAST
+        or RTA_GATEWAY not in attributes
+        or RTA_OIF not in attributes
+    ):
+        return None
+    (priority,) = _U32.unpack(attributes.get(RTA_PRIORITY, bytes(4))[:4])
+    (oif,) = _U32.unpack(attributes[RTA_OIF][:4])
+    return priority, attributes[RTA_GATEWAY], oif
+
+
+def get_default_route():
+    """
+    Return gateway and interface of the IPv4 default route.
+
+    With several default routes, the one with the lowest metric wins.
+    """
+    with _open() as sock:
+        routes = _dump(
+            sock, RTM_GETROUTE, _RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0)
+        )
+    best = None
+    for type_, payload in routes:
+        if type_ == RTM_NEWROUTE:
+            route = _default_route(payload)
+            if route is not None and (best is None or route[0] < best[0]):
+                best = route
+    if best is None:
+        raise Exception("No default route")
+    _priority, gateway, oif = best
+    return {
+        "GW": socket.inet_ntop(socket.AF_INET, gateway),
+        "IF": socket.if_indextoname(oif),
+    }
+
+
+def subscribe(timeout=None):
+    """
+    Return a socket receiving changes of links, addresses and IPv4 routes.
+
+    Subscribe before reading the current state, so that no change between
+    reading and subscribing gets lost.
+    """
+    sock = socket.socket(
+        socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_CLOEXEC, NETLINK_ROUTE
+    )
+    try:
+        sock.settimeout(timeout)
+        sock.bind(
+            (
+                0,
+                RTMGRP_LINK
+                | RTMGRP_IPV4_IFADDR
+                | RTMGRP_IPV4_ROUTE
+                | RTMGRP_IPV6_IFADDR,
+            )
+        )
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def read_events(sock):
+    """
+    Wait for changes on a `subscribe` socket, return them as events.
+
+    Raises an OSError with errno ENOBUFS, if the kernel had to drop changes.
+    The state needs to be read again then.
+    """
+    data = sock.recv(65536)
+    events = []
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, type_, _flags, _sequence, _pid = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            raise OSError("Malformed netlink message")
+        payload = data[offset + _NLMSGHDR.size : offset + length]
+        offset += _align(length)
+        if type_ in (RTM_NEWLINK, RTM_DELLINK):
+            entry = _parse_link(payload)
+            events.append(Event("link", type_ == RTM_DELLINK, entry["ifindex"], entry))
+        elif type_ in (RTM_NEWADDR, RTM_DELADDR):
+            index, addr_info = _parse_address(payload)
+            if addr_info is not None:
+                events.append(Event("address", type_ == RTM_DELADDR, index, addr_info))
+        elif type_ in (RTM_NEWROUTE, RTM_DELROUTE):
+            if _default_route(payload) is not None:
+                events.append(Event("route", type_ == RTM_DELROUTE, None, None))
+    return events
@@ -1,7 +1,33 @@
-"""Responsible for extracting all required information about networks."""
+"""
+Responsible for extracting all required information about networks.
+
+Information comes from the kernel over rtnetlink. Without netlink, it gets
+read from `/sys/class/net` and `/proc/net`, and as a last resort from the
+output of the `ip` command.
+"""
+import copy
+import fcntl
 import json
+import os
 import re
+import socket
+import struct
 import subprocess
+import threading
+from time import monotonic
+from typing import Dict, Optional, Tuple
+
+import structlog
+
+from appliance_status import netlink
+
+SYSFS_NET = "/sys/class/net"
+PROC_ROUTE = "/proc/net/route"
+PROC_IF_INET6 = "/proc/net/if_inet6"
+# Seconds all `ip` commands together may take
+IP_DEADLINE = 2
+# Seconds the results of the `ip` commands answer further calls
+IP_REUSE = 1
 
 
 def _prefix_to_netmask(prefix):
@@ -23,49 +49,350 @@ def _is_physical_address_name(name):
     return bool(__physical_re.match(name))
 
 
+# Per prefix length, computed once: IPv4 netmasks as number and as text,
+# IPv6 masks, and how many addresses of a network can be given to hosts.
+# Like `ipaddress`, /31, /32, /127 and /128 networks consist of hosts only.
+_IPV4_MASKS = tuple((2 ** 32 - 1) ^ (2 ** (32 - prefix) - 1) for prefix in range(33))
+_IPV4_NETMASKS = ("0.0.0.0",) + tuple(
+    _prefix_to_netmask(prefix) for prefix in range(1, 33)
+)
+_IPV4_HOSTS = tuple(
+    2 ** (32 - prefix) - 2 if prefix < 31 else 2 ** (32 - prefix)
+    for prefix in range(33)
+)
+_IPV6_MASKS = tuple(
+    (2 ** 128 - 1) ^ (2 ** (128 - prefix) - 1) for prefix in range(129)
+)
+_IPV6_HOSTS = tuple(
+    2 ** (128 - prefix) - 1 if prefix < 127 else 2 ** (128 - prefix)
+    for prefix in range(129)
+)
+_IPV4 = struct.Struct("!L")
+
+
+def _add_address_details(addresses):
+    """
+    Add netmask, network, broadcast and number of hosts to `addresses`.
+
+    All addresses get handled in one pass, with table lookups instead of
+    computing masks per address. IPv6 has no netmask and no broadcast,
+    its networks are shown with their prefix length.
+    """
+    inet_aton, inet_ntoa = socket.inet_aton, socket.inet_ntoa
+    inet_pton, inet_ntop = socket.inet_pton, socket.inet_ntop
+    for addr_info in addresses:
+        family, prefixlen = addr_info["family"], addr_info["prefixlen"]
+        local = addr_info.get("local")
+        if family == "inet":
+            addr_info["netmask"] = _IPV4_NETMASKS[prefixlen]
+            if local is None:
+                continue
+            mask = _IPV4_MASKS[prefixlen]
+            network = _IPV4.unpack(inet_aton(local))[0] & mask
+            addr_info["network"] = inet_ntoa(_IPV4.pack(network))
+            # Keep a broadcast address configured on the interface
+            addr_info.setdefault(
+                "broadcast", inet_ntoa(_IPV4.pack(network | (mask ^ 0xFFFFFFFF)))
+            )
+            addr_info["hosts"] = _IPV4_HOSTS[prefixlen]
+        elif family == "inet6" and local is not None:
+            network = (
+                int.from_bytes(inet_pton(socket.AF_INET6, local), "big")
+                & _IPV6_MASKS[prefixlen]
+            )
+            addr_info["network"] = inet_ntop(
+                socket.AF_INET6, network.to_bytes(16, "big")
+            )
+            addr_info["hosts"] = _IPV6_HOSTS[prefixlen]
+
+
+def add_details(interfaces, default_if):
+    """
+    Mark the default and physical interfaces, add details to addresses.
+
+    Details of the addresses of all interfaces get computed in one batch.
+    """
+    addresses = []
+    for entry in interfaces:
+        entry["default"] = entry["ifname"] == default_if
+        entry["is_physical"] = _is_physical_address_name(entry["ifname"])
+        addresses.extend(entry["addr_info"])
+    _add_address_details(addresses)
+    return interfaces
+
+
+def _read(path):
+    with open(path) as file_:
+        return file_.read().strip()
+
+
+# ioctls returning the primary IPv4 address and netmask of an interface
+_SIOCGIFADDR = 0x8915
+_SIOCGIFNETMASK = 0x891B
+# Scopes of /proc/net/if_inet6, by the scope names of `ip`
+_INET6_SCOPES = {0x00: "global", 0x10: "host", 0x20: "link", 0x40: "site"}
+_IFA_F_PERMANENT = 0x80
+_IFF_RUNNING = 0x40
+_IFF_LOWER_UP = 0x10000
+
+
+def _sysfs_flags(path):
+    """Return the interface flags, with the operational flags `ip` shows."""
+    flags = int(_read(os.path.join(path, "flags")), 16)
+    try:
+        carrier = _read(os.path.join(path, "carrier")) == "1"
+    except OSError:
+        # Interfaces that are down have no carrier to read
+        carrier = False
+    if carrier:
+        flags |= _IFF_RUNNING | _IFF_LOWER_UP
+    return flags
+
+
+def _ioctl_ipv4(sock, name):
+    """Return the primary IPv4 address and prefix length of interface `name`."""
+    request = struct.pack("256s", name.encode()[:15])
+    try:
+        address = fcntl.ioctl(sock.fileno(), _SIOCGIFADDR, request)[20:24]
+        netmask = fcntl.ioctl(sock.fileno(), _SIOCGIFNETMASK, request)[20:24]
+    except OSError:
+        # No IPv4 address on this interface
+        return None
+    prefixlen = bin(int.from_bytes(netmask, "big")).count("1")
+    return socket.inet_ntoa(address), prefixlen
+
+
+def _proc_ipv6_addresses():
+    addresses = {}
+    try:
+        with open(PROC_IF_INET6) as file_:
+            lines = file_.read().splitlines()
+    except FileNotFoundError:
+        # Kernel without IPv6
+        return addresses
+    for line in lines:
+        address, _index, prefixlen, scope, flags, name = line.split()
+        addr_info = {
+            "family": "inet6",
+            "local": socket.inet_ntop(socket.AF_INET6, bytes.fromhex(address)),
+            "prefixlen": int(prefixlen, 16),
+            "scope": _INET6_SCOPES.get(int(scope, 16), "global"),
+        }
+        if not int(flags, 16) & _IFA_F_PERMANENT:
+            addr_info["dynamic"] = True
+        addresses.setdefault(name, []).append(addr_info)
+    return addresses
+
+
+def _sysfs_get_interfaces():
+    """
+    Return all interfaces with their addresses, read from sysfs and procfs.
+
+    Only the primary IPv4 address of an interface is known this way.
+    """
+    ipv6_addresses = _proc_ipv6_addresses()
+    interfaces = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for name in os.listdir(SYSFS_NET):
+            path = os.path.join(SYSFS_NET, name)
+            entry = {
+                "ifindex": int(_read(os.path.join(path, "ifindex"))),
+                "ifname": name,
+                "flags": netlink.flag_names(_sysfs_flags(path)),
+                "mtu": int(_read(os.path.join(path, "mtu"))),
+                "operstate": _read(os.path.join(path, "operstate")).upper(),
+                "address": _read(os.path.join(path, "address")),
+                "addr_info": [],
+            }
+            ipv4 = _ioctl_ipv4(sock, name)
+            if ipv4 is not None:
+                entry["addr_info"].append(
+                    {
+                        "family": "inet",
+                        "local": ipv4[0],
+                        "prefixlen": ipv4[1],
+                        "label": name,
+                    }
+                )
+            entry["addr_info"].extend(ipv6_addresses.get(name, []))
+            interfaces.append(entry)
+    return sorted(interfaces, key=lambda entry: entry["ifindex"])
+
+
 def get_network_information(default_if):
     """
     Return a big tuple of information over the network.
 
-    Take the output from ip --json addr and provide more information:
+    Take the interfaces and addresses, in the format of ip --json addr,
+    and provide more information:
     - Is it the interface to the internet (default route uses this interface)?
       default=true
     - Is it a physical device and not a virtual? is_physical=true
     - For all addresses, provide a netmask.
     """
-    cmd_result = None
-    try:
-        cmd_result = subprocess.Popen(["ip", "--json", "addr"], stdout=subprocess.PIPE)
-        stdout, stderr = cmd_result.communicate(timeout=2)
-        if cmd_result.returncode != 0:
-            raise Exception(
-                "Unhandled error while getting network information: "
-                "Error Code: {} Error Msg:{}".format(
-                    cmd_result.returncode, cmd_result.stderr
-                )
+    for get_interfaces in _INTERFACE_BACKENDS:
+        try:
+            return add_details(get_interfaces(), default_if)
+        except OSError:
+            structlog.get_logger().warning(
+                "Could not read network interfaces", backend=get_interfaces.__name__
             )
-        retval = json.loads(stdout)
-        for entry in retval:
-            entry["default"] = entry["ifname"] == default_if
-            entry["is_physical"] = _is_physical_address_name(entry["ifname"])
-            for addr_info_entry in entry["addr_info"]:
-                # Only show netmasks for v4
-                if addr_info_entry["family"] == "inet":
-                    addr_info_entry["netmask"] = _prefix_to_netmask(
-                        addr_info_entry["prefixlen"]
-                    )
-        return retval
-    except subprocess.TimeoutExpired:
-        if cmd_result is not None:
-            cmd_result.kill()
-        raise Exception("Timeout while trying to get network information")
-    except (json.JSONDecodeError, KeyError):
+    return _ip_get_network_information(default_if)
+
+
+def _parse_ip_addr(stdout):
+    try:
+        # Fails on unexpected entries now, not on serving them later
+        return add_details(json.loads(stdout), None)
+    except (json.JSONDecodeError, KeyError, TypeError):
         raise Exception("Unknown output format of ip --json addr command")
 
 
 __route_regex = re.compile(r"(?<=via )(?P<GW>[\d.]{7,15}).*(?<=dev )(?P<IF>\S+)")
 
 
+def _parse_ip_route(stdout):
+    match = __route_regex.search(stdout.decode("ascii"))
+    if match is None:
+        raise Exception("Unknown output format of ip route command")
+    return match.groupdict()
+
+
+# Commands to run as a last resort, with the parser of their output
+_IP_COMMANDS = {
+    "addr": (["ip", "--json", "addr"], _parse_ip_addr),
+    "route": (["ip", "-4", "route", "show", "default"], _parse_ip_route),
+}
+
+
+class _IPCommands:
+    """
+    Run all `_IP_COMMANDS` at the same time, within one deadline.
+
+    A command that fails or takes too long is answered with its last good
+    result, tagged as stale. Only without such a result, the error gets
+    raised. Calls within `IP_REUSE` seconds of a run share its results, so
+    a page asking for interfaces and route runs every command once.
+    """
+
+    def __init__(self, deadline=IP_DEADLINE):
+        self.deadline = deadline
+        self._lock = threading.Lock()
+        self._last_good: Dict[str, object] = {}
+        self._results: Optional[Tuple[float, dict]] = None
+
+    def get(self, name):
+        """Return a copy of the result of command `name`, run if needed."""
+        with self._lock:
+            if self._results is None or monotonic() - self._results[0] > IP_REUSE:
+                results = self._run()
+                self._results = (monotonic(), results)
+            result, stale = self._results[1][name]
+        if isinstance(result, Exception):
+            # A fresh exception, raising the same one grows its traceback
+            raise Exception(*result.args)
+        return result, stale
+
+    def _run(self):
+        log = structlog.get_logger()
+        started = monotonic()
+        processes = {}
+        errors = {}
+        for name, (command, _parse) in _IP_COMMANDS.items():
+            try:
+                processes[name] = subprocess.Popen(command, stdout=subprocess.PIPE)
+            except OSError as exc:
+                errors[name] = Exception(
+                    "Could not run {}: {}".format(" ".join(command), exc)
+                )
+        results = {}
+        try:
+            for name, process in processes.items():
+                try:
+                    stdout, stderr = process.communicate(
+                        timeout=max(0.0, self.deadline - (monotonic() - started))
+                    )
+                    if process.returncode != 0:
+                        raise Exception(
+                            "Unhandled error while getting network information: "
+                            "Error Code: {} Error Msg:{}".format(
+                                process.returncode, process.stderr
+                            )
+                        )
+                    results[name] = (_IP_COMMANDS[name][1](stdout), False)
+                except subprocess.TimeoutExpired:
+                    errors[name] = Exception(
+                        "Timeout while trying to get network information"
+                    )
+                except Exception as exc:
+                    errors[name] = exc
+        finally:
+            for process in processes.values():
+                if process.returncode is None:
+                    process.kill()
+                    # Reap it, killed processes stay zombies until waited for
+                    process.wait()
+        for name, (value, _stale) in results.items():
+            self._last_good[name] = value
+        for name, error in errors.items():
+            if name in self._last_good:
+                log.warning(
+                    "Serving stale network information", command=name, error=str(error)
+                )
+                results[name] = (self._last_good[name], True)
+            else:
+                results[name] = (error, False)
+        return results
+
+
+_ip_commands = _IPCommands()
+
+
+def _ip_get_network_information(default_if):
+    interfaces, stale = _ip_commands.get("addr")
+    interfaces = copy.deepcopy(interfaces)
+    if stale:
+        for entry in interfaces:
+            entry["stale"] = True
+    return add_details(interfaces, default_if)
+
+
+def _ip_get_default_route():
+    route, stale = _ip_commands.get("route")
+    return dict(route, stale=True) if stale else dict(route)
+
+
+# Flags of /proc/net/route
+_RTF_UP = 0x1
+_RTF_GATEWAY = 0x2
+
+
+def _proc_get_default_route():
+    """Return the IPv4 default route with the lowest metric from procfs."""
+    best = None
+    with open(PROC_ROUTE) as file_:
+        # The first line holds the column names
+        for line in file_.read().splitlines()[1:]:
+            fields = line.split()
+            name, destination, gateway, flags = fields[:4]
+            metric, mask = int(fields[6]), fields[7]
+            if (
+                int(destination, 16)
+                or int(mask, 16)
+                or int(flags, 16) & (_RTF_UP | _RTF_GATEWAY) != (_RTF_UP | _RTF_GATEWAY)
+            ):
+                continue
+            if best is None or metric < best[0]:
+                best = (metric, gateway, name)
+    if best is None:
+        raise Exception("No default route")
+    _metric, gateway, name = best
+    return {
+        "GW": socket.inet_ntoa(struct.pack("<L", int(gateway, 16))),
+        "IF": name,
+    }
+
+
 def get_default_route():
     """
     Provide a default route.
@@ -74,25 +401,16 @@ def get_default_route():
     - What is the gateway address? `via`
     - What is the device over which the traffic goes? `dev`
     """
-    cmd_result = None
-    try:
-        cmd_result = subprocess.Popen(
-            ["ip", "-4", "route", "show", "default"], stdout=subprocess.PIPE
-        )
-        stdout, stderr = cmd_result.communicate(timeout=2)
-        stdout = stdout.decode("ascii")
-        if cmd_result.returncode != 0:
-            raise Exception(
-                "Unhandled error while getting network information:"
-                " Error Code: {} Error Msg:{}".format(
-                    cmd_result.returncode, cmd_result.stderr
-                )
+    for get_route in _ROUTE_BACKENDS:
+        try:
+            return get_route()
+        except OSError:
+            structlog.get_logger().warning(
+                "Could not read default route", backend=get_route.__name__
             )
-    except subprocess.TimeoutExpired:
-        if cmd_result is not None:
-            cmd_result.kill()
-        raise Exception("Timeout while trying to get network information")
-    match = __route_regex.search(stdout)
-    if match is None:
-        raise Exception("Unknown output format of ip route command")
-    return match.groupdict()
+    return _ip_get_default_route()
+
+
+# Ways to read the network configuration, before falling back to `ip`
+_INTERFACE_BACKENDS = (netlink.get_interfaces, _sysfs_get_interfaces)
+_ROUTE_BACKENDS = (netlink.get_default_route, _proc_get_default_route)
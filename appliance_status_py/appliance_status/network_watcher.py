@@ -0,0 +1,191 @@
+"""
+Responsible for keeping the network information up to date in the background.
+
+A thread subscribes to changes of links, addresses and routes over netlink
+and applies every change to a snapshot of the interfaces and the default
+route. Pages read the snapshot instead of asking the kernel. Every change
+increases a version, so clients can find out cheaply whether anything
+changed. The index of the interfaces gets built once per version.
+Without netlink, every call asks the kernel, like `network` does.
+"""
+import copy
+import errno
+import threading
+from typing import Dict, Optional
+
+import structlog
+
+from appliance_status import netlink, network
+from appliance_status.background import Background, start_thread
+from appliance_status.interface_index import InterfaceIndex
+
+# Seconds to wait before subscribing again, after netlink failed
+RETRY_AFTER = 5
+# Seconds to wait for changes, before checking whether to stop
+POLL_TIMEOUT = 1
+
+
+def _address_key(addr_info):
+    return addr_info["family"], addr_info["local"], addr_info["prefixlen"]
+
+
+def _read_default_route():
+    try:
+        return netlink.get_default_route()
+    except OSError:
+        raise
+    except Exception:
+        # No default route right now
+        return None
+
+
+class NetworkWatcher:
+    """Implements all responsibilities of the module."""
+
+    def __init__(self):
+        """
+        Create a watcher without snapshot.
+
+        Nothing gets watched until `start` gets called.
+        """
+        self._lock = threading.Lock()
+        self._background = Background()
+        self._interfaces: Optional[Dict[int, dict]] = None
+        self._default_route: Optional[dict] = None
+        self._version = 0
+        self._index: Optional[tuple] = None
+
+    def start(self):
+        """Start watching network changes in a daemon thread, see `background`."""
+        self._background.start(self._launch)
+
+    def _launch(self):
+        with self._lock:
+            self._interfaces = None
+        return start_thread(self._run, "network-watcher")
+
+    def stop(self):
+        """Stop watching and wait until the thread is gone."""
+        self._background.stop()
+        with self._lock:
+            self._interfaces = None
+
+    def _run(self, stopping):
+        log = structlog.get_logger().bind(component="network-watcher")
+        while not stopping.is_set():
+            try:
+                with netlink.subscribe(timeout=POLL_TIMEOUT) as sock:
+                    self._resync()
+                    while not stopping.is_set():
+                        try:
+                            events = netlink.read_events(sock)
+                        except TimeoutError:
+                            continue
+                        except OSError as exc:
+                            if exc.errno != errno.ENOBUFS:
+                                raise
+                            log.info("Missed network changes, reading them again")
+                            self._resync()
+                            continue
+                        self._apply(events)
+            except OSError:
+                log.warning("Could not watch network changes", exc_info=True)
+                with self._lock:
+                    self._interfaces = None
+                stopping.wait(RETRY_AFTER)
+
+    def _resync(self):
+        """Replace the snapshot with the current state."""
+        interfaces = {entry["ifindex"]: entry for entry in netlink.get_interfaces()}
+        default_route = _read_default_route()
+        with self._lock:
+            if interfaces != self._interfaces or default_route != self._default_route:
+                self._version += 1
+            self._interfaces = interfaces
+            self._default_route = default_route
+
+    def _apply(self, events):
+        """Update the entries affected by `events`."""
+        default_route = self._default_route
+        if any(event.kind == "route" for event in events):
+            default_route = _read_default_route()
+        with self._lock:
+            if self._interfaces is None:
+                return
+            changed = default_route != self._default_route
+            self._default_route = default_route
+            for event in events:
+                if event.kind == "link":
+                    changed |= self._apply_link(event)
+                elif event.kind == "address":
+                    changed |= self._apply_address(event)
+            if changed:
+                self._version += 1
+
+    def _apply_link(self, event):
+        previous = self._interfaces.get(event.index)
+        if event.deleted:
+            return self._interfaces.pop(event.index, None) is not None
+        entry = dict(event.data)
+        entry["addr_info"] = previous["addr_info"] if previous else []
+        self._interfaces[event.index] = entry
+        return entry != previous
+
+    def _apply_address(self, event):
+        interface = self._interfaces.get(event.index)
+        if interface is None:
+            return False
+        key = _address_key(event.data)
+        addresses = interface["addr_info"]
+        # Updates keep the position of the address, new ones get appended
+        for position, addr_info in enumerate(addresses):
+            if _address_key(addr_info) == key:
+                if event.deleted:
+                    del addresses[position]
+                    return True
+                addresses[position] = event.data
+                return addr_info != event.data
+        if event.deleted:
+            return False
+        addresses.append(event.data)
+        return True
+
+    def get_version(self) -> Optional[int]:
+        """Return the version of the snapshot, None without snapshot."""
+        with self._lock:
+            return None if self._interfaces is None else self._version
+
+    def get_network_information(self, default_if):
+        """Return the interfaces like `network.get_network_information` does."""
+        with self._lock:
+            interfaces = (
+                None
+                if self._interfaces is None
+                else copy.deepcopy(
+                    [self._interfaces[index] for index in sorted(self._interfaces)]
+                )
+            )
+        if interfaces is None:
+            return network.get_network_information(default_if)
+        return network.add_details(interfaces, default_if)
+
+    def get_default_route(self):
+        """Return the default route like `network.get_default_route` does."""
+        with self._lock:
+            default_route = None if self._interfaces is None else self._default_route
+        if default_route is None:
+            return network.get_default_route()
+        return dict(default_route)
+
+    def get_interface_index(self, default_if) -> InterfaceIndex:
+        """Return an index of the interfaces, built once per version."""
+        version = self.get_version()
+        cached = self._index
+        if version is not None and cached is not None:
+            cached_version, cached_default_if, index = cached
+            if (cached_version, cached_default_if) == (version, default_if):
+                return index
+        index = InterfaceIndex(self.get_network_information(default_if))
+        if version is not None:
+            self._index = (version, default_if, index)
+        return index
@@ -0,0 +1,150 @@
+"""
+Responsible for resolving host names, with a cache shared by all tests.
+
+Many tests talk to the same few hosts. Resolving each host once per TTL
+instead of once per test keeps slow resolvers out of most test runs.
+The cache works from threads and from event loops. Concurrent lookups of the
+same host on the same loop share a single query.
+
+`getaddrinfo` does not tell the TTL of the records it found, so entries live
+for a fixed `ttl`. Hosts that do not exist get cached for `negative_ttl`.
+Temporary failures are not cached at all.
+"""
+import asyncio
+import socket
+import threading
+from collections import OrderedDict
+from functools import partial
+from time import monotonic
+from typing import Dict
+
+# Seconds to keep addresses of a host
+TTL = 60
+# Seconds to remember that a host does not exist
+NEGATIVE_TTL = 10
+# Number of hosts to keep at most
+MAX_ENTRIES = 1024
+
+_NEGATIVE_ERRORS = {
+    getattr(socket, name)
+    for name in ("EAI_NONAME", "EAI_NODATA")
+    if hasattr(socket, name)
+}
+
+
+def _with_port(addresses, port):
+    """Put `port` into the socket addresses of getaddrinfo results."""
+    return [
+        (family, type_, proto, name, (address[0], port) + tuple(address[2:]))
+        for family, type_, proto, name, address in addresses
+    ]
+
+
+class ResolverCache:
+    """Implements all responsibilities of the module."""
+
+    def __init__(self, ttl=TTL, negative_ttl=NEGATIVE_TTL, max_entries=MAX_ENTRIES):
+        """Create an empty cache."""
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._pending: Dict[tuple, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def _lookup(self, key):
+        """Return the cached entry, or None. Caller must hold the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, addresses, error = entry
+        if expires < monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        if error is None:
+            self.hits += 1
+        else:
+            self.negative_hits += 1
+        return entry
+
+    def _store(self, key, addresses, error):
+        with self._lock:
+            ttl = self.ttl if error is None else self.negative_ttl
+            self._entries[key] = (monotonic() + ttl, addresses, error)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _resolved(self, key, port):
+        """Return cached addresses for `port`, raise a cached error."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return None
+        _expires, addresses, error = entry
+        if error is not None:
+            raise socket.gaierror(error.errno, error.strerror)
+        return _with_port(addresses, port)
+
+    def _query(self, key):
+        host, type_ = key
+        try:
+            addresses = socket.getaddrinfo(host, None, type=type_)
+        except socket.gaierror as exc:
+            if exc.errno in _NEGATIVE_ERRORS:
+                self._store(key, None, exc)
+            raise
+        self._store(key, addresses, None)
+        return addresses
+
+    def getaddrinfo(self, host, port, type_=socket.SOCK_STREAM):
+        """Blocking, cached version of `socket.getaddrinfo`."""
+        key = (host, type_)
+        addresses = self._resolved(key, port)
+        if addresses is None:
+            addresses = _with_port(self._query(key), port)
+        return addresses
+
+    async def agetaddrinfo(self, host, port, type_=socket.SOCK_STREAM):
+        """Cached version of `loop.getaddrinfo`."""
+        key = (host, type_)
+        addresses = self._resolved(key, port)
+        if addresses is not None:
+            return addresses
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None or pending.get_loop() is not loop:
+                pending = loop.run_in_executor(None, self._query, key)
+                pending.add_done_callback(partial(self._forget_pending, key))
+                self._pending[key] = pending
+        # Shielded, a cancelled test must not cancel the lookup of others
+        return _with_port(await asyncio.shield(pending), port)
+
+    def _forget_pending(self, key, pending):
+        with self._lock:
+            if self._pending.get(key) is pending:
+                del self._pending[key]
+
+    def clear(self):
+        """Forget all cached entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit and miss counters, ready to be serialized to json."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+
+cache = ResolverCache()
@@ -0,0 +1,150 @@
+"""
+Responsible for running network tests in the background.
+
+Every test gets repeated in its own interval on the process wide test loop.
+The latest result of every test is kept, so that pages can show results
+without ever waiting for the network. The timings of all results feed
+latency histograms, pass and latency of the latest results a history per test.
+"""
+import asyncio
+from time import monotonic, time
+from typing import List, Optional
+
+import attr
+import structlog
+
+from appliance_status import test_types
+from appliance_status.background import Background, cancel_futures
+from appliance_status.history import ProbeHistories, ProbeHistory
+from appliance_status.latency import LatencyHistograms
+from appliance_status.test_manager import ATestManager
+
+# A result is stale, once its test missed that many runs
+STALE_AFTER_INTERVALS = 2
+
+
+@attr.s(frozen=True)
+class ScheduledResult:
+    """The latest result of a test, together with its age in seconds."""
+
+    result = attr.ib()
+    age: Optional[float] = attr.ib()
+    interval: float = attr.ib()
+    history: Optional[ProbeHistory] = attr.ib(default=None)
+
+    @property
+    def stale(self):
+        """Tell whether the test did not deliver a result in time."""
+        return self.age is None or self.age > self.interval * STALE_AFTER_INTERVALS
+
+
+def _make_not_yet_tested_result(test):
+    return test_types.ErrorResult(
+        test.test_type,
+        address=getattr(test, "_address", ""),
+        status_code=0,
+        reason="Not tested yet",
+        description=test.description,
+    )
+
+
+class ProbeScheduler:
+    """Implements all responsibilities of the module."""
+
+    def __init__(self, test_manager: ATestManager):
+        """
+        Create a scheduler for the tests of the provided `test_manager`.
+
+        Nothing runs until `start` gets called.
+        """
+        self.test_manager = test_manager
+        self._latest: List[Optional[tuple]] = [None] * len(test_manager.tests)
+        self.latency = LatencyHistograms(len(test_manager.tests))
+        self.history = ProbeHistories(len(test_manager.tests))
+        self._background = Background()
+
+    def start(self):
+        """Start repeating the tests on the process wide test loop, see `background`."""
+        self._background.start(self._launch)
+
+    def _launch(self):
+        log = structlog.get_logger().bind(component="probe-scheduler")
+        return cancel_futures(
+            [
+                self.test_manager.submit(
+                    self._schedule(index, test, interval, timeout, log)
+                )
+                for index, (test, interval, timeout) in enumerate(
+                    zip(
+                        self.test_manager.tests,
+                        self.test_manager.intervals,
+                        self.test_manager.timeouts,
+                    )
+                )
+            ]
+        )
+
+    def stop(self):
+        """Stop repeating the tests and wait until they are stopped."""
+        self._background.stop()
+
+    async def _schedule(self, index, test, interval, timeout, log):
+        log = log.bind(test=test)
+        while True:
+            started = monotonic()
+            result = await self.test_manager.perform_network_test(
+                test, log.bind(), timeout
+            )
+            self._latest[index] = (result, monotonic())
+            self.latency.add(index, getattr(result, "timings", {}))
+            self.history.add(index, result, time())
+            await asyncio.sleep(max(0.0, interval - (monotonic() - started)))
+
+    def get_results(self) -> List[ScheduledResult]:
+        """Return the latest result of every test, without waiting for any."""
+        now = monotonic()
+        results = []
+        for index, (test, interval, latest) in enumerate(
+            zip(self.test_manager.tests, self.test_manager.intervals, self._latest)
+        ):
+            history = self.history.get(index)
+            if latest is None:
+                results.append(
+                    ScheduledResult(
+                        _make_not_yet_tested_result(test), None, interval, history
+                    )
+                )
+            else:
+                result, finished = latest
+                results.append(
+                    ScheduledResult(result, now - finished, interval, history)
+                )
+        return results
+
+    def get_latency(self):
+        """Return the latency histograms of every test."""
+        return [
+            {
+                "test_type": test.test_type,
+                "address": getattr(test, "_address", ""),
+                "description": test.description,
+                "histograms": self.latency.get(index),
+            }
+            for index, test in enumerate(self.test_manager.tests)
+        ]
+
+    def get_history(self):
+        """Return pass rate, latency percentiles and samples of every test."""
+        histories = []
+        for index, test in enumerate(self.test_manager.tests):
+            history = self.history.get(index)
+            histories.append(
+                {
+                    "test_type": test.test_type,
+                    "address": getattr(test, "_address", ""),
+                    "description": test.description,
+                    "summary": history.summary(),
+                    "samples": history.samples(),
+                }
+            )
+        return histories
@@ -1,35 +1,275 @@
 """Super basic tests for app config."""
+import json
 import werkzeug
 from appliance_status import app
+from appliance_status.interface_index import InterfacePage
 import pytest
 
 
 def test_status(mocker):
     """Only validate that things get called."""
-    network = mocker.patch("appliance_status.app.network")
-    test_manager = mocker.patch("appliance_status.app.test_manager")
+    network_watcher = mocker.patch("appliance_status.app.network_watcher")
+    interface_stats = mocker.patch("appliance_status.app.interface_stats")
+    gateway_monitor = mocker.patch("appliance_status.app.gateway_monitor")
+    probe_scheduler = mocker.patch("appliance_status.app.probe_scheduler")
     config_manager = mocker.patch("appliance_status.app.config_manager")
+    file_watcher = mocker.patch("appliance_status.app.file_watcher")
     renderer = mocker.patch("appliance_status.app.render_template")
     renderer.return_value = "success"
 
-    template = app.status()
+    with app.app.test_request_context():
+        template = app.status()
 
-    assert network.get_default_route.called
-    assert test_manager.perform_network_tests.called
-    assert config_manager.get_schema_with_config.called
+    assert network_watcher.get_default_route.called
+    assert interface_stats.start.called
+    assert gateway_monitor.start.called
+    assert probe_scheduler.start.called
+    assert probe_scheduler.get_results.called
+    assert file_watcher.start.called
+    assert config_manager.get_sections.called
     assert renderer.called
     assert template == "success"
 
 
+def test_status_live(mocker):
+    """Only validate that things get called, and tests run per request."""
+    network_watcher = mocker.patch("appliance_status.app.network_watcher")
+    mocker.patch("appliance_status.app.interface_stats")
+    mocker.patch("appliance_status.app.gateway_monitor")
+    test_manager = mocker.patch("appliance_status.app.test_manager")
+    test_manager.iter_network_tests.return_value = iter([(0, "result")])
+    test_manager.intervals = [60]
+    config_manager = mocker.patch("appliance_status.app.config_manager")
+    mocker.patch("appliance_status.app.file_watcher")
+    mocker.patch("appliance_status.app.render_template")
+    renderer = mocker.patch("appliance_status.app.stream_template")
+    renderer.return_value = "success"
+
+    with app.app.test_request_context():
+        template = app.status_live()
+    network_tests = list(renderer.call_args.kwargs["network_tests"])
+
+    assert network_watcher.get_default_route.called
+    assert config_manager.get_sections.called
+    assert ["result"] == [network_test.result for network_test in network_tests]
+    assert not network_tests[0].stale
+    assert template == "success"
+
+
+def test_status_interface_filter(mocker):
+    """Query parameters select the interfaces, bad ones are rejected."""
+    network_watcher = mocker.patch("appliance_status.app.network_watcher")
+    mocker.patch("appliance_status.app.interface_stats")
+    mocker.patch("appliance_status.app.gateway_monitor")
+    mocker.patch("appliance_status.app.probe_scheduler")
+    mocker.patch("appliance_status.app.config_manager")
+    mocker.patch("appliance_status.app.file_watcher")
+    mocker.patch("appliance_status.app.render_template")
+    query = network_watcher.get_interface_index().query
+
+    with app.app.test_request_context("/?name=veth1&name=veth2&page=2"):
+        app.status()
+    with app.app.test_request_context("/?kind=virtual&default=true&family=inet"):
+        app.status()
+    query.side_effect = ValueError("Unknown kind of interface: horse")
+    with app.app.test_request_context("/?kind=horse"):
+        with pytest.raises(werkzeug.exceptions.BadRequest):
+            app.status()
+
+    assert [
+        mocker.call(
+            names=["veth1", "veth2"],
+            kind="all",
+            default=False,
+            family=None,
+            page=2,
+            per_page=50,
+        ),
+        mocker.call(
+            names=[],
+            kind="virtual",
+            default=True,
+            family="inet",
+            page=1,
+            per_page=50,
+        ),
+    ] == query.call_args_list[:2]
+
+
+def test_interfaces(mocker):
+    """A page of interfaces gets returned as json."""
+    network_watcher = mocker.patch("appliance_status.app.network_watcher")
+    network_watcher.get_default_route.return_value = {"IF": "eth0"}
+    network_watcher.get_interface_index().query.return_value = InterfacePage(
+        [{"ifname": "eth0"}], 1, 1, 50
+    )
+
+    with app.app.test_request_context("/interfaces"):
+        response = app.interfaces()
+
+    assert {
+        "interfaces": [{"ifname": "eth0"}],
+        "total": 1,
+        "page": 1,
+        "per_page": 50,
+        "pages": 1,
+    } == response.get_json()
+    network_watcher.get_interface_index.assert_called_with("eth0")
+
+
+def test_network_state(mocker):
+    """The version of the snapshot allows conditional requests."""
+    network_watcher = mocker.patch("appliance_status.app.network_watcher")
+    network_watcher.get_version.return_value = 7
+    network_watcher.get_default_route.return_value = {"GW": "10.0.0.1", "IF": "eth0"}
+    network_watcher.get_network_information.return_value = []
+
+    with app.app.test_request_context():
+        response = app.network_state()
+    with app.app.test_request_context(headers={"If-None-Match": '"7"'}):
+        unchanged = app.network_state()
+
+    assert 200 == response.status_code
+    assert 7 == response.get_json()["version"]
+    assert 304 == unchanged.status_code
+
+
+def test_gateway(mocker):
+    """The status of the gateway gets returned as json."""
+    gateway_monitor = mocker.patch("appliance_status.app.gateway_monitor")
+    gateway_monitor.get_status.return_value = {"loss": 0.0}
+
+    with app.app.test_request_context():
+        response = app.gateway()
+
+    assert gateway_monitor.start.called
+    assert {"loss": 0.0} == response.get_json()
+
+
+def test_latency(mocker):
+    """The histograms of the scheduler get returned as json."""
+    probe_scheduler = mocker.patch("appliance_status.app.probe_scheduler")
+    probe_scheduler.get_latency.return_value = [{"histograms": {}}]
+
+    with app.app.test_request_context():
+        response = app.latency()
+
+    assert [{"histograms": {}}] == response.get_json()
+
+
+def test_history(mocker):
+    """The history of the scheduler gets returned as json."""
+    probe_scheduler = mocker.patch("appliance_status.app.probe_scheduler")
+    probe_scheduler.get_history.return_value = [{"summary": {}, "samples": []}]
+
+    with app.app.test_request_context():
+        response = app.history()
+
+    assert probe_scheduler.start.called
+    assert [{"summary": {}, "samples": []}] == response.get_json()
+
+
+def test_dns(mocker):
+    """The counters of the dns cache get returned as json."""
+    resolver = mocker.patch("appliance_status.app.resolver")
+    resolver.cache.stats.return_value = {"hits": 1}
+
+    with app.app.test_request_context():
+        response = app.dns()
+
+    assert {"hits": 1} == response.get_json()
+
+
+def test_configuration_get(mocker):
+    """Stored values get returned with their ETag."""
+    config_manager = mocker.patch("appliance_status.app.config_manager")
+    config_manager.get_values.return_value = ({"demo": "x"}, "abc")
+
+    with app.app.test_request_context():
+        response = app.configuration()
+    with app.app.test_request_context(headers={"If-None-Match": '"abc"'}):
+        unchanged = app.configuration()
+
+    assert {"demo": "x"} == response.get_json()
+    assert '"abc"' == response.headers["ETag"]
+    assert 304 == unchanged.status_code
+
+
+def test_configuration_patch(mocker):
+    """Changes get passed on with the ETags of If-Match."""
+    config_manager = mocker.patch("appliance_status.app.config_manager")
+    file_watcher = mocker.patch("appliance_status.app.file_watcher")
+    config_manager.patch_config.return_value = ({"demo": "y"}, "def")
+
+    with app.app.test_request_context(
+        method="PATCH", json={"demo": "y"}, headers={"If-Match": '"abc"'}
+    ):
+        response = app.configuration()
+
+    changes, if_match = config_manager.patch_config.call_args.args
+    assert {"demo": "y"} == changes
+    assert "abc" in if_match
+    assert '"def"' == response.headers["ETag"]
+    assert file_watcher.check.called
+
+
+@pytest.mark.parametrize(
+    "exception, body, code",
+    [
+        (app.StaleConfigError, {"demo": "y"}, 412),
+        (ValueError, {"demo": "y"}, 400),
+        (KeyError, {"demo": "y"}, 400),
+        (None, ["demo"], 400),
+    ],
+)
+def test_configuration_patch_fails(mocker, exception, body, code):
+    """Stale, invalid and incomplete changes get rejected."""
+    config_manager = mocker.patch("appliance_status.app.config_manager")
+    mocker.patch("appliance_status.app.file_watcher")
+    if exception is not None:
+        config_manager.patch_config.side_effect = exception()
+
+    with app.app.test_request_context(method="PATCH", json=body):
+        with pytest.raises(werkzeug.exceptions.HTTPException) as exc:
+            app.configuration()
+
+    assert code == exc.value.code
+
+
+@pytest.mark.parametrize("value", (None, True, [1], 1.5))
+def test_configuration_patch_rejects_other_values(mocker, value):
+    """Only strings and integers reach the normalizers."""
+    config_manager = mocker.patch("appliance_status.app.config_manager")
+
+    with app.app.test_request_context(method="PATCH", json={"port": value}):
+        with pytest.raises(werkzeug.exceptions.HTTPException) as exc:
+            app.configuration()
+
+    assert 400 == exc.value.code
+    assert not config_manager.patch_config.called
+
+
+def test_config_cache(mocker):
+    """The counters of the parsed configuration get returned as json."""
+    config_manager = mocker.patch("appliance_status.app.config_manager")
+    config_manager.config_on_disk.stats.return_value = {"hits": 1, "misses": 2}
+
+    with app.app.test_request_context():
+        response = app.config_cache()
+
+    assert {"hits": 1, "misses": 2} == response.get_json()
+
+
 def test_leases(mocker):
     """Only validate that things get called."""
     renderer = mocker.patch("appliance_status.app.render_template")
     renderer.return_value = "success"
     leases_manager = mocker.patch("appliance_status.app.leases_manager")
+    leases_manager.get_leases_and_records.return_value = ([], {})
 
     template = app.leases()
 
-    assert leases_manager.get_leases.called
+    leases_manager.get_leases_and_records.assert_called_once_with()
     assert renderer.called
     assert template == "success"
 
@@ -37,11 +277,13 @@ def test_leases(mocker):
 def test_update_good(mocker):
     """Only validate that things get called."""
     config_manager = mocker.patch("appliance_status.app.config_manager")
+    file_watcher = mocker.patch("appliance_status.app.file_watcher")
 
     with app.app.test_request_context():
         text, code = app.update()
 
     assert config_manager.update_config.calles
+    assert file_watcher.check.called
     assert "" == text
     assert 204 == code
 
@@ -54,8 +296,129 @@ def test_update_fails(mocker, exception):
     Catch them, return a 400
     """
     config_manager = mocker.patch("appliance_status.app.config_manager")
+    mocker.patch("appliance_status.app.file_watcher")
     config_manager.update_config.side_effect = exception()
 
     with app.app.test_request_context():
         with pytest.raises(werkzeug.exceptions.BadRequest):
             app.update()
+
+
+def test_config_form_rendered_once_per_generation(mocker):
+    """The form gets reused until a watched file changed."""
+    file_watcher = mocker.patch("appliance_status.app.file_watcher")
+    config_manager = mocker.patch("appliance_status.app.config_manager")
+    renderer = mocker.patch("appliance_status.app.render_template")
+    renderer.side_effect = ["first", "second", "third"]
+    config_manager.get_sections.return_value = ["General", "Network"]
+
+    file_watcher.get_generation.return_value = 1
+    with app.app.test_request_context():
+        forms = [app._render_config_form(), app._render_config_form()]
+        file_watcher.get_generation.return_value = 2
+        forms.append(app._render_config_form())
+        file_watcher.get_generation.return_value = None
+        forms.append(app._render_config_form())
+
+    assert ["first", "first", "second", "third"] == forms
+    assert [mocker.call("General")] * 3 == config_manager.get_section.call_args_list
+    assert [("General", config_manager.get_section()), ("Network", None)] == (
+        renderer.call_args.kwargs["sections"]
+    )
+
+
+def test_config_form_opens_requested_section(mocker):
+    """The section in the query gets rendered instead of the first one."""
+    mocker.patch("appliance_status.app.file_watcher")
+    config_manager = mocker.patch("appliance_status.app.config_manager")
+    config_manager.get_sections.return_value = ["General", "Network"]
+    mocker.patch("appliance_status.app.render_template")
+
+    with app.app.test_request_context("/?section=1"):
+        app._render_config_form()
+
+    config_manager.get_section.assert_called_once_with("Network")
+
+
+def test_config_section(mocker):
+    """Sections get rendered on their own, unknown ones do not exist."""
+    config_manager = mocker.patch("appliance_status.app.config_manager")
+    config_manager.get_sections.return_value = ["General", "Network"]
+    renderer = mocker.patch("appliance_status.app.render_template")
+    renderer.return_value = "section"
+
+    with app.app.test_request_context():
+        section = app.config_section(1)
+        with pytest.raises(werkzeug.exceptions.NotFound):
+            app.config_section(2)
+
+    assert "section" == section
+    config_manager.get_section.assert_called_once_with("Network")
+
+
+def test_config_section_save(mocker):
+    """Saving a section only changes its values."""
+    config_manager = mocker.patch("appliance_status.app.config_manager")
+    config_manager.get_sections.return_value = ["General"]
+    file_watcher = mocker.patch("appliance_status.app.file_watcher")
+
+    with app.app.test_request_context(method="POST", data={"demo": "x"}):
+        text, code = app.config_section(0)
+    config_manager.patch_config.side_effect = ValueError()
+    with app.app.test_request_context(method="POST", data={"demo": "1"}):
+        with pytest.raises(werkzeug.exceptions.BadRequest):
+            app.config_section(0)
+
+    assert 204 == code
+    assert mocker.call({"demo": "x"}) == config_manager.patch_config.call_args_list[0]
+    assert file_watcher.check.called
+
+
+def test_schema_changed(mocker, tmp_path):
+    """A changed schema replaces the config manager, an invalid one does not."""
+    old_manager = mocker.patch("appliance_status.app.config_manager")
+    old_manager.config_on_disk.config_file = str(tmp_path / "config.json")
+    schema_path = tmp_path / "schema.json"
+    schema_path.write_text(
+        json.dumps(
+            dict(
+                version=2,
+                name="New",
+                schema=[dict(name="a", key="a", type_normalizer="port")],
+            )
+        )
+    )
+
+    app._schema_changed(str(schema_path))
+    new_manager = app.config_manager
+    schema_path.write_text(
+        json.dumps(dict(version=3, schema=[dict(key="a", type_normalizer="zip")]))
+    )
+    app._schema_changed(str(schema_path))
+
+    assert new_manager is not old_manager
+    assert 2 == new_manager.form_schema["version"]
+    assert new_manager is app.config_manager
+
+
+def test_tests_changed(mocker, tmp_path):
+    """Changed tests get scheduled instead of the old ones."""
+    old_scheduler = mocker.patch("appliance_status.app.probe_scheduler")
+    mocker.patch("appliance_status.app.test_manager")
+    scheduler_class = mocker.patch("appliance_status.app.ProbeScheduler")
+    tests_path = tmp_path / "tests.json"
+    tests_path.write_text(
+        json.dumps(
+            [dict(TestType="HTTPTest", args=["https://example.com"], description="d")]
+        )
+    )
+
+    app._tests_changed(str(tests_path))
+    tests_path.write_text("[{}]")
+    app._tests_changed(str(tests_path))
+
+    assert old_scheduler.stop.called
+    assert 1 == scheduler_class.call_count
+    assert scheduler_class().start.called
+    assert scheduler_class() is app.probe_scheduler
+    assert 1 == len(app.test_manager.tests)
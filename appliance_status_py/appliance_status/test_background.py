@@ -0,0 +1,58 @@
+"""Verify background work gets started once per process."""
+import asyncio
+import threading
+
+from appliance_status import background
+from appliance_status.test_manager import ATestManager
+
+
+def test_start_once_per_process(mocker):
+    """Starting again is a no-op, unless in a forked process."""
+    stop = mocker.Mock()
+    launch = mocker.Mock(return_value=stop)
+    work = background.Background()
+
+    assert work.start(launch)
+    assert not work.start(launch)
+    assert work.running
+    mocker.patch.object(background.os, "getpid", return_value=-1)
+    assert not work.running
+    assert work.start(launch)
+
+    assert 2 == launch.call_count
+
+
+def test_stop(mocker):
+    """Stopping calls what `launch` returned, once."""
+    stop = mocker.Mock()
+    work = background.Background()
+    work.start(lambda: stop)
+
+    work.stop()
+    work.stop()
+
+    stop.assert_called_once_with()
+    assert not work.running
+
+
+def test_start_thread():
+    """The thread runs until it gets stopped."""
+    started = threading.Event()
+
+    def target(stopping):
+        started.set()
+        stopping.wait()
+
+    stop = background.start_thread(target, "test")
+    assert started.wait(5)
+
+    stop()
+
+
+def test_cancel_futures():
+    """Coroutines running on the test loop get cancelled."""
+    futures = [ATestManager.submit(asyncio.sleep(60)) for _ in range(2)]
+
+    background.cancel_futures(futures)()
+
+    assert all(future.cancelled() for future in futures)
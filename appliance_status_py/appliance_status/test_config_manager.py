@@ -1,4 +1,9 @@
 """Test Config manager."""
+import errno
+import fcntl
+import json
+import threading
+import time
 
 from appliance_status import config_manager
 import pytest
@@ -113,6 +118,197 @@ def test_config_on_disk_read_empty_or_invalid(contents, tmp_path):
     assert {"schema": [], "version": -1} == cd.config
 
 
+def test_config_on_disk_parsed_once(mocker, tmp_path):
+    """Unchanged files are not parsed again."""
+    config_path = tmp_path / "config.json"
+    config_path.write_text('{"version": 1}')
+    cd = config_manager.ConfigOnDisk(str(config_path))
+    load = mocker.spy(config_manager.json, "load")
+
+    assert cd.config is cd.config
+    assert 1 == load.call_count
+    assert {"hits": 1, "misses": 1} == cd.stats()
+
+
+def test_config_on_disk_reads_changed_file(tmp_path):
+    """Files replaced or changed on disk get parsed again."""
+    config_path = tmp_path / "config.json"
+    config_path.write_text('{"version": 1}')
+    cd = config_manager.ConfigOnDisk(str(config_path))
+    assert {"version": 1} == cd.config
+
+    config_path.write_text('{"version": 10}')
+    assert {"version": 10} == cd.config
+    config_path.unlink()
+    assert {"schema": [], "version": -1} == cd.config
+    assert {"hits": 0, "misses": 3} == cd.stats()
+
+
+def test_config_on_disk_write_invalidates(tmp_path):
+    """Writing the config makes the next read parse the file."""
+    config_path = tmp_path / "config.json"
+    cd = config_manager.ConfigOnDisk(str(config_path))
+    assert {"schema": [], "version": -1} == cd.config
+
+    cd.config = {"version": 2, "schema": []}
+
+    assert {"version": 2, "schema": []} == cd.config
+    assert {"version": 2, "schema": []} == json.loads(config_path.read_text())
+
+
+def test_config_on_disk_invalidate(tmp_path):
+    """After invalidating, the file gets parsed again, even if it looks the same."""
+    config_path = tmp_path / "config.json"
+    config_path.write_text('{"version": 1}')
+    cd = config_manager.ConfigOnDisk(str(config_path))
+    first = cd.config
+
+    cd.invalidate()
+
+    assert first is not cd.config
+    assert {"hits": 0, "misses": 2} == cd.stats()
+
+
+def test_config_on_disk_write_replaces_file(tmp_path):
+    """New contents go to a new file, renamed over the old one."""
+    config_path = tmp_path / "config.json"
+    config_path.write_text("{}")
+    config_path.chmod(0o640)
+    inode = config_path.stat().st_ino
+    cd = config_manager.ConfigOnDisk(str(config_path))
+
+    cd.config = {"version": 3}
+
+    assert inode != config_path.stat().st_ino
+    assert 0o640 == config_path.stat().st_mode & 0o777
+    assert ["config.json", "config.json.lock"] == sorted(
+        path.name for path in tmp_path.iterdir()
+    )
+
+
+def test_config_on_disk_write_skips_unchanged(mocker, tmp_path):
+    """Writing the same contents again leaves the file alone."""
+    config_path = tmp_path / "config.json"
+    config_path.write_text('{"version": 3}')
+    cd = config_manager.ConfigOnDisk(str(config_path))
+    replace = mocker.spy(config_manager.os, "replace")
+
+    cd.config = {"version": 3}
+
+    assert not replace.called
+
+
+def test_config_on_disk_write_into_mounted_file(mocker, tmp_path):
+    """Files that can not be replaced, like docker mounts, are written in place."""
+    config_path = tmp_path / "config.json"
+    config_path.write_text("{}")
+    inode = config_path.stat().st_ino
+    mocker.patch.object(
+        config_manager.os, "replace", side_effect=OSError(errno.EBUSY, "busy")
+    )
+    cd = config_manager.ConfigOnDisk(str(config_path))
+
+    cd.config = {"version": 3}
+
+    assert inode == config_path.stat().st_ino
+    assert {"version": 3} == cd.config
+    assert ["config.json", "config.json.lock"] == sorted(
+        path.name for path in tmp_path.iterdir()
+    )
+
+
+def test_config_on_disk_coalesces_writes(mocker, tmp_path):
+    """Writes waiting for a running one result in one write of the latest value."""
+    config_path = tmp_path / "config.json"
+    cd = config_manager.ConfigOnDisk(str(config_path))
+    writing, proceed = threading.Event(), threading.Event()
+    written = []
+
+    def write(contents, requested):
+        written.append(json.loads(contents))
+        writing.set()
+        proceed.wait(5)
+
+    mocker.patch.object(cd, "_write", side_effect=write)
+    threads = [threading.Thread(target=setattr, args=(cd, "config", {"version": 1}))]
+    threads[0].start()
+    writing.wait(5)
+    for version in (2, 3):
+        threads.append(
+            threading.Thread(target=setattr, args=(cd, "config", {"version": version}))
+        )
+        threads[-1].start()
+    while cd._generation < 3:
+        time.sleep(0.01)
+    proceed.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert [{"version": 1}, {"version": 3}] == written
+
+
+def test_config_on_disk_coalesces_writes_of_workers(mocker, tmp_path):
+    """A value requested before the one another worker wrote is not written."""
+    config_path = tmp_path / "config.json"
+    cd = config_manager.ConfigOnDisk(str(config_path))
+    requested = threading.Event()
+
+    def monotonic_ns():
+        requested.set()
+        return time.monotonic_ns()
+
+    mocker.patch.object(config_manager, "monotonic_ns", monotonic_ns)
+    with open(str(config_path) + ".lock", "a+") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        thread = threading.Thread(target=setattr, args=(cd, "config", {"version": 1}))
+        thread.start()
+        requested.wait(5)
+        # Another worker writes a later value, while this one waits for the lock
+        config_path.write_text('{"version": 2}')
+        config_manager._record_request(lock_file, time.monotonic_ns())
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    thread.join(5)
+
+    assert {"version": 2} == cd.config
+    cd.config = {"version": 3}
+    assert {"version": 3} == cd.config
+
+
+@pytest.mark.parametrize(
+    "schema_field",
+    (
+        dict(name="demo_field", key="demo"),
+        dict(name="demo_field", key="demo", type_normalizer="zip_code"),
+        dict(name="demo_field", key="demo", type_normalizer="__init__"),
+    ),
+)
+def test_config_manager_make_one_bad_normalizer(tmp_path, schema_field):
+    """Unknown type normalizers fail when the manager gets created."""
+    schema = dict(SCHEMA, schema=[schema_field])
+
+    with pytest.raises(ValueError):
+        config_manager.ConfigManager.make_one(str(tmp_path / "config.json"), schema)
+
+
+def test_config_manager_plan():
+    """The plan holds resolved normalizers and the set of keys."""
+    schema = dict(
+        SCHEMA,
+        schema=[
+            dict(name="port", key="port", type_normalizer="port"),
+            dict(name="name", key="name", type_normalizer="az_az_upper"),
+        ],
+    )
+
+    plan = config_manager.ConfigManager(None, schema).plan
+
+    assert {"port", "name"} == plan.keys
+    assert {
+        "version": 1,
+        "schema": [{"key": "port", "value": 80}, {"key": "name", "value": "x"}],
+    } == plan.apply({"name": "x", "port": "80"})
+
+
 def test_config_manager_make_one(tmp_path):
     """For the sake of completeness, we run makeOne."""
     config_path = tmp_path / "config.json"
@@ -234,6 +430,152 @@ def test_config_manager_name_in_config_is_ignored(mocker, faker):
     assert SCHEMA["name"] == config.get_schema_with_config()["name"]
 
 
+def test_config_manager_merges_once(mocker, faker):
+    """Values get merged again only after the stored config changed."""
+    cfg_on_disk = mocker.Mock()
+    cfg_on_disk.config = dict(version=1, schema=[dict(key="demo", value=faker.word())])
+    config = config_manager.ConfigManager(cfg_on_disk, SCHEMA)
+    merge = mocker.spy(config_manager.ConfigManager, "_merge")
+
+    first = config.get_schema_with_config()
+    second = config.get_schema_with_config()
+    cfg_on_disk.config = dict(version=1, schema=[dict(key="demo", value="other")])
+    third = config.get_schema_with_config()
+
+    assert 2 == merge.call_count
+    assert first["schema"][0] is second["schema"][0]
+    assert "other" == third["schema"][0]["value"]
+
+
+def test_config_manager_schema_is_read_only(mocker):
+    """Changing the returned schema fails, instead of changing the next page."""
+    cfg_on_disk = mocker.Mock()
+    cfg_on_disk.config = {"schema": [], "version": -1}
+    config = config_manager.ConfigManager(cfg_on_disk, SCHEMA)
+
+    with pytest.raises(TypeError):
+        config.get_schema_with_config()["schema"][0]["value"] = "x"
+    assert SCHEMA == config.get_schema_with_config()
+
+
+def _patchable(tmp_path):
+    schema = dict(
+        SCHEMA,
+        schema=[
+            dict(name="port", key="port", type_normalizer="port"),
+            dict(name="name", key="name", type_normalizer="az_az_upper"),
+        ],
+    )
+    config = config_manager.ConfigManager.make_one(
+        str(tmp_path / "config.json"), schema
+    )
+    config.update_config({"port": "80", "name": "web"})
+    return config
+
+
+def test_config_manager_patch_config(mocker, tmp_path):
+    """Only the changed values get normalized, the others stay."""
+    config = _patchable(tmp_path)
+    values, etag = config.get_values()
+    port = mocker.spy(config_manager._Normalizers, "port")
+
+    new_values, new_etag = config.patch_config({"name": "api"}, [etag])
+
+    assert {"port": 80, "name": "web"} == values
+    assert {"port": 80, "name": "api"} == new_values
+    assert (new_values, new_etag) == config.get_values()
+    assert etag != new_etag
+    assert not port.called
+
+
+def test_config_manager_patch_config_stale(tmp_path):
+    """Changes based on an old ETag leave the file alone."""
+    config = _patchable(tmp_path)
+    _values, etag = config.get_values()
+    config.patch_config({"port": "8080"})
+
+    with pytest.raises(config_manager.StaleConfigError):
+        config.patch_config({"name": "api"}, [etag])
+    assert {"port": 8080, "name": "web"} == config.get_values()[0]
+
+
+@pytest.mark.parametrize(
+    "changes, exception",
+    (
+        ({"port": "0"}, ValueError),
+        ({"unknown": "x"}, ValueError),
+        ({"port": None}, ValueError),
+        ({"port": [1]}, ValueError),
+        ({"port": 1.5}, ValueError),
+        ({"name": None}, ValueError),
+        ({"name": True}, ValueError),
+    ),
+)
+def test_config_manager_patch_config_bad(tmp_path, changes, exception):
+    """Bad values and unknown keys get rejected."""
+    config = config_manager.ConfigManager.make_one(
+        str(tmp_path / "config.json"),
+        dict(
+            SCHEMA,
+            schema=[
+                dict(name="port", key="port", type_normalizer="port"),
+                dict(name="name", key="name", type_normalizer="az_az_upper"),
+            ],
+        ),
+    )
+
+    with pytest.raises(exception):
+        config.patch_config(changes)
+    assert not (tmp_path / "config.json").exists()
+
+
+def test_config_manager_patch_config_partial(tmp_path):
+    """Values can be saved one section at a time."""
+    config = config_manager.ConfigManager.make_one(
+        str(tmp_path / "config.json"),
+        dict(
+            SCHEMA,
+            schema=[
+                dict(name="port", key="port", type_normalizer="port"),
+                dict(name="name", key="name", type_normalizer="az_az_upper"),
+            ],
+        ),
+    )
+
+    values, _etag = config.patch_config({"port": "80"})
+
+    assert {"port": 80} == values
+    assert [("port", 80), ("name", None)] == [
+        (field["key"], field.get("value"))
+        for field in config.get_schema_with_config()["schema"]
+    ]
+
+
+def test_config_manager_sections(mocker):
+    """Fields get grouped into sections, without section into the default one."""
+    cfg_on_disk = mocker.Mock()
+    cfg_on_disk.config = dict(
+        version=1, schema=[dict(key="port", value=80), dict(key="name", value="x")]
+    )
+    schema = dict(
+        SCHEMA,
+        schema=[
+            dict(name="name", key="name", type_normalizer="az_az_upper"),
+            dict(name="port", key="port", type_normalizer="port", section="Network"),
+            dict(name="host", key="host", type_normalizer="az_az_upper"),
+        ],
+    )
+    config = config_manager.ConfigManager(cfg_on_disk, schema)
+
+    assert ["General", "Network"] == config.get_sections()
+    assert [("name", "x"), ("host", None)] == [
+        (field["key"], field.get("value")) for field in config.get_section("General")
+    ]
+    assert [80] == [field["value"] for field in config.get_section("Network")]
+    with pytest.raises(KeyError):
+        config.get_section("Unknown")
+
+
 def test_config_manager_update_config_good(mocker, faker):
     """Verify that valid configurations get written to disk."""
     cfg_on_disk = mocker.Mock()
@@ -0,0 +1,115 @@
+"""Verify the file watcher."""
+import threading
+
+import pytest
+
+from appliance_status import file_watcher
+
+
+def _watched(tmp_path, watcher, name="config.json"):
+    path = tmp_path / name
+    path.write_text("{}")
+    calls = []
+    changed = threading.Event()
+
+    def callback(changed_path):
+        calls.append(changed_path)
+        changed.set()
+
+    watcher.watch(str(path), callback)
+    return path, calls, changed
+
+
+def test_check_finds_changes(tmp_path):
+    """Changed, replaced and removed files run their callback once."""
+    watcher = file_watcher.FileWatcher()
+    path, calls, _changed = _watched(tmp_path, watcher)
+    other = tmp_path / "other.json"
+
+    assert not watcher.check()
+    path.write_text('{"version": 1}')
+    assert watcher.check()
+    assert not watcher.check()
+    other.write_text("{}")
+    other.replace(path)
+    assert watcher.check()
+    path.unlink()
+    assert watcher.check()
+
+    assert [str(path)] * 3 == calls
+
+
+def test_generation(mocker, tmp_path):
+    """Generations exist while watching, and increase with every change."""
+    mocker.patch.object(file_watcher, "_Inotify", side_effect=OSError)
+    watcher = file_watcher.FileWatcher(poll_interval=60)
+    path, _calls, _changed = _watched(tmp_path, watcher)
+    assert watcher.get_generation() is None
+    watcher.start()
+    try:
+        generation = watcher.get_generation()
+        path.write_text('{"version": 1}')
+        watcher.check()
+
+        assert generation + 1 == watcher.get_generation()
+    finally:
+        watcher.stop()
+    assert watcher.get_generation() is None
+
+
+def test_failing_callback_still_counts(mocker, tmp_path):
+    """A failing callback does not hide the change from views."""
+    mocker.patch.object(file_watcher, "_Inotify", side_effect=OSError)
+    watcher = file_watcher.FileWatcher(poll_interval=60)
+    path = tmp_path / "tests.json"
+    path.write_text("[]")
+    watcher.watch(str(path), lambda changed_path: 1 / 0)
+    watcher.start()
+    try:
+        generation = watcher.get_generation()
+        path.write_text("[{}]")
+        with pytest.raises(ZeroDivisionError):
+            watcher.check()
+
+        assert generation + 1 == watcher.get_generation()
+    finally:
+        watcher.stop()
+
+
+def test_inotify(tmp_path):
+    """Files replaced by a rename, like by other workers, get noticed."""
+    try:
+        file_watcher._Inotify().close()
+    except OSError:
+        pytest.skip("inotify is not available")
+    watcher = file_watcher.FileWatcher(poll_interval=60)
+    path, calls, changed = _watched(tmp_path, watcher)
+    watcher.start()
+    try:
+        (tmp_path / "new.json").write_text('{"version": 1}')
+        (tmp_path / "new.json").replace(path)
+        # Noticed by the first check or by inotify, the watches exist now
+        assert changed.wait(5)
+        changed.clear()
+        (tmp_path / "new.json").write_text('{"version": 22}')
+        (tmp_path / "new.json").replace(path)
+
+        assert changed.wait(5)
+        assert [str(path)] * 2 == calls
+    finally:
+        watcher.stop()
+
+
+def test_polling_without_inotify(mocker, tmp_path):
+    """Without inotify, the files get checked regularly."""
+    mocker.patch.object(file_watcher, "_Inotify", side_effect=OSError)
+    watcher = file_watcher.FileWatcher(poll_interval=0.01)
+    path, calls, changed = _watched(tmp_path, watcher)
+    watcher.start()
+    try:
+        path.write_text('{"version": 1}')
+
+        assert changed.wait(5)
+    finally:
+        watcher.stop()
+    assert [str(path)] == calls
@@ -0,0 +1,175 @@
+"""Verify the monitor of the default gateway."""
+import asyncio
+import concurrent.futures
+import socket
+
+import pytest
+
+from appliance_status import gateway_monitor
+
+PROC_ARP = """\
+IP address       HW type     Flags       HW address            Mask     Device
+192.0.2.1        0x1         0x2         02:00:00:00:00:01     *        eth0
+192.0.2.2        0x1         0x0         00:00:00:00:00:00     *        eth0
+192.0.2.3        0x1         0x6         02:00:00:00:00:03     *        eth0
+"""
+
+
+@pytest.mark.parametrize(
+    "address,state",
+    (
+        ("192.0.2.1", ("reachable", "02:00:00:00:00:01")),
+        ("192.0.2.2", ("incomplete", None)),
+        ("192.0.2.3", ("permanent", "02:00:00:00:00:03")),
+        ("192.0.2.4", ("missing", None)),
+    ),
+)
+def test_read_arp_state(mocker, tmp_path, address, state):
+    """The flags of the ARP entry tell its state."""
+    proc_arp = tmp_path / "arp"
+    proc_arp.write_text(PROC_ARP)
+    mocker.patch.object(gateway_monitor, "PROC_ARP", str(proc_arp))
+
+    assert state == gateway_monitor.read_arp_state(address)
+
+
+def test_measure_rtt_accepted_and_refused():
+    """Accepted and refused connections are both answers."""
+    with socket.socket() as listening:
+        listening.bind(("127.0.0.1", 0))
+        listening.listen()
+        port = listening.getsockname()[1]
+
+        accepted = asyncio.run(gateway_monitor.measure_rtt("127.0.0.1", port))
+    refused = asyncio.run(gateway_monitor.measure_rtt("127.0.0.1", port))
+
+    assert accepted >= 0
+    assert refused >= 0
+
+
+def test_measure_rtt_lost(mocker):
+    """Without answer in time, the probe is lost."""
+    mocker.patch(
+        "appliance_status.gateway_monitor.asyncio.open_connection",
+        side_effect=asyncio.TimeoutError,
+    )
+
+    assert asyncio.run(gateway_monitor.measure_rtt("192.0.2.1")) is None
+
+
+def test_measure_udp_rtt_answered_and_refused():
+    """Answers as well as ICMP port unreachable count."""
+    with socket.socket(type=socket.SOCK_DGRAM) as server:
+        server.bind(("127.0.0.1", 0))
+        port = server.getsockname()[1]
+
+        async def answer():
+            loop = asyncio.get_running_loop()
+            measuring = asyncio.ensure_future(
+                gateway_monitor.measure_udp_rtt("127.0.0.1", port)
+            )
+            data, address = await loop.run_in_executor(None, server.recvfrom, 512)
+            server.sendto(data, address)
+            return await measuring
+
+        answered = asyncio.run(answer())
+    refused = asyncio.run(gateway_monitor.measure_udp_rtt("127.0.0.1", port))
+
+    assert answered >= 0
+    assert refused >= 0
+
+
+def test_measure_udp_rtt_lost():
+    """Without answer in time, the probe is lost."""
+    with socket.socket(type=socket.SOCK_DGRAM) as server:
+        server.bind(("127.0.0.1", 0))
+        port = server.getsockname()[1]
+
+        rtt = asyncio.run(
+            gateway_monitor.measure_udp_rtt("127.0.0.1", port, timeout=0.1)
+        )
+
+    assert rtt is None
+
+
+def test_probe_without_tcp_answer(mocker):
+    """Gateways dropping TCP are not lost, when they answer over UDP."""
+
+    async def measure_rtt(address, port):
+        return None
+
+    async def measure_udp_rtt(address, port):
+        return 2.0
+
+    mocker.patch("appliance_status.gateway_monitor.measure_rtt", measure_rtt)
+    mocker.patch("appliance_status.gateway_monitor.measure_udp_rtt", measure_udp_rtt)
+    mocker.patch(
+        "appliance_status.gateway_monitor.read_arp_state",
+        return_value=("reachable", "02:00:00:00:00:01"),
+    )
+    monitor = gateway_monitor.GatewayMonitor(lambda: None)
+
+    asyncio.run(monitor.probe({"GW": "192.0.2.1", "IF": "eth0"}))
+    status = monitor.get_status()
+
+    assert 0 == status["loss"]
+    assert 1 == status["no_tcp_answer"]
+    assert 2.0 == status["last_rtt_ms"]
+
+
+def test_probe_follows_route_changes(mocker):
+    """Probes fill the history, a new gateway starts over."""
+    rtts = iter((1.0, None, 3.0))
+
+    async def measure_rtt(address, port):
+        return next(rtts)
+
+    async def measure_udp_rtt(address, port):
+        return None
+
+    mocker.patch("appliance_status.gateway_monitor.measure_rtt", measure_rtt)
+    mocker.patch("appliance_status.gateway_monitor.measure_udp_rtt", measure_udp_rtt)
+    mocker.patch(
+        "appliance_status.gateway_monitor.read_arp_state",
+        return_value=("reachable", "02:00:00:00:00:01"),
+    )
+    monitor = gateway_monitor.GatewayMonitor(lambda: None)
+
+    assert monitor.get_status() is None
+
+    asyncio.run(monitor.probe({"GW": "192.0.2.1", "IF": "eth0"}))
+    asyncio.run(monitor.probe({"GW": "192.0.2.1", "IF": "eth0"}))
+    status = monitor.get_status()
+
+    assert 2 == status["samples"]
+    assert 0.5 == status["loss"]
+    assert status["last_rtt_ms"] is None
+    assert 1.0 == status["p95_ms"]
+    assert "reachable" == status["arp_state"]
+
+    asyncio.run(monitor.probe({"GW": "198.51.100.1", "IF": "wg0"}))
+    status = monitor.get_status()
+
+    assert "198.51.100.1" == status["gateway"]
+    assert 1 == status["samples"]
+    assert 3.0 == status["last_rtt_ms"]
+
+
+def test_start_again_after_fork(mocker):
+    """Probing starts once per process, also in forked workers."""
+    done = concurrent.futures.Future()
+    done.set_result(None)
+    submit = mocker.patch.object(
+        gateway_monitor.ATestManager,
+        "submit",
+        side_effect=lambda coro: coro.close() or done,
+    )
+    monitor = gateway_monitor.GatewayMonitor(lambda: None)
+
+    monitor.start()
+    monitor.start()
+    mocker.patch("appliance_status.background.os.getpid", return_value=-1)
+    monitor.start()
+    monitor.stop()
+
+    assert 2 == submit.call_count
@@ -0,0 +1,77 @@
+"""Verify the history of test results."""
+from appliance_status import history
+from appliance_status.test_types import ATestResult, ErrorResult
+
+
+def test_probe_history_wraps_around():
+    """Only the latest results are kept, oldest first."""
+    probe_history = history.ProbeHistory(size=3)
+
+    for finished in range(5):
+        probe_history.append(finished % 2 == 0, finished * 10.0, finished)
+
+    assert 3 == len(probe_history)
+    assert [2, 3, 4] == [sample["finished"] for sample in probe_history.samples()]
+    assert [True, False, True] == [
+        sample["passed"] for sample in probe_history.samples()
+    ]
+    assert 2 / 3 == probe_history.pass_rate()
+
+
+def test_probe_history_summary():
+    """Percentiles leave out results without timing, changes get tracked."""
+    probe_history = history.ProbeHistory(size=100)
+
+    for latency_ms in range(1, 101):
+        probe_history.append(True, float(latency_ms), 1.0)
+    probe_history.append(False, None, 2.0)
+
+    assert {
+        "samples": 100,
+        "pass_rate": 0.99,
+        "p50_ms": 51.0,
+        "p95_ms": 96.0,
+        "last_change": 2.0,
+    } == probe_history.summary()
+
+
+def test_probe_history_empty():
+    """Without results there is nothing to aggregate."""
+    probe_history = history.ProbeHistory()
+
+    assert {
+        "samples": 0,
+        "pass_rate": None,
+        "p50_ms": None,
+        "p95_ms": None,
+        "last_change": None,
+    } == probe_history.summary()
+    assert [] == probe_history.sparkline()
+
+
+def test_probe_history_sparkline():
+    """Bars scale between the fastest and the slowest result."""
+    probe_history = history.ProbeHistory()
+
+    probe_history.append(True, 10.0, 1.0)
+    probe_history.append(True, 80.0, 2.0)
+    probe_history.append(False, None, 3.0)
+
+    assert [("▁", True), ("█", True), ("▁", False)] == probe_history.sparkline()
+
+
+def test_probe_histories_add(faker):
+    """Results get added with their total, error results without one."""
+    histories = history.ProbeHistories(1)
+    description = faker.pystr()
+
+    histories.add(
+        0,
+        ATestResult("T", True, "a", 200, "OK", description, {"total": 5.0}),
+        1.0,
+    )
+    histories.add(0, ErrorResult("T", "a", 0, "Timeout", description), 2.0)
+
+    assert [5.0, None] == [
+        sample["latency_ms"] for sample in histories.get(0).samples()
+    ]
@@ -0,0 +1,81 @@
+"""Verify finding interfaces in the index."""
+import pytest
+
+from appliance_status.interface_index import InterfaceIndex
+
+
+def _interface(ifname, is_physical=False, default=False, families=()):
+    return {
+        "ifname": ifname,
+        "is_physical": is_physical,
+        "default": default,
+        "addr_info": [{"family": family} for family in families],
+    }
+
+
+@pytest.fixture
+def index():
+    """Return an index over a physical, a default and many virtual interfaces."""
+    return InterfaceIndex(
+        [
+            _interface("lo", families=("inet", "inet6")),
+            _interface("eth0", is_physical=True, families=("inet",)),
+            _interface("wg0", default=True, families=("inet", "inet6")),
+        ]
+        + [_interface("veth{}".format(number)) for number in range(120)]
+    )
+
+
+def _names(page):
+    return [interface["ifname"] for interface in page.interfaces]
+
+
+def test_main_interfaces_by_default(index):
+    """Without filters, physical and default interfaces get shown."""
+    page = index.query()
+
+    assert ["eth0", "wg0"] == _names(page)
+    assert 2 == page.total
+    assert 1 == page.pages
+
+
+@pytest.mark.parametrize(
+    "query,names",
+    (
+        (dict(kind="physical"), ["eth0"]),
+        (dict(kind="all", default=True), ["wg0"]),
+        (dict(kind="all", family="inet6"), ["lo", "wg0"]),
+        (dict(kind="virtual", family="inet"), ["lo", "wg0"]),
+        (dict(kind="all", names=["veth7", "missing", "lo"]), ["lo", "veth7"]),
+        (dict(names=["veth7"]), []),
+    ),
+)
+def test_filters(index, query, names):
+    """All filters have to match, the order of the interfaces stays."""
+    assert names == _names(index.query(**query))
+
+
+def test_pagination(index):
+    """Pages slice the matching interfaces."""
+    page = index.query(kind="virtual", page=3, per_page=50)
+
+    assert 122 == page.total
+    assert 3 == page.pages
+    assert ["veth98", "veth99"] == _names(page)[:2]
+    assert 22 == len(page.interfaces)
+
+
+@pytest.mark.parametrize(
+    "query",
+    (
+        dict(kind="horse"),
+        dict(family="ipx"),
+        dict(page=0),
+        dict(per_page=0),
+        dict(per_page=501),
+    ),
+)
+def test_bad_queries(index, query):
+    """Unknown filters and pages out of range are errors."""
+    with pytest.raises(ValueError):
+        index.query(**query)
@@ -0,0 +1,90 @@
+"""Verify sampling of interface counters."""
+import pytest
+
+from appliance_status import interface_stats
+
+PROC_NET_DEV = """\
+Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo:  1000      10    0    0    0     0          0         0  1000      10    0    0    0     0       0          0
+  eth0:  5000      50    1    2    0     0          0         0  3000      30    3    4    0     0       0          0
+"""  # noqa: E501
+
+
+def test_read_counters(mocker, tmp_path):
+    """All counters come from a single read of /proc/net/dev."""
+    proc_net_dev = tmp_path / "dev"
+    proc_net_dev.write_text(PROC_NET_DEV)
+    mocker.patch.object(interface_stats, "PROC_NET_DEV", str(proc_net_dev))
+
+    counters = interface_stats.read_counters()
+
+    assert {"lo", "eth0"} == set(counters)
+    assert (5000, 50, 1, 2, 3000, 30, 3, 4) == counters["eth0"]
+
+
+def test_read_counters_from_sysfs(mocker, tmp_path):
+    """Without /proc/net/dev, the statistics in sysfs get read."""
+    statistics = tmp_path / "eth0" / "statistics"
+    statistics.mkdir(parents=True)
+    for value, counter in enumerate(interface_stats.COUNTERS):
+        (statistics / counter).write_text("{}\n".format(value))
+    (tmp_path / "gone").mkdir()
+    mocker.patch.object(interface_stats, "PROC_NET_DEV", str(tmp_path / "missing"))
+    mocker.patch.object(interface_stats, "SYSFS_NET", str(tmp_path))
+
+    assert {"eth0": tuple(range(8))} == interface_stats.read_counters()
+
+
+@pytest.fixture
+def read_counters(mocker):
+    """Return the counters the sampler reads, one sample per second."""
+    mocker.patch("appliance_status.interface_stats.monotonic", side_effect=range(100))
+    return mocker.patch("appliance_status.interface_stats.read_counters")
+
+
+@pytest.fixture
+def sampler(read_counters):
+    """Return a sampler keeping two differences."""
+    return interface_stats.InterfaceStats(window=2)
+
+
+def _counters(rx_bytes, rx_errors=0):
+    return (rx_bytes, 0, rx_errors, 0, 0, 0, 0, 0)
+
+
+def test_rates(sampler, read_counters):
+    """Rates are per second, the average covers the window only."""
+    for rx_bytes in (0, 100, 400, 1000):
+        read_counters.return_value = {"eth0": _counters(rx_bytes)}
+        sampler.sample()
+
+    rates = sampler.get_rates(["eth0", "lo"])["eth0"]
+
+    assert 600 == rates["current"]["rx_bytes"]
+    assert 450 == rates["average"]["rx_bytes"]
+    assert 0 == rates["current"]["tx_errors"]
+
+
+def test_no_rates_before_two_samples(sampler, read_counters):
+    """A single sample tells nothing about rates."""
+    read_counters.return_value = {"eth0": _counters(100)}
+    sampler.sample()
+
+    assert {} == sampler.get_rates(["eth0"])
+
+
+def test_reset_and_removed_interfaces(sampler, read_counters):
+    """Reset counters are skipped, interfaces that are gone are forgotten."""
+    for counters in (
+        {"eth0": _counters(100, 1), "veth1": _counters(0)},
+        {"eth0": _counters(200, 3), "veth1": _counters(10)},
+        {"eth0": _counters(50, 0)},
+    ):
+        read_counters.return_value = counters
+        sampler.sample()
+
+    rates = sampler.get_rates(["eth0", "veth1"])
+
+    assert {"eth0"} == set(rates)
+    assert 2 == rates["eth0"]["current"]["rx_errors"]
@@ -0,0 +1,37 @@
+"""Verify the latency histograms."""
+from appliance_status import latency
+
+
+def test_rolling_histogram_buckets():
+    """Samples land in the first bucket with an upper bound not below them."""
+    histogram = latency.RollingHistogram(window=10, bounds=(1, 10))
+
+    for value in (0.5, 1, 3, 10, 11, 5000):
+        histogram.add(value)
+
+    assert [2, 2, 2] == histogram.counts
+    assert {"le_ms": [1, 10, None], "counts": [2, 2, 2], "samples": 6} == (
+        histogram.as_dict()
+    )
+
+
+def test_rolling_histogram_window():
+    """Only the latest samples are counted."""
+    histogram = latency.RollingHistogram(window=2, bounds=(1, 10))
+
+    for value in (0.5, 5, 50):
+        histogram.add(value)
+
+    assert [0, 1, 1] == histogram.counts
+    assert 2 == len(histogram)
+
+
+def test_latency_histograms():
+    """Phases without samples and unknown phases are left out."""
+    histograms = latency.LatencyHistograms(2)
+
+    histograms.add(1, {"connect": 3.0, "total": 4.0, "unknown": 1.0})
+
+    assert {} == histograms.get(0)
+    assert {"connect", "total"} == set(histograms.get(1))
+    assert 1 == histograms.get(1)["total"]["samples"]
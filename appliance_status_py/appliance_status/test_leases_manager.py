@@ -37,3 +37,82 @@ def test_leases_manager_non_existing_dir(tmp_path, faker):
     leases_mgr = leases_manager.LeasesManager(str(tmp_path / faker.name()))
 
     assert [] == leases_mgr.get_leases()
+
+
+LEASE = """# This is private data. Do not parse.
+ADDRESS=192.0.2.23
+NETMASK=255.255.255.0
+ROUTER=192.0.2.1
+SERVER_ADDRESS=192.0.2.1
+DNS=192.0.2.1 198.51.100.53
+LIFETIME=86400
+T1=43200
+T2=75600
+CLIENTID=ffc0ffee
+"""
+
+
+def test_parse_lease():
+    """Lease files of systemd-networkd get parsed into records."""
+    lease = leases_manager.parse_lease(LEASE, 2, 1000.0)
+
+    assert 2 == lease.ifindex
+    assert "192.0.2.23" == lease.address
+    assert "255.255.255.0" == lease.netmask
+    assert ("192.0.2.1",) == lease.routers
+    assert ("192.0.2.1", "198.51.100.53") == lease.dns
+    assert () == lease.ntp
+    assert "192.0.2.1" == lease.server_address
+    assert (86400, 43200, 75600) == (lease.lifetime, lease.t1, lease.t2)
+    assert 87400.0 == lease.expires
+    assert "ffc0ffee" == lease.values["CLIENTID"]
+
+
+def test_parse_lease_garbage(faker):
+    """Unknown formats give empty records, instead of failing."""
+    lease = leases_manager.parse_lease(faker.paragraph() + "\nLIFETIME=forever")
+
+    assert lease.address is None
+    assert lease.lifetime is None
+    assert lease.expires is None
+
+
+def test_lease_records_by_interface_index(tmp_path, faker):
+    """Leases get indexed by interface index, other files get left out."""
+    (tmp_path / "2").write_text(LEASE)
+    (tmp_path / faker.file_name()).write_text(faker.paragraph())
+    leases_mgr = leases_manager.LeasesManager(str(tmp_path))
+
+    records = leases_mgr.get_lease_records()
+
+    assert [2] == list(records)
+    assert "192.0.2.23" == records[2].address
+
+
+def test_lease_files_read_once(mocker, tmp_path):
+    """Unchanged files are not read again, changed and removed ones are noticed."""
+    lease_path = tmp_path / "2"
+    lease_path.write_text(LEASE)
+    leases_mgr = leases_manager.LeasesManager(str(tmp_path))
+    parse = mocker.spy(leases_manager, "parse_lease")
+
+    first = leases_mgr.get_lease_records()[2]
+    assert first is leases_mgr.get_lease_records()[2]
+    lease_path.write_text(LEASE.replace("192.0.2.23", "192.0.2.123"))
+    assert "192.0.2.123" == leases_mgr.get_lease_records()[2].address
+    lease_path.unlink()
+    assert {} == leases_mgr.get_lease_records()
+    assert 2 == parse.call_count
+
+
+def test_leases_and_records_in_one_pass(mocker, tmp_path):
+    """Texts and records come from a single read of the directory."""
+    (tmp_path / "2").write_text(LEASE)
+    leases_mgr = leases_manager.LeasesManager(str(tmp_path))
+    scandir = mocker.spy(leases_manager.os, "scandir")
+
+    leases, records = leases_mgr.get_leases_and_records()
+
+    assert [LEASE] == leases
+    assert [2] == list(records)
+    assert 1 == scandir.call_count
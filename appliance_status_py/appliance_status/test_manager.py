@@ -1,8 +1,64 @@
 """Responsible for loading test configurations and for running them."""
+import asyncio
 import concurrent.futures
+import os
+import threading
 
 from appliance_status import test_types
 
+# Seconds between two runs of a test, if tests.json does not say otherwise
+DEFAULT_INTERVAL = 60
+# Seconds a single test may take, if tests.json does not say otherwise
+DEFAULT_TIMEOUT = 10
+# Upper bound of tests running at the same time, on the loop and in threads
+MAX_CONCURRENT_TESTS = 32
+MAX_WORKERS = 8
+
+
+class _TestEngine:
+    """
+    Process wide event loop, running in a daemon thread.
+
+    All tests of a process run on this loop. Tests that only implement the
+    blocking `test` method run in a bounded thread pool instead of a thread
+    each. Both get created on first use, and again after a fork, since
+    threads do not survive one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self.loop = None
+        self.executor = None
+        self.semaphore = None
+
+    def _ensure_running(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix="network-test"
+            )
+            self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_TESTS)
+            self.loop = asyncio.new_event_loop()
+            self.loop.set_default_executor(self.executor)
+            threading.Thread(
+                target=self.loop.run_forever, name="network-tests", daemon=True
+            ).start()
+            self._pid = os.getpid()
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Schedule `coro` on the loop, return a future usable from any thread."""
+        self._ensure_running()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+_engine = _TestEngine()
+
+
+def _address_of(test):
+    return getattr(test, "_address", "")
+
 
 class ATestManager:
     """Implements all responsibilities of the module."""
@@ -12,23 +68,122 @@ class ATestManager:
         Create an instance of the TestManager.
 
         Loads the test definition from the provided `test_file`
+        Each entry may define `options`, passed as keyword arguments to the
+        test type, an `interval` in seconds, telling how often the
+        test should be repeated when run in the background, and a `timeout`
+        in seconds, after which the test counts as timed out.
         """
         self.tests = []
+        self.intervals = []
+        self.timeouts = []
         for entry in test_config:
             self.tests.append(
                 getattr(test_types, entry["TestType"])(
-                    *entry["args"], description=entry["description"]
+                    *entry["args"],
+                    description=entry["description"],
+                    **entry.get("options", {})
+                )
+            )
+            interval = entry.get("interval", DEFAULT_INTERVAL)
+            if interval <= 0:
+                raise ValueError("The interval of a test must be positive")
+            self.intervals.append(interval)
+            timeout = entry.get("timeout", DEFAULT_TIMEOUT)
+            if timeout <= 0:
+                raise ValueError("The timeout of a test must be positive")
+            self.timeouts.append(timeout)
+
+    @staticmethod
+    def submit(coro) -> concurrent.futures.Future:
+        """Run `coro` on the process wide test loop."""
+        return _engine.submit(coro)
+
+    @staticmethod
+    async def perform_network_test(test, log, timeout=DEFAULT_TIMEOUT):
+        """
+        Perform a single test on the process wide test loop.
+
+        Tests providing an `atest` coroutine run on the loop itself, tests that
+        only know the blocking `test` method get handed to the shared executor.
+        A test not finishing within `timeout` seconds results in a timeout
+        result, a test raising an exception in a generic error result.
+        """
+        log.info("Performing test", test=test)
+        atest = getattr(test, "atest", None)
+        try:
+            async with _engine.semaphore:
+                if atest is not None:
+                    return await asyncio.wait_for(atest(log), timeout=timeout)
+                loop = asyncio.get_running_loop()
+                return await asyncio.wait_for(
+                    loop.run_in_executor(_engine.executor, test.test, log),
+                    timeout=timeout,
                 )
+        except asyncio.TimeoutError:
+            log.info("Test timed out", test=test, timeout=timeout)
+            return test_types._make_timeout_error_result(
+                test.test_type, _address_of(test), test.description
+            )
+        except Exception as exc:
+            log.exception("Test failed unexpectedly", test=test)
+            return test_types._make_generic_error_result(
+                test.test_type, _address_of(test), test.description, exc
             )
 
-    def perform_network_tests(self, log):
-        """Perform network tests and return the results."""
-        futures = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=100) as executor:
-            for test in self.tests:
-                futures.append((test, executor.submit(test.test, log.bind())))
-            results = []
-            for test, future in futures:
-                log.info("Getting future", future=future, test=test)
-                results.append(future.result())
-            return results
+    def submit_network_tests(self, log):
+        """Start all network tests, return a future for each of them."""
+        return [
+            self.submit(self.perform_network_test(test, log.bind(), timeout))
+            for test, timeout in zip(self.tests, self.timeouts)
+        ]
+
+    def iter_network_tests(self, log, deadline=None):
+        """
+        Perform network tests, yield index and result of each as it finishes.
+
+        Results come in the order the tests finish. With a `deadline` in
+        seconds, tests still pending by then get cancelled and yielded as timed
+        out. Closing the generator early cancels all pending tests.
+        """
+        futures = dict(
+            (future, index)
+            for index, future in enumerate(self.submit_network_tests(log))
+        )
+        pending = set(futures)
+        try:
+            try:
+                for future in concurrent.futures.as_completed(
+                    futures, timeout=deadline
+                ):
+                    pending.discard(future)
+                    yield futures[future], future.result()
+            except concurrent.futures.TimeoutError:
+                pass
+            for future in sorted(pending, key=futures.get):
+                pending.discard(future)
+                index = futures[future]
+                # Cancelling only succeeds, if the test did not finish yet
+                if future.cancel():
+                    test = self.tests[index]
+                    log.info("Deadline passed for test", test=test, deadline=deadline)
+                    yield index, test_types._make_timeout_error_result(
+                        test.test_type, _address_of(test), test.description
+                    )
+                else:
+                    yield index, future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def perform_network_tests(self, log, deadline=None):
+        """
+        Perform network tests and return the results.
+
+        With a `deadline` in seconds, wait at most that long for all tests.
+        Tests still pending by then get cancelled and reported as timed out,
+        results of finished tests get returned as they are.
+        """
+        results = [None] * len(self.tests)
+        for index, result in self.iter_network_tests(log, deadline):
+            results[index] = result
+        return results
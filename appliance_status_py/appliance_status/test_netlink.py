@@ -0,0 +1,183 @@
+"""Verify parsing of rtnetlink messages, without talking to the kernel."""
+import socket
+import struct
+
+import pytest
+
+from appliance_status import netlink
+
+
+def _attribute(type_, value):
+    length = 4 + len(value)
+    return struct.pack("=HH", length, type_) + value + bytes(-length % 4)
+
+
+def _message(type_, sequence, payload):
+    length = 16 + len(payload)
+    return struct.pack("=LHHLL", length, type_, 0, sequence, 0) + payload
+
+
+def _link(index, name, flags):
+    return (
+        netlink._IFINFOMSG.pack(socket.AF_UNSPEC, 1, index, flags, 0)
+        + _attribute(netlink.IFLA_IFNAME, name.encode() + b"\0")
+        + _attribute(netlink.IFLA_MTU, struct.pack("=L", 1500))
+        + _attribute(netlink.IFLA_OPERSTATE, b"\x06")
+        + _attribute(netlink.IFLA_ADDRESS, bytes([2, 0, 0, 0, 0, 1]))
+    )
+
+
+def _address(index, family, local, prefixlen, flags=0, scope=0):
+    return (
+        netlink._IFADDRMSG.pack(family, prefixlen, flags, scope, index)
+        + _attribute(netlink.IFA_ADDRESS, socket.inet_pton(family, local))
+        + _attribute(netlink.IFA_CACHEINFO, struct.pack("=LLLL", 10, 20, 0, 0))
+    )
+
+
+class FakeSocket:
+    """Answer every request with the next prepared answer."""
+
+    def __init__(self, *answers):
+        """Prepare the answers, one list of (type, payload) per request."""
+        self.answers = list(answers)
+        self.sequence = None
+
+    def send(self, data):
+        """Remember the sequence number of the request."""
+        self.sequence = struct.unpack_from("=LHHLL", data)[3]
+
+    def recv(self, size):
+        """Return all messages of the next answer, followed by NLMSG_DONE."""
+        return b"".join(
+            _message(type_, self.sequence, payload)
+            for type_, payload in self.answers.pop(0) + [(netlink.NLMSG_DONE, b"")]
+        )
+
+    def __enter__(self):
+        """Act like a socket."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Act like a socket."""
+
+
+def test_flag_names():
+    """Flags are named and ordered like ip does it."""
+    assert ["BROADCAST", "MULTICAST", "UP", "LOWER_UP"] == netlink.flag_names(
+        0x1 | 0x2 | 0x40 | 0x1000 | 0x10000
+    )
+    assert ["NO-CARRIER", "BROADCAST", "UP"] == netlink.flag_names(0x1 | 0x2)
+
+
+def test_get_interfaces(mocker):
+    """Links and addresses get merged into the structure of ip --json addr."""
+    fake = FakeSocket(
+        [(netlink.RTM_NEWLINK, _link(2, "eth0", 0x1 | 0x40 | 0x10000))],
+        [
+            (netlink.RTM_NEWADDR, _address(2, socket.AF_INET, "10.0.0.2", 24)),
+            (
+                netlink.RTM_NEWADDR,
+                _address(2, socket.AF_INET6, "fe80::1", 64, 0x80, 253),
+            ),
+            (netlink.RTM_NEWADDR, _address(9, socket.AF_INET, "10.0.9.2", 24)),
+        ],
+    )
+    mocker.patch("appliance_status.netlink._open", return_value=fake)
+
+    assert [
+        {
+            "ifindex": 2,
+            "ifname": "eth0",
+            "flags": ["UP", "LOWER_UP"],
+            "mtu": 1500,
+            "operstate": "UP",
+            "address": "02:00:00:00:00:01",
+            "addr_info": [
+                {
+                    "family": "inet",
+                    "local": "10.0.0.2",
+                    "prefixlen": 24,
+                    "scope": "global",
+                    "dynamic": True,
+                    "valid_life_time": 20,
+                    "preferred_life_time": 10,
+                },
+                {
+                    "family": "inet6",
+                    "local": "fe80::1",
+                    "prefixlen": 64,
+                    "scope": "link",
+                    "valid_life_time": 20,
+                    "preferred_life_time": 10,
+                },
+            ],
+        }
+    ] == netlink.get_interfaces()
+
+
+def _route(gateway, oif, priority, dst_len=0, table=netlink.RT_TABLE_MAIN):
+    return (
+        netlink._RTMSG.pack(socket.AF_INET, dst_len, 0, 0, table, 0, 0, 1, 0)
+        + _attribute(netlink.RTA_GATEWAY, socket.inet_aton(gateway))
+        + _attribute(netlink.RTA_OIF, struct.pack("=L", oif))
+        + _attribute(netlink.RTA_PRIORITY, struct.pack("=L", priority))
+    )
+
+
+def test_get_default_route(mocker):
+    """The default route of the main table with the lowest metric wins."""
+    fake = FakeSocket(
+        [
+            (netlink.RTM_NEWROUTE, _route("10.0.1.1", 3, 600)),
+            (netlink.RTM_NEWROUTE, _route("10.0.0.1", 2, 100)),
+            (netlink.RTM_NEWROUTE, _route("10.0.2.1", 4, 0, dst_len=24)),
+            (netlink.RTM_NEWROUTE, _route("10.0.3.1", 5, 0, table=255)),
+        ]
+    )
+    mocker.patch("appliance_status.netlink._open", return_value=fake)
+    names = mocker.patch("appliance_status.netlink.socket.if_indextoname")
+    names.return_value = "eth0"
+
+    assert {"GW": "10.0.0.1", "IF": "eth0"} == netlink.get_default_route()
+    names.assert_called_once_with(2)
+
+
+def test_get_default_route_missing(mocker):
+    """No default route is an error, not a reason to try another backend."""
+    mocker.patch("appliance_status.netlink._open", return_value=FakeSocket([]))
+
+    with pytest.raises(Exception) as exc:
+        netlink.get_default_route()
+
+    assert ("No default route",) == exc.value.args
+
+
+def test_dump_error(mocker):
+    """Errors of the kernel become an OSError."""
+    fake = FakeSocket([(netlink.NLMSG_ERROR, struct.pack("=i", -1) + bytes(16))])
+    mocker.patch("appliance_status.netlink._open", return_value=fake)
+
+    with pytest.raises(OSError):
+        netlink.get_interfaces()
+
+
+def test_read_events(mocker):
+    """Changes of links, addresses and default routes become events."""
+    fake = FakeSocket(
+        [
+            (netlink.RTM_DELLINK, _link(3, "eth1", 0)),
+            (netlink.RTM_NEWADDR, _address(2, socket.AF_INET, "10.0.0.2", 24)),
+            (netlink.RTM_NEWROUTE, _route("10.0.0.1", 2, 0)),
+            (netlink.RTM_NEWROUTE, _route("10.0.2.1", 2, 0, dst_len=24)),
+        ]
+    )
+    fake.sequence = 0
+
+    events = netlink.read_events(fake)
+
+    assert [("link", True, 3), ("address", False, 2), ("route", False, None)] == [
+        (event.kind, event.deleted, event.index) for event in events
+    ]
+    assert "eth1" == events[0].data["ifname"]
+    assert "10.0.0.2" == events[1].data["local"]
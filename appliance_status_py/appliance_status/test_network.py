@@ -1,4 +1,5 @@
 """Verify network module functionality."""
+import ipaddress
 import json
 import math
 import sys
@@ -8,6 +9,14 @@ import pytest
 from appliance_status import network
 
 
+@pytest.fixture
+def ip_command(mocker):
+    """Pretend the kernel can not be asked directly, so that `ip` gets run."""
+    mocker.patch.object(network, "_INTERFACE_BACKENDS", ())
+    mocker.patch.object(network, "_ROUTE_BACKENDS", ())
+    mocker.patch.object(network, "_ip_commands", network._IPCommands())
+
+
 def test_prefix_to_net_mask_good():
     """For the sake of completeness."""
     assert "255.128.0.0" == network._prefix_to_netmask(9)
@@ -31,6 +40,67 @@ def test_prefix_to_net_mask_bad2(bad_prefix):
         network._prefix_to_netmask(bad_prefix)
 
 
+@pytest.mark.parametrize(
+    "address",
+    (
+        "192.0.2.130/25",
+        "10.1.2.3/8",
+        "10.0.0.1/31",
+        "10.0.0.1/32",
+        "0.0.0.0/0",
+        "2001:db8::1/64",
+        "fe80::1:2/126",
+        "2001:db8::1/127",
+        "::1/128",
+    ),
+)
+def test_add_address_details(address):
+    """Details match the ones of the ipaddress module."""
+    interface = ipaddress.ip_interface(address)
+    addr_info = {
+        "family": "inet" if interface.version == 4 else "inet6",
+        "local": str(interface.ip),
+        "prefixlen": interface.network.prefixlen,
+    }
+
+    network._add_address_details([addr_info])
+
+    assert str(interface.network.network_address) == addr_info["network"]
+    if interface.network.num_addresses <= 256:
+        assert len(list(interface.network.hosts())) == addr_info["hosts"]
+    if interface.version == 4:
+        assert str(interface.netmask) == addr_info["netmask"]
+        assert str(interface.network.broadcast_address) == addr_info["broadcast"]
+    else:
+        assert {"netmask", "broadcast"}.isdisjoint(addr_info)
+
+
+def test_add_address_details_host_count():
+    """Host counts of large networks come from the tables."""
+    addresses = [
+        {"family": "inet", "local": "10.0.0.1", "prefixlen": 8},
+        {"family": "inet6", "local": "2001:db8::1", "prefixlen": 64},
+    ]
+
+    network._add_address_details(addresses)
+
+    assert [2 ** 24 - 2, 2 ** 64 - 1] == [addr_info["hosts"] for addr_info in addresses]
+
+
+def test_add_address_details_keeps_broadcast():
+    """A broadcast address configured on the interface wins."""
+    addr_info = {
+        "family": "inet",
+        "local": "10.0.0.1",
+        "prefixlen": 24,
+        "broadcast": "10.0.0.0",
+    }
+
+    network._add_address_details([addr_info])
+
+    assert "10.0.0.0" == addr_info["broadcast"]
+
+
 @pytest.mark.parametrize(
     "if_name,is_physical",
     (
@@ -49,7 +119,7 @@ def test_is_physical_address(if_name, is_physical):
     assert is_physical == network._is_physical_address_name(if_name)
 
 
-def test_get_network_information_good(mocker):
+def test_get_network_information_good(mocker, ip_command):
     """At one time, the output will change. Validate that the error makes sense."""
     subprocess = mocker.patch("appliance_status.network.subprocess")
     subprocess.TimeoutExpired = type("TimeoutExpired", (BaseException,), {})
@@ -90,7 +160,7 @@ def test_get_network_information_good(mocker):
     assert expectation == network_information
 
 
-def test_get_network_information_output_changed2(mocker):
+def test_get_network_information_output_changed2(mocker, ip_command):
     """At one time, the output will change. Validate that the error makes sense."""
     subprocess = mocker.patch("appliance_status.network.subprocess")
     subprocess.TimeoutExpired = type("TimeoutExpired", (BaseException,), {})
@@ -104,7 +174,7 @@ def test_get_network_information_output_changed2(mocker):
     assert ("Unknown output format of ip --json addr command",) == exc.value.args
 
 
-def test_get_network_information_output_changed1(mocker):
+def test_get_network_information_output_changed1(mocker, ip_command):
     """At one time, the output will change. Validate that the error makes sense."""
     subprocess = mocker.patch("appliance_status.network.subprocess")
     subprocess.TimeoutExpired = type("TimeoutExpired", (BaseException,), {})
@@ -123,7 +193,7 @@ def test_get_network_information_output_changed1(mocker):
     assert ("Unknown output format of ip --json addr command",) == exc.value.args
 
 
-def test_get_network_information_return_code_not_null(mocker):
+def test_get_network_information_return_code_not_null(mocker, ip_command):
     """Verify that we fail hard on bad return code of ip command."""
     subprocess = mocker.patch("appliance_status.network.subprocess")
     subprocess.Popen().returncode = 1
@@ -133,11 +203,12 @@ def test_get_network_information_return_code_not_null(mocker):
         network.get_network_information("eth0")
 
 
-def test_get_network_information_fail_if_too_slow(mocker):
+def test_get_network_information_fail_if_too_slow(mocker, ip_command):
     """Verify that we fail hard on bad return code of ip command."""
     subprocess = mocker.patch("appliance_status.network.subprocess")
     subprocess.TimeoutExpired = type("TimeoutExpired", (BaseException,), {})
     subprocess.Popen().communicate.side_effect = subprocess.TimeoutExpired()
+    mocker.patch("appliance_status.network.monotonic", return_value=0)
 
     with pytest.raises(Exception):
         network.get_network_information("eth0")
@@ -145,7 +216,7 @@ def test_get_network_information_fail_if_too_slow(mocker):
     assert 2 == subprocess.Popen().communicate.call_args.kwargs["timeout"]
 
 
-def test_get_default_route_good(mocker, faker):
+def test_get_default_route_good(mocker, faker, ip_command):
     """Verify that we get a default route that makes sense."""
     subprocess = mocker.patch("appliance_status.network.subprocess")
     subprocess.TimeoutExpired = type("TimeoutExpired", (BaseException,), {})
@@ -160,7 +231,7 @@ def test_get_default_route_good(mocker, faker):
     assert expectation == route_info
 
 
-def test_get_default_route_cant_parse_answer(mocker):
+def test_get_default_route_cant_parse_answer(mocker, ip_command):
     """At one time, the output will change. Validate that the error makes sense."""
     subprocess = mocker.patch("appliance_status.network.subprocess")
     subprocess.TimeoutExpired = type("TimeoutExpired", (BaseException,), {})
@@ -174,7 +245,7 @@ def test_get_default_route_cant_parse_answer(mocker):
     assert ("Unknown output format of ip route command",) == exc.value.args
 
 
-def test_get_default_route_return_code_not_null(mocker):
+def test_get_default_route_return_code_not_null(mocker, ip_command):
     """Verify that we fail hard on bad return code of ip command."""
     subprocess = mocker.patch("appliance_status.network.subprocess")
     subprocess.Popen().returncode = 1
@@ -184,13 +255,232 @@ def test_get_default_route_return_code_not_null(mocker):
         network.get_default_route()
 
 
-def test_get_default_route_fail_if_too_slow(mocker):
+def test_get_default_route_fail_if_too_slow(mocker, ip_command):
     """Verify that we fail hard on bad return code of ip command."""
     subprocess = mocker.patch("appliance_status.network.subprocess")
     subprocess.TimeoutExpired = type("TimeoutExpired", (BaseException,), {})
     subprocess.Popen().communicate.side_effect = subprocess.TimeoutExpired()
+    mocker.patch("appliance_status.network.monotonic", return_value=0)
 
     with pytest.raises(Exception):
         network.get_default_route()
 
     assert 2 == subprocess.Popen().communicate.call_args.kwargs["timeout"]
+
+
+def _ip_process(mocker, stdout, returncode=0):
+    process = mocker.Mock(returncode=returncode)
+    process.communicate.return_value = (stdout, None)
+    return process
+
+
+def test_ip_commands_share_one_deadline(mocker, ip_command):
+    """Both commands run at the same time, the second only gets the time left."""
+    clock = mocker.patch("appliance_status.network.monotonic")
+    clock.side_effect = [10.0, 10.5, 11.5, 12.0]
+    addr = _ip_process(mocker, b"[]")
+    route = _ip_process(mocker, b"default via 192.0.2.1 dev eth0")
+    popen = mocker.patch(
+        "appliance_status.network.subprocess.Popen", side_effect=[addr, route]
+    )
+
+    result = network._ip_commands.get("route")
+
+    assert 2 == popen.call_count
+    assert 1.5 == addr.communicate.call_args.kwargs["timeout"]
+    assert 0.5 == route.communicate.call_args.kwargs["timeout"]
+    assert ({"GW": "192.0.2.1", "IF": "eth0"}, False) == result
+
+
+def test_ip_commands_reused_within_a_second(mocker, ip_command):
+    """Interfaces and route of one page come from the same run."""
+    popen = mocker.patch(
+        "appliance_status.network.subprocess.Popen",
+        side_effect=[
+            _ip_process(mocker, b"[]"),
+            _ip_process(mocker, b"default via 192.0.2.1 dev eth0"),
+        ],
+    )
+
+    assert [] == network.get_network_information("eth0")
+    assert {"GW": "192.0.2.1", "IF": "eth0"} == network.get_default_route()
+    assert 2 == popen.call_count
+
+
+def test_ip_commands_serve_stale_data(mocker, ip_command):
+    """After a good run, failing commands answer with the last good result."""
+    stdout = json.dumps([{"ifname": "eth0", "addr_info": []}]).encode()
+    mocker.patch(
+        "appliance_status.network.subprocess.Popen",
+        side_effect=[
+            _ip_process(mocker, stdout),
+            _ip_process(mocker, b"default via 192.0.2.1 dev eth0"),
+            _ip_process(mocker, None, returncode=1),
+            _ip_process(mocker, b"Oh no"),
+        ],
+    )
+    clock = mocker.patch("appliance_status.network.monotonic", return_value=0)
+    network.get_default_route()
+    clock.return_value = 100
+
+    interfaces = network.get_network_information("eth0")
+    route = network.get_default_route()
+
+    assert [True] == [entry["stale"] for entry in interfaces]
+    assert {"GW": "192.0.2.1", "IF": "eth0", "stale": True} == route
+
+
+def test_ip_commands_kill_slow_commands(mocker, ip_command):
+    """Commands still running after the deadline get killed."""
+    subprocess = mocker.patch("appliance_status.network.subprocess")
+    subprocess.TimeoutExpired = type("TimeoutExpired", (BaseException,), {})
+    subprocess.Popen().communicate.side_effect = subprocess.TimeoutExpired()
+    subprocess.Popen().returncode = None
+
+    with pytest.raises(Exception) as exc:
+        network.get_default_route()
+
+    assert ("Timeout while trying to get network information",) == exc.value.args
+    assert subprocess.Popen().kill.called
+    assert subprocess.Popen().wait.called
+
+
+def test_ip_commands_reap_killed_commands(mocker):
+    """Killed commands get waited for, they do not stay around as zombies."""
+    mocker.patch.object(network, "_IP_COMMANDS", {"addr": (["sleep", "5"], len)})
+    popen = mocker.spy(network.subprocess, "Popen")
+
+    with pytest.raises(Exception):
+        network._IPCommands(deadline=0.1).get("addr")
+
+    assert -9 == popen.spy_return.returncode
+
+
+def _failing_backend(mocker):
+    backend = mocker.Mock(side_effect=OSError)
+    backend.__name__ = "failing"
+    return backend
+
+
+def test_get_network_information_falls_back(mocker):
+    """Without netlink, sysfs gets used, without both the ip command."""
+    backend = _failing_backend(mocker)
+    mocker.patch.object(network, "_INTERFACE_BACKENDS", (backend, backend))
+    ip = mocker.patch("appliance_status.network._ip_get_network_information")
+
+    network_information = network.get_network_information("eth0")
+
+    assert 2 == backend.call_count
+    assert ip.return_value == network_information
+
+
+def test_get_network_information_from_kernel(mocker):
+    """Interfaces read from the kernel get the same details as from ip."""
+    interfaces = mocker.Mock(
+        return_value=[
+            dict(ifname="eth0", addr_info=[dict(prefixlen=24, family="inet")])
+        ]
+    )
+    mocker.patch.object(network, "_INTERFACE_BACKENDS", (interfaces,))
+    subprocess = mocker.patch("appliance_status.network.subprocess")
+
+    network_information = network.get_network_information("eth0")
+
+    assert not subprocess.Popen.called
+    assert [
+        {
+            "addr_info": [
+                {"netmask": "255.255.255.0", "prefixlen": 24, "family": "inet"}
+            ],
+            "default": True,
+            "ifname": "eth0",
+            "is_physical": True,
+        }
+    ] == network_information
+
+
+def test_get_default_route_falls_back(mocker):
+    """Without netlink, procfs gets used."""
+    route = {"GW": "10.0.0.1", "IF": "eth0"}
+    mocker.patch.object(
+        network,
+        "_ROUTE_BACKENDS",
+        (_failing_backend(mocker), mocker.Mock(return_value=route)),
+    )
+    ip = mocker.patch("appliance_status.network._ip_get_default_route")
+
+    assert route == network.get_default_route()
+    assert not ip.called
+
+
+def test_sysfs_get_interfaces(mocker, tmp_path):
+    """Interfaces come from sysfs, IPv4 from ioctls, IPv6 from procfs."""
+    eth0 = tmp_path / "net" / "eth0"
+    eth0.mkdir(parents=True)
+    for name, value in (
+        ("ifindex", "2"),
+        ("flags", "0x1003"),
+        ("carrier", "1"),
+        ("mtu", "1500"),
+        ("operstate", "up"),
+        ("address", "02:00:00:00:00:01"),
+    ):
+        (eth0 / name).write_text(value + "\n")
+    if_inet6 = tmp_path / "if_inet6"
+    if_inet6.write_text(
+        "fe800000000000000000000000000001 02 40 20 80     eth0\n"
+        "20010db8000000000000000000000001 02 40 00 00     eth0\n"
+    )
+    mocker.patch.object(network, "SYSFS_NET", str(tmp_path / "net"))
+    mocker.patch.object(network, "PROC_IF_INET6", str(if_inet6))
+    mocker.patch(
+        "appliance_status.network._ioctl_ipv4", return_value=("10.0.0.2", 24)
+    )
+
+    (interface,) = network._sysfs_get_interfaces()
+
+    assert {
+        "ifindex": 2,
+        "ifname": "eth0",
+        "flags": ["BROADCAST", "MULTICAST", "UP", "LOWER_UP"],
+        "mtu": 1500,
+        "operstate": "UP",
+        "address": "02:00:00:00:00:01",
+        "addr_info": [
+            {"family": "inet", "local": "10.0.0.2", "prefixlen": 24, "label": "eth0"},
+            {"family": "inet6", "local": "fe80::1", "prefixlen": 64, "scope": "link"},
+            {
+                "family": "inet6",
+                "local": "2001:db8::1",
+                "prefixlen": 64,
+                "scope": "global",
+                "dynamic": True,
+            },
+        ],
+    } == interface
+
+
+def test_proc_get_default_route(mocker, tmp_path):
+    """The default route with the lowest metric wins."""
+    route = tmp_path / "route"
+    route.write_text(
+        "Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\n"
+        "eth1\t00000000\t0101A8C0\t0003\t0\t0\t600\t00000000\n"
+        "eth0\t00000000\t010200C0\t0003\t0\t0\t100\t00000000\n"
+        "eth0\t000200C0\t00000000\t0001\t0\t0\t0\t00FFFFFF\n"
+    )
+    mocker.patch.object(network, "PROC_ROUTE", str(route))
+
+    assert {"GW": "192.0.2.1", "IF": "eth0"} == network._proc_get_default_route()
+
+
+def test_proc_get_default_route_missing(mocker, tmp_path):
+    """No default route is an error, not a reason to try the next backend."""
+    route = tmp_path / "route"
+    route.write_text("Iface\tDestination\tGateway \tFlags\n")
+    mocker.patch.object(network, "PROC_ROUTE", str(route))
+
+    with pytest.raises(Exception) as exc:
+        network._proc_get_default_route()
+
+    assert ("No default route",) == exc.value.args
@@ -0,0 +1,133 @@
+"""Verify the snapshot of the network watcher."""
+import time
+
+import pytest
+
+from appliance_status import network_watcher
+from appliance_status.netlink import Event
+
+
+def _eth0(*addresses):
+    return {
+        "ifindex": 2,
+        "ifname": "eth0",
+        "flags": ["UP"],
+        "addr_info": [
+            {"family": "inet", "local": local, "prefixlen": 24} for local in addresses
+        ],
+    }
+
+
+@pytest.fixture
+def watcher(mocker):
+    """Return a watcher with a snapshot of a single interface."""
+    netlink = mocker.patch("appliance_status.network_watcher.netlink")
+    netlink.get_interfaces.return_value = [_eth0("10.0.0.2")]
+    netlink.get_default_route.return_value = {"GW": "10.0.0.1", "IF": "eth0"}
+    watcher = network_watcher.NetworkWatcher()
+    watcher._resync()
+    return watcher
+
+
+def test_snapshot(watcher):
+    """Pages get the interfaces and details from the snapshot."""
+    (interface,) = watcher.get_network_information("eth0")
+
+    assert 1 == watcher.get_version()
+    assert interface["default"]
+    assert "255.255.255.0" == interface["addr_info"][0]["netmask"]
+    assert {"GW": "10.0.0.1", "IF": "eth0"} == watcher.get_default_route()
+
+
+def test_snapshot_is_not_shared(watcher):
+    """Adding details does not change the snapshot."""
+    watcher.get_network_information("eth0")
+
+    assert "default" not in watcher._interfaces[2]
+
+
+def test_resync_without_change(watcher):
+    """Reading the same state again keeps the version."""
+    watcher._resync()
+
+    assert 1 == watcher.get_version()
+
+
+def test_apply_address_events(watcher):
+    """Addresses get added, updated in place and removed."""
+    new = {"family": "inet", "local": "10.0.1.2", "prefixlen": 24}
+    updated = {"family": "inet", "local": "10.0.0.2", "prefixlen": 24, "dynamic": True}
+
+    watcher._apply([Event("address", False, 2, new)])
+    watcher._apply([Event("address", False, 2, updated)])
+    watcher._apply([Event("address", False, 2, updated)])
+    (interface,) = watcher.get_network_information("eth0")
+
+    assert 3 == watcher.get_version()
+    assert ["10.0.0.2", "10.0.1.2"] == [
+        addr_info["local"] for addr_info in interface["addr_info"]
+    ]
+    assert interface["addr_info"][0]["dynamic"]
+
+    watcher._apply([Event("address", True, 2, new)])
+
+    assert 4 == watcher.get_version()
+    assert 1 == len(watcher.get_network_information("eth0")[0]["addr_info"])
+
+
+def test_apply_link_events(watcher):
+    """Links keep their addresses on changes, and get removed."""
+    link = dict(_eth0(), flags=["UP", "LOWER_UP"])
+
+    watcher._apply([Event("link", False, 2, link)])
+    (interface,) = watcher.get_network_information("eth0")
+
+    assert ["UP", "LOWER_UP"] == interface["flags"]
+    assert 1 == len(interface["addr_info"])
+
+    watcher._apply([Event("link", True, 2, link)])
+
+    assert [] == watcher.get_network_information("eth0")
+    assert 3 == watcher.get_version()
+
+
+def test_apply_route_events(watcher, mocker):
+    """Route changes read the default route again."""
+    netlink = network_watcher.netlink
+    netlink.get_default_route.return_value = {"GW": "10.0.0.254", "IF": "eth0"}
+
+    watcher._apply([Event("route", False, None, None)])
+
+    assert "10.0.0.254" == watcher.get_default_route()["GW"]
+    assert 2 == watcher.get_version()
+
+
+def test_without_netlink(mocker):
+    """Without netlink, every call asks the kernel through network."""
+    netlink = mocker.patch("appliance_status.network_watcher.netlink")
+    netlink.subscribe.side_effect = OSError
+    network = mocker.patch("appliance_status.network_watcher.network")
+    watcher = network_watcher.NetworkWatcher()
+
+    watcher.start()
+    try:
+        deadline = time.monotonic() + 2
+        while not netlink.subscribe.called:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert watcher.get_version() is None
+        assert network.get_default_route.return_value == watcher.get_default_route()
+    finally:
+        watcher.stop()
+
+
+def test_interface_index_per_version(watcher):
+    """The index gets built again only after a change."""
+    first = watcher.get_interface_index("eth0")
+
+    assert first is watcher.get_interface_index("eth0")
+    assert first is not watcher.get_interface_index("wg0")
+
+    watcher._apply([Event("link", True, 2, {})])
+
+    assert [] == watcher.get_interface_index("eth0").query(kind="all").interfaces
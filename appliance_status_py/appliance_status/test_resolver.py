@@ -0,0 +1,97 @@
+"""Verify the shared dns cache."""
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from appliance_status import resolver
+
+ADDRESSES = [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("192.0.2.1", 0))]
+
+
+@pytest.fixture
+def getaddrinfo(mocker):
+    """Count real lookups, always answer with ADDRESSES."""
+    return mocker.patch.object(resolver.socket, "getaddrinfo", return_value=ADDRESSES)
+
+
+def test_cache_hit(getaddrinfo):
+    """Only the first lookup of a host hits the resolver, ports get filled in."""
+    cache = resolver.ResolverCache()
+
+    first = cache.getaddrinfo("example.com", 80)
+    second = cache.getaddrinfo("example.com", 443)
+
+    assert 1 == getaddrinfo.call_count
+    assert ("192.0.2.1", 80) == first[0][4]
+    assert ("192.0.2.1", 443) == second[0][4]
+    assert {"hits": 1, "negative_hits": 0, "misses": 1, "entries": 1} == (cache.stats())
+
+
+def test_cache_expires(getaddrinfo, mocker):
+    """Entries get resolved again once their ttl passed."""
+    cache = resolver.ResolverCache(ttl=10)
+    monotonic = mocker.patch.object(resolver, "monotonic", return_value=100)
+
+    cache.getaddrinfo("example.com", 80)
+    monotonic.return_value = 111
+    cache.getaddrinfo("example.com", 80)
+
+    assert 2 == getaddrinfo.call_count
+
+
+def test_negative_caching(getaddrinfo):
+    """Hosts that do not exist are remembered, temporary failures are not."""
+    cache = resolver.ResolverCache()
+    getaddrinfo.side_effect = socket.gaierror(socket.EAI_NONAME, "Unknown")
+
+    for _ in range(2):
+        with pytest.raises(socket.gaierror):
+            cache.getaddrinfo("nowhere.invalid", 80)
+    getaddrinfo.side_effect = socket.gaierror(socket.EAI_AGAIN, "Try again")
+    for _ in range(2):
+        with pytest.raises(socket.gaierror):
+            cache.getaddrinfo("flaky.invalid", 80)
+
+    assert 3 == getaddrinfo.call_count
+    assert 1 == cache.stats()["negative_hits"]
+
+
+def test_max_entries(getaddrinfo):
+    """The least recently used host gets dropped."""
+    cache = resolver.ResolverCache(max_entries=2)
+
+    for host in ("a", "b", "a", "c", "a"):
+        cache.getaddrinfo(host, 80)
+
+    assert 3 == getaddrinfo.call_count
+    assert 2 == cache.stats()["entries"]
+
+
+def test_concurrent_lookups_share_a_query(mocker):
+    """Tests resolving the same host at the same time wait for one query."""
+    release = threading.Event()
+
+    def slow_getaddrinfo(*args, **kwargs):
+        release.wait(2)
+        return ADDRESSES
+
+    getaddrinfo = mocker.patch.object(
+        resolver.socket, "getaddrinfo", side_effect=slow_getaddrinfo
+    )
+    cache = resolver.ResolverCache()
+
+    async def scenario():
+        lookups = [
+            asyncio.ensure_future(cache.agetaddrinfo("example.com", port))
+            for port in (80, 443, 8883)
+        ]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*lookups)
+
+    results = asyncio.run(scenario())
+
+    assert 1 == getaddrinfo.call_count
+    assert [80, 443, 8883] == [result[0][4][1] for result in results]
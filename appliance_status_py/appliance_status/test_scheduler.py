@@ -0,0 +1,134 @@
+"""Verify the background scheduling of network tests."""
+import time
+
+import attr
+
+from appliance_status import scheduler
+from appliance_status.test_types import ATestResult
+
+
+@attr.s
+class CountingTest:
+    """Count how often the test ran, fail the first `failures` runs hard."""
+
+    description = attr.ib()
+    failures = attr.ib(default=0)
+    runs = attr.ib(default=0)
+    test_type = "Counting Test"
+    _address = "counter"
+
+    async def atest(self, log):
+        """Pass, unless we still need to fail."""
+        self.runs += 1
+        if self.runs <= self.failures:
+            raise RuntimeError("Boom")
+        return ATestResult(self.test_type, True, "counter", 200, "OK", self.description)
+
+
+class FakeManager(scheduler.ATestManager):
+    """A test manager with hand made tests."""
+
+    def __init__(self, tests, intervals):
+        """Take the tests directly, without test configuration."""
+        self.tests = tests
+        self.intervals = intervals
+        self.timeouts = [1] * len(tests)
+
+
+def _wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Condition not met in time"
+        time.sleep(0.01)
+
+
+def test_get_results_before_start():
+    """Nothing ran yet, every result is a stale placeholder."""
+    probe_scheduler = scheduler.ProbeScheduler(FakeManager([CountingTest("a")], [5]))
+
+    (result,) = probe_scheduler.get_results()
+
+    assert result.stale
+    assert result.age is None
+    assert "Not tested yet" == result.result.reason
+    assert not result.result.passed
+
+
+def test_tests_repeat_in_their_interval():
+    """A test with a short interval runs repeatedly, its result is fresh."""
+    fast, slow = CountingTest("fast"), CountingTest("slow")
+    probe_scheduler = scheduler.ProbeScheduler(FakeManager([fast, slow], [0.01, 60]))
+
+    probe_scheduler.start()
+    probe_scheduler.start()
+    try:
+        _wait_for(lambda: fast.runs > 3)
+    finally:
+        probe_scheduler.stop()
+    results = probe_scheduler.get_results()
+
+    assert 1 == slow.runs
+    assert [True, True] == [result.result.passed for result in results]
+    assert not results[1].stale
+
+
+def test_failing_test_keeps_being_scheduled():
+    """An exception turns into an error result and the test runs again."""
+    flaky = CountingTest("flaky", failures=1)
+    probe_scheduler = scheduler.ProbeScheduler(FakeManager([flaky], [0.01]))
+
+    probe_scheduler.start()
+    try:
+        _wait_for(lambda: flaky.runs > 1)
+    finally:
+        probe_scheduler.stop()
+
+    assert flaky.runs > 1
+
+
+def test_scheduled_result_stale():
+    """A result is stale once it is older than two intervals."""
+    assert not scheduler.ScheduledResult(None, 19, 10).stale
+    assert scheduler.ScheduledResult(None, 21, 10).stale
+
+
+def test_timings_feed_latency_histograms():
+    """Timings of results end up in the histograms of their test."""
+    test = CountingTest("timed")
+    probe_scheduler = scheduler.ProbeScheduler(FakeManager([test], [0.01]))
+    original = test.atest
+
+    async def timed_atest(log):
+        result = await original(log)
+        result.timings = {"total": 3.0}
+        return result
+
+    test.atest = timed_atest
+    probe_scheduler.start()
+    try:
+        _wait_for(lambda: test.runs > 2)
+    finally:
+        probe_scheduler.stop()
+    (latency,) = probe_scheduler.get_latency()
+
+    assert "counter" == latency["address"]
+    assert latency["histograms"]["total"]["samples"] >= 2
+
+
+def test_results_feed_history():
+    """Every result ends up in the history of its test."""
+    test = CountingTest("recorded", failures=1)
+    probe_scheduler = scheduler.ProbeScheduler(FakeManager([test], [0.01]))
+
+    probe_scheduler.start()
+    try:
+        _wait_for(lambda: test.runs > 2)
+    finally:
+        probe_scheduler.stop()
+    (result,) = probe_scheduler.get_results()
+    (test_history,) = probe_scheduler.get_history()
+
+    assert result.history is probe_scheduler.history.get(0)
+    assert test_history["summary"]["last_change"] is not None
+    assert not test_history["samples"][0]["passed"]
+    assert test_history["samples"][-1]["passed"]
@@ -0,0 +1,205 @@
+"""Verify that the test manager runs every kind of test."""
+import asyncio
+import time
+
+import attr
+import pytest
+import structlog
+
+from appliance_status import test_manager
+from appliance_status.test_types import ATestResult
+
+
+@attr.s
+class SyncOnlyTest:
+    """A custom test type that only knows the blocking api."""
+
+    description = attr.ib()
+    test_type = "Sync Test"
+
+    def test(self, log):
+        """Pass, from an executor thread."""
+        return ATestResult(self.test_type, True, "sync", 200, "OK", self.description)
+
+
+@attr.s
+class AsyncTest(SyncOnlyTest):
+    """A custom test type providing a coroutine."""
+
+    test_type = "Async Test"
+
+    def test(self, log):
+        """Must not be called if `atest` exists."""
+        raise AssertionError("Blocking test called")
+
+    async def atest(self, log):
+        """Pass, on the event loop."""
+        return ATestResult(self.test_type, True, "async", 200, "OK", self.description)
+
+
+def test_perform_network_tests_mixed(mocker):
+    """Blocking and asyncio tests run together, results keep the config order."""
+    mocker.patch.object(
+        test_manager.test_types, "SyncOnlyTest", SyncOnlyTest, create=True
+    )
+    mocker.patch.object(test_manager.test_types, "AsyncTest", AsyncTest, create=True)
+    manager = test_manager.ATestManager(
+        [
+            dict(TestType="SyncOnlyTest", args=[], description="first"),
+            dict(TestType="AsyncTest", args=[], description="second"),
+        ]
+    )
+
+    results = manager.perform_network_tests(structlog.get_logger())
+
+    assert ["first", "second"] == [result.description for result in results]
+    assert ["sync", "async"] == [result.address for result in results]
+
+
+def test_perform_network_tests_empty():
+    """No tests configured, no results."""
+    manager = test_manager.ATestManager([])
+
+    assert [] == manager.perform_network_tests(structlog.get_logger())
+
+
+def test_intervals(mocker):
+    """Intervals default to DEFAULT_INTERVAL and can be set per test."""
+    mocker.patch.object(test_manager.test_types, "AsyncTest", AsyncTest, create=True)
+    manager = test_manager.ATestManager(
+        [
+            dict(TestType="AsyncTest", args=[], description="first"),
+            dict(TestType="AsyncTest", args=[], description="second", interval=5),
+        ]
+    )
+
+    assert [test_manager.DEFAULT_INTERVAL, 5] == manager.intervals
+
+
+def test_intervals_must_be_positive(mocker):
+    """A zero interval would keep a test running in a tight loop."""
+    mocker.patch.object(test_manager.test_types, "AsyncTest", AsyncTest, create=True)
+
+    with pytest.raises(ValueError):
+        test_manager.ATestManager(
+            [dict(TestType="AsyncTest", args=[], description="x", interval=0)]
+        )
+
+
+@attr.s
+class HangingTest(SyncOnlyTest):
+    """A test that never finishes in time, like a broker never sending CONNACK."""
+
+    test_type = "Hanging Test"
+    _address = "hanging"
+
+    async def atest(self, log):
+        """Wait forever."""
+        await asyncio.sleep(3600)
+
+
+@attr.s
+class BrokenTest(SyncOnlyTest):
+    """A test with a bug."""
+
+    test_type = "Broken Test"
+
+    def test(self, log):
+        """Fail unexpectedly."""
+        raise RuntimeError("Bug")
+
+
+@pytest.fixture
+def custom_tests(mocker):
+    """Make the custom test types available to the test configuration."""
+    for test_class in (SyncOnlyTest, AsyncTest, HangingTest, BrokenTest):
+        mocker.patch.object(
+            test_manager.test_types, test_class.__name__, test_class, create=True
+        )
+
+
+def test_perform_network_tests_deadline(custom_tests):
+    """Finished tests return their result, pending ones time out at the deadline."""
+    manager = test_manager.ATestManager(
+        [
+            dict(TestType="HangingTest", args=[], description="hangs"),
+            dict(TestType="AsyncTest", args=[], description="fast"),
+        ]
+    )
+
+    started = time.monotonic()
+    hanging, fast = manager.perform_network_tests(structlog.get_logger(), deadline=0.2)
+
+    assert time.monotonic() - started < 2
+    assert "Network timeout" == hanging.reason
+    assert "hanging" == hanging.address
+    assert fast.passed
+
+
+def test_perform_network_tests_test_timeout(custom_tests):
+    """A test exceeding its own timeout is reported as timed out."""
+    manager = test_manager.ATestManager(
+        [dict(TestType="HangingTest", args=[], description="hangs", timeout=0.1)]
+    )
+
+    (result,) = manager.perform_network_tests(structlog.get_logger())
+
+    assert "Network timeout" == result.reason
+
+
+def test_perform_network_tests_exception(custom_tests):
+    """A test raising an exception results in an error result."""
+    manager = test_manager.ATestManager(
+        [dict(TestType="BrokenTest", args=[], description="broken")]
+    )
+
+    (result,) = manager.perform_network_tests(structlog.get_logger())
+
+    assert not result.passed
+    assert "Bug" in result.reason
+
+
+def test_executor_is_shared(custom_tests):
+    """Blocking tests run in the same bounded pool, across calls."""
+    manager = test_manager.ATestManager(
+        [dict(TestType="SyncOnlyTest", args=[], description="sync")]
+    )
+
+    manager.perform_network_tests(structlog.get_logger())
+    executor = test_manager._engine.executor
+    manager.perform_network_tests(structlog.get_logger())
+
+    assert executor is test_manager._engine.executor
+    assert test_manager.MAX_WORKERS == executor._max_workers
+
+
+def test_iter_network_tests_order(custom_tests):
+    """Results come as tests finish, timed out tests last."""
+    manager = test_manager.ATestManager(
+        [
+            dict(TestType="HangingTest", args=[], description="hangs"),
+            dict(TestType="AsyncTest", args=[], description="fast"),
+        ]
+    )
+
+    results = list(manager.iter_network_tests(structlog.get_logger(), deadline=0.2))
+
+    assert [1, 0] == [index for index, _result in results]
+    assert "Network timeout" == results[1][1].reason
+
+
+def test_iter_network_tests_close_cancels(custom_tests, mocker):
+    """Closing the generator, like a client going away, cancels pending tests."""
+    manager = test_manager.ATestManager(
+        [
+            dict(TestType="AsyncTest", args=[], description="fast"),
+            dict(TestType="HangingTest", args=[], description="hangs"),
+        ]
+    )
+    submit = mocker.spy(manager, "submit_network_tests")
+
+    results = manager.iter_network_tests(structlog.get_logger())
+    next(results)
+    results.close()
+
+    assert submit.spy_return[1].cancelled()
@@ -0,0 +1,671 @@
+"""Verify the asyncio implementations of the test types against local servers."""
+import asyncio
+import http.server
+import socket
+import ssl
+import subprocess
+import threading
+import time
+
+import ntplib
+import pytest
+import structlog
+
+from appliance_status import test_types
+
+
+async def _serve_once(handler):
+    server = await asyncio.start_server(handler, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture(scope="session")
+def certificate(tmp_path_factory):
+    """Create a self signed certificate for 127.0.0.1."""
+    directory = tmp_path_factory.mktemp("tls")
+    cert, key = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-days", "1", "-subj", "/CN=127.0.0.1",
+            "-addext", "subjectAltName=IP:127.0.0.1",
+            "-keyout", str(key), "-out", str(cert),
+        ],
+        check=True,
+        capture_output=True,
+    )  # fmt: skip
+    return str(cert), str(key)
+
+
+@pytest.fixture
+def server_context(certificate):
+    """TLS context for local servers, using the self signed certificate."""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(*certificate)
+    return context
+
+
+@pytest.fixture(autouse=True)
+def fresh_tls_state():
+    """Do not let TLS contexts or failed verifications leak between tests."""
+    test_types._ssl_context.cache_clear()
+    test_types._unverifiable_endpoints.clear()
+    yield
+    test_types._ssl_context.cache_clear()
+    test_types._unverifiable_endpoints.clear()
+
+
+@pytest.fixture(autouse=True)
+def no_proxy(monkeypatch):
+    """Do not let proxies of the environment get in the way."""
+    for name in ("http_proxy", "https_proxy", "no_proxy", "all_proxy"):
+        monkeypatch.delenv(name, raising=False)
+        monkeypatch.delenv(name.upper(), raising=False)
+
+
+@pytest.fixture
+def trust_certificate(mocker, certificate):
+    """Make the test types trust the self signed certificate."""
+    create_default_context = ssl.create_default_context
+    mocker.patch.object(
+        test_types.ssl,
+        "create_default_context",
+        lambda *args, **kwargs: create_default_context(cafile=certificate[0]),
+    )
+
+
+@pytest.mark.parametrize(
+    "answer,passed", ((b"220 welcome", True), (b"500 go away", False))
+)
+def test_tcp_test_atest(answer, passed):
+    """The answer of the server gets matched against the regex."""
+
+    async def scenario():
+        async def handler(reader, writer):
+            await reader.read(4)
+            writer.write(answer)
+            await writer.drain()
+            writer.close()
+
+        server, port = await _serve_once(handler)
+        async with server:
+            test = test_types.TCPTest("127.0.0.1", port, "HELO", "^220", "desc")
+            return await test.atest(structlog.get_logger())
+
+    result = _run(scenario())
+
+    assert passed is result.passed
+    assert "127.0.0.1" in result.address
+    assert {"resolve", "connect", "first_byte", "total"} == set(result.timings)
+
+
+def test_tcp_test_atest_timeout():
+    """A server that never answers results in a timeout result."""
+
+    async def scenario():
+        async def handler(reader, writer):
+            await asyncio.sleep(5)
+
+        server, port = await _serve_once(handler)
+        async with server:
+            test = test_types.TCPTest("127.0.0.1", port, "HELO", "^220", "desc")
+            return await test.atest(structlog.get_logger())
+
+    result = _run(scenario())
+
+    assert not result.passed
+    assert "Network timeout" == result.reason
+
+
+def test_tcp_test_atest_connection_refused():
+    """A closed port is a failed test, not an unexpected exception."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    test = test_types.TCPTest("127.0.0.1", port, "HELO", "^220", "desc")
+
+    result = _run(test.atest(structlog.get_logger()))
+
+    assert not result.passed
+    assert 500 == result.status_code
+    assert "ConnectionRefusedError" in result.reason
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/secret")
+        elif self.path == "/secret":
+            self.send_response(401)
+        else:
+            self.send_response(404)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    """Run a tiny HTTP server in a thread."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+class _KeepAliveHandler(_Handler):
+    protocol_version = "HTTP/1.1"
+
+
+@pytest.fixture
+def keep_alive_server():
+    """Run a tiny HTTP server supporting keep-alive in a thread."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("keep_alive,connections", ((True, 1), (False, 6)))
+def test_http_test_atest_keep_alive(keep_alive_server, mocker, keep_alive, connections):
+    """Redirects and later runs on the same loop reuse the connection."""
+    http_open = mocker.spy(test_types, "_http_open")
+    test = test_types.HTTPTest(
+        keep_alive_server + "/redirect", "desc", keep_alive=keep_alive
+    )
+
+    async def scenario():
+        return [await test.atest(structlog.get_logger()) for _ in range(3)]
+
+    results = _run(scenario())
+    test_types._http_connection_pool.clear()
+
+    assert all(result.passed for result in results)
+    assert connections == http_open.call_count
+    assert "total_cold" in results[0].timings
+    assert ("total_warm" in results[2].timings) is keep_alive
+    assert ("connect" in results[2].timings) is not keep_alive
+
+
+async def _serve_keep_alive(second_answer):
+    """Answer the first request, then hang or close instead of answering."""
+
+    async def handler(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(b"HTTP/1.1 200 OK\r\n\r\n")
+        await writer.drain()
+        await reader.readuntil(b"\r\n\r\n")
+        if second_answer == "hang":
+            await asyncio.sleep(5)
+        writer.close()
+
+    server = await asyncio.start_server(handler, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+@pytest.mark.parametrize(
+    "second_answer,connections,reason",
+    (("close", 2, "OK"), ("hang", 1, "Network timeout")),
+)
+def test_http_test_atest_warm_connection_fails(
+    mocker, second_answer, connections, reason
+):
+    """Closed kept connections get replaced, timeouts are failures."""
+    http_open = mocker.spy(test_types, "_http_open")
+
+    async def scenario():
+        server, port = await _serve_keep_alive(second_answer)
+        async with server:
+            test = test_types.HTTPTest("http://127.0.0.1:{}/".format(port), "desc")
+            await test.atest(structlog.get_logger())
+            result = await test.atest(structlog.get_logger())
+            test_types._http_connection_pool.clear()
+            return result
+
+    result = _run(scenario())
+
+    assert reason == result.reason
+    assert connections == http_open.call_count
+
+
+def test_http_test_blocking_keeps_no_connections(keep_alive_server):
+    """Connections of the blocking api get closed with its loop."""
+    test = test_types.HTTPTest(keep_alive_server + "/secret", "desc")
+
+    assert test.test(structlog.get_logger()).passed
+    assert {} == test_types._http_connection_pool._idle
+
+
+@pytest.fixture
+def https_server(server_context):
+    """Run a tiny HTTPS server with a self signed certificate in a thread."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.socket = server_context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "https://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_test_atest_unverified(https_server):
+    """Without a trusted certificate, the test passes with a warning."""
+    test = test_types.HTTPTest(https_server + "/redirect", "desc")
+
+    result = _run(test.atest(structlog.get_logger()))
+
+    assert result.passed
+    assert result.reason.endswith("but no SSL Verification possible")
+
+
+def test_http_test_atest_verified(https_server, trust_certificate):
+    """With a trusted certificate, there is no warning."""
+    test = test_types.HTTPTest(https_server + "/secret", "desc")
+
+    result = _run(test.atest(structlog.get_logger()))
+
+    assert result.passed
+    assert "Unauthorized" == result.reason
+
+
+@pytest.mark.parametrize(
+    "path,status_code,passed",
+    (("/redirect", 401, True), ("/secret", 401, True), ("/nothing", 404, False)),
+)
+def test_http_test_atest(http_server, path, status_code, passed):
+    """Redirects get followed, 200 and 401 are accepted."""
+    test = test_types.HTTPTest(http_server + path, "desc")
+
+    result = _run(test.atest(structlog.get_logger()))
+
+    assert status_code == result.status_code
+    assert passed is result.passed
+    assert result.timings["total"] >= result.timings["first_byte"]
+
+
+def test_http_test_blocking(http_server):
+    """The blocking api keeps working."""
+    test = test_types.HTTPTest(http_server + "/secret", "desc")
+
+    result = test.test(structlog.get_logger())
+
+    assert result.passed
+
+
+class _RecordingHandler(_Handler):
+    requests = []
+
+    def do_HEAD(self):
+        self.requests.append(
+            (self.path, self.headers["Host"], self.headers["Authorization"])
+        )
+        super().do_HEAD()
+
+
+def test_http_test_atest_credentials(mocker):
+    """Credentials in the URL are sent as basic auth, never in the Host header."""
+    mocker.patch.object(_RecordingHandler, "requests", [])
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _RecordingHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host = "127.0.0.1:{}".format(server.server_address[1])
+    test = test_types.HTTPTest("http://u:p%40ss@{}/redirect".format(host), "desc")
+    try:
+        result = _run(test.atest(structlog.get_logger()))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert result.passed
+    auth = "Basic dTpwQHNz"
+    assert [
+        ("/redirect", host, auth),
+        ("/secret", host, auth),
+    ] == _RecordingHandler.requests
+
+
+@pytest.mark.parametrize(
+    "url,host",
+    (
+        ("http://u:pw@example.com/", "example.com"),
+        ("http://u:pw@example.com:8080/", "example.com:8080"),
+        ("https://[::1]:8443/path", "[::1]:8443"),
+    ),
+)
+def test_http_host(url, host):
+    """The Host header has host and port only."""
+    assert host == test_types._http_host(test_types.urlsplit(url))
+
+
+async def _pipe(reader, writer):
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def _serve_proxy(requests):
+    """Serve a proxy tunneling CONNECT, and answering other requests itself."""
+
+    async def handler(reader, writer):
+        request = []
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            request.append(line.decode("ascii").strip())
+        requests.append(request)
+        method, target, _version = request[0].split()
+        if method != "CONNECT":
+            writer.write(b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n")
+            writer.close()
+            return
+        host, port = target.rsplit(":", 1)
+        upstream_reader, upstream_writer = await asyncio.open_connection(host, port)
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        await asyncio.gather(
+            _pipe(reader, upstream_writer), _pipe(upstream_reader, writer)
+        )
+
+    server = await asyncio.start_server(handler, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_http_test_atest_proxy(monkeypatch, http_server):
+    """Plain requests go to the proxy of the environment, naming the URL."""
+    requests = []
+
+    async def scenario():
+        server, port = await _serve_proxy(requests)
+        monkeypatch.setenv("http_proxy", "http://me:pw@127.0.0.1:{}".format(port))
+        async with server:
+            test = test_types.HTTPTest(http_server + "/nothing", "desc")
+            return await test.atest(structlog.get_logger())
+
+    result = _run(scenario())
+
+    assert result.passed
+    assert "HEAD {}/nothing HTTP/1.1".format(http_server) == requests[0][0]
+    assert "Proxy-Authorization: Basic bWU6cHc=" in requests[0]
+
+
+def test_http_test_atest_proxy_tunnel(monkeypatch, https_server, trust_certificate):
+    """TLS connections get tunneled through the proxy with CONNECT."""
+    requests = []
+
+    async def scenario():
+        server, port = await _serve_proxy(requests)
+        monkeypatch.setenv("https_proxy", "127.0.0.1:{}".format(port))
+        async with server:
+            test = test_types.HTTPTest(https_server + "/secret", "desc")
+            return await test.atest(structlog.get_logger())
+
+    result = _run(scenario())
+
+    assert "Unauthorized" == result.reason
+    target = https_server.split("//")[1]
+    assert [["CONNECT {} HTTP/1.1".format(target), "Host: " + target]] == requests
+
+
+def test_http_test_atest_no_proxy(monkeypatch, http_server):
+    """Hosts listed in NO_PROXY get connected directly."""
+    monkeypatch.setenv("http_proxy", "http://127.0.0.1:1")
+    monkeypatch.setenv("no_proxy", "127.0.0.1")
+    test = test_types.HTTPTest(http_server + "/secret", "desc")
+
+    result = _run(test.atest(structlog.get_logger()))
+
+    assert 401 == result.status_code
+
+
+def test_http_test_atest_all_proxy(monkeypatch, http_server):
+    """ALL_PROXY applies to every scheme, like with requests."""
+    requests = []
+
+    async def scenario():
+        server, port = await _serve_proxy(requests)
+        monkeypatch.setenv("all_proxy", "http://127.0.0.1:{}".format(port))
+        async with server:
+            test = test_types.HTTPTest(http_server + "/nothing", "desc")
+            return await test.atest(structlog.get_logger())
+
+    result = _run(scenario())
+
+    assert result.passed
+    assert 1 == len(requests)
+
+
+# Differences to the former implementation based on requests
+
+
+def test_http_test_ignores_netrc(monkeypatch, mocker, tmp_path):
+    """Credentials of .netrc are not sent, only those in the URL."""
+    netrc = tmp_path / ".netrc"
+    netrc.write_text("machine 127.0.0.1 login u password pw\n")
+    monkeypatch.setenv("NETRC", str(netrc))
+    monkeypatch.setenv("HOME", str(tmp_path))
+    mocker.patch.object(_RecordingHandler, "requests", [])
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _RecordingHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = "http://127.0.0.1:{}/secret".format(server.server_address[1])
+    try:
+        _run(test_types.HTTPTest(url, "desc").atest(structlog.get_logger()))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [None] == [auth for _path, _host, auth in _RecordingHandler.requests]
+
+
+@pytest.mark.parametrize("variable", ("REQUESTS_CA_BUNDLE", "CURL_CA_BUNDLE"))
+def test_http_test_ignores_requests_ca_bundle(
+    monkeypatch, https_server, certificate, variable
+):
+    """Certificates get verified against the system store, not certifi or bundles."""
+    monkeypatch.setenv(variable, certificate[0])
+    test = test_types.HTTPTest(https_server + "/secret", "desc")
+
+    result = _run(test.atest(structlog.get_logger()))
+
+    assert result.reason.endswith("but no SSL Verification possible")
+
+
+def test_http_test_sends_no_user_agent(mocker, http_server):
+    """There is no User-Agent header, requests sent python-requests/<version>."""
+    sent = []
+    exchange = test_types._http_exchange
+
+    async def spy(connection, origin, request, keep_alive, timer):
+        sent.append(request)
+        return await exchange(connection, origin, request, keep_alive, timer)
+
+    mocker.patch.object(test_types, "_http_exchange", spy)
+
+    _run(
+        test_types.HTTPTest(http_server + "/secret", "desc").atest(
+            structlog.get_logger()
+        )
+    )
+
+    assert b"user-agent" not in sent[0].lower()
+
+
+def test_http_test_atest_connection_refused():
+    """A closed port results in an error, not an exception."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    test = test_types.HTTPTest("http://127.0.0.1:{}/".format(port), "desc")
+
+    result = _run(test.atest(structlog.get_logger()))
+
+    assert not result.passed
+    assert 500 == result.status_code
+
+
+def test_ntp_test_atest(mocker):
+    """An NTP v3 answer passes."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+
+    def answer():
+        _data, addr = server.recvfrom(256)
+        packet = ntplib.NTPPacket(version=3, mode=4, tx_timestamp=3900000000)
+        server.sendto(packet.to_data(), addr)
+
+    thread = threading.Thread(target=answer, daemon=True)
+    thread.start()
+    real_request = test_types._ntp_request
+    mocker.patch.object(
+        test_types,
+        "_ntp_request",
+        lambda host, version, timer: real_request(
+            host, version, timer, port=server.getsockname()[1]
+        ),
+    )
+    test = test_types.NTPTest("127.0.0.1", "desc")
+
+    result = _run(test.atest(structlog.get_logger()))
+    thread.join()
+    server.close()
+
+    assert result.passed
+
+
+async def _serve_mqtt(server_context, answer, delay=0):
+    async def handler(reader, writer):
+        await reader.readexactly(14)
+        await asyncio.sleep(delay)
+        writer.write(answer)
+        await writer.drain()
+        await reader.read()
+        writer.close()
+
+    server = await asyncio.start_server(handler, "127.0.0.1", 0, ssl=server_context)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_mqtt_test_atest_concurrently(server_context, trust_certificate):
+    """Several runs of the same test at once all see their own CONNACK."""
+
+    async def scenario():
+        server, port = await _serve_mqtt(server_context, b"\x20\x02\x00\x00")
+        async with server:
+            test = test_types.MQTTTest("127.0.0.1", port, "desc", measure_latency=True)
+            return await asyncio.gather(
+                *(test.atest(structlog.get_logger()) for _ in range(5))
+            )
+
+    results = _run(scenario())
+
+    assert all(result.passed for result in results)
+    assert all("TLS handshake" in result.reason for result in results)
+
+
+def test_mqtt_test_atest_no_connack(server_context, trust_certificate):
+    """A broker accepting connections but never answering times out in time."""
+
+    async def scenario():
+        server, port = await _serve_mqtt(server_context, b"\x20\x02\x00\x00", delay=5)
+        async with server:
+            test = test_types.MQTTTest("127.0.0.1", port, "desc", timeout=0.3)
+            started = time.monotonic()
+            result = await test.atest(structlog.get_logger())
+            return result, time.monotonic() - started
+
+    result, duration = _run(scenario())
+
+    assert "Network timeout" == result.reason
+    assert duration < 1
+
+
+def test_mqtt_test_atest_refused(server_context, trust_certificate):
+    """A broker refusing the connection fails the test, telling why."""
+
+    async def scenario():
+        server, port = await _serve_mqtt(server_context, b"\x20\x02\x00\x05")
+        async with server:
+            test = test_types.MQTTTest("127.0.0.1", port, "desc")
+            return await test.atest(structlog.get_logger())
+
+    result = _run(scenario())
+
+    assert not result.passed
+    assert "Connection refused: 5 (not authorized)" == result.reason
+    assert "first_byte" in result.timings
+
+
+def test_mqtt_test_untrusted_certificate(server_context):
+    """Certificates must be valid for MQTT."""
+
+    async def scenario():
+        server, port = await _serve_mqtt(server_context, b"\x20\x02\x00\x00")
+        async with server:
+            test = test_types.MQTTTest("127.0.0.1", port, "desc")
+            return await test.atest(structlog.get_logger())
+
+    result = _run(scenario())
+
+    assert not result.passed
+    assert "SSLCertVerificationError" in result.reason
+
+
+async def _serve_tls(server_context):
+    async def handler(reader, writer):
+        await reader.read()
+        writer.close()
+
+    server = await asyncio.start_server(handler, "127.0.0.1", 0, ssl=server_context)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_ssl_test_atest_verified(server_context, trust_certificate):
+    """A trusted certificate with a modern TLS version passes."""
+
+    async def scenario():
+        server, port = await _serve_tls(server_context)
+        async with server:
+            test = test_types.SSLTest("127.0.0.1", port, "desc")
+            return await test.atest(structlog.get_logger())
+
+    result = _run(scenario())
+
+    assert result.passed
+    assert "OK" == result.reason
+
+
+def test_ssl_test_atest_unverified_once(server_context, mocker):
+    """Once verification failed, later runs only need a single handshake."""
+    open_connection = mocker.spy(test_types, "_open_connection")
+
+    async def scenario():
+        server, port = await _serve_tls(server_context)
+        async with server:
+            test = test_types.SSLTest("127.0.0.1", port, "desc")
+            return [await test.atest(structlog.get_logger()) for _ in range(3)]
+
+    results = _run(scenario())
+
+    assert ["OK but no SSL Verification possible"] * 3 == [
+        result.reason for result in results
+    ]
+    assert 4 == open_connection.call_count
+
+
+def test_tls_contexts_are_shared():
+    """The CA store gets loaded once per kind of context."""
+    assert test_types._ssl_context(True) is test_types._ssl_context(True)
+    assert test_types._ssl_context(True) is not test_types._ssl_context(False)
@@ -1,17 +1,47 @@
-"""Provide all test implementations."""
+"""
+Provide all test implementations.
+
+Every test type offers a blocking `test` method. The built in test types
+implement `atest`, a coroutine doing the work on an asyncio event loop, which
+lets the test manager run a whole suite on a single thread. Their `test`
+method only runs `atest` on a private loop.
+
+The built in test types measure how long each phase of a test took. The
+results carry these `timings` in milliseconds, for the phases in `PHASES`
+that apply to the test type.
+"""
 from abc import abstractmethod
-from functools import partial
+from functools import lru_cache, partial, wraps
 from time import ctime
-from time import sleep
-from typing import Protocol
+from time import monotonic
+from time import perf_counter
+from time import time
+from typing import Dict, Protocol
+from urllib.parse import unquote, urljoin, urlsplit
+from urllib.request import getproxies, proxy_bypass
+import asyncio
+import base64
 import attr
 import ntplib
-import paho.mqtt.client as mqtt
 import re
-import requests
 import socket
 import ssl
 import structlog
+import threading
+
+from appliance_status import resolver
+
+# Tests reusing connections report their total a second time, as
+# "total_cold" or "total_warm", telling whether a new connection was needed.
+PHASES = (
+    "resolve",
+    "connect",
+    "handshake",
+    "first_byte",
+    "total",
+    "total_cold",
+    "total_warm",
+)
 
 
 @attr.s
@@ -24,6 +54,7 @@ class ATestResult:
     status_code = attr.ib()
     reason = attr.ib()
     description = attr.ib()
+    timings: Dict[str, float] = attr.ib(factory=dict)
 
 
 @attr.s
@@ -36,6 +67,7 @@ class ErrorResult:
     status_code = attr.ib()
     reason = attr.ib()
     description = attr.ib()
+    timings: Dict[str, float] = attr.ib(factory=dict)
 
 
 def _make_timeout_error_result(test_type, address, description):
@@ -58,26 +90,223 @@ def _make_generic_error_result(test_type, address, description, exc):
     )
 
 
+class _PhaseTimer:
+    """
+    Measure how long the phases of a test take, in milliseconds.
+
+    `mark` attributes the time since the previous mark to a phase. Phases
+    happening more than once, like connecting again after a redirect, add up.
+    """
+
+    def __init__(self):
+        self.started = self._last = perf_counter()
+        self.timings = {}
+        self._connection = None
+
+    def mark(self, phase):
+        now = perf_counter()
+        self.timings[phase] = self.timings.get(phase, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+    def skip(self):
+        """Do not attribute the time since the previous mark to any phase."""
+        self._last = perf_counter()
+
+    def connection(self, kind):
+        """Tell whether a "cold" or a reused, "warm" connection got used."""
+        if self._connection != "cold":
+            self._connection = kind
+
+    def finish(self):
+        self.timings["total"] = (perf_counter() - self.started) * 1000
+        if self._connection is not None:
+            self.timings["total_" + self._connection] = self.timings["total"]
+        return self.timings
+
+
+def _timed(func):
+    """Pass a `_PhaseTimer` to `func`, attach the timings to its result."""
+
+    @wraps(func)
+    async def inner(self, log):
+        timer = _PhaseTimer()
+        result = await func(self, log, timer)
+        result.timings = timer.finish()
+        return result
+
+    return inner
+
+
 def _handle_socket_errors(func):
-    def inner(self, *args, **kwargs):
+    @wraps(func)
+    async def inner(self, *args, **kwargs):
         try:
-            return func(self, *args, **kwargs)
-        except ssl.SSLCertVerificationError as exc:
-            return _make_generic_error_result(
-                self.test_type, self._address, self.description, exc
+            return await func(self, *args, **kwargs)
+        except (socket.timeout, asyncio.TimeoutError):
+            return _make_timeout_error_result(
+                self.test_type, self._address, self.description
             )
-        except socket.gaierror as exc:
+        except OSError as exc:
+            # Refused connections, failed lookups and certificates alike
             return _make_generic_error_result(
                 self.test_type, self._address, self.description, exc
             )
-        except socket.timeout:
-            return _make_timeout_error_result(
-                self.test_type, self._address, self.description
-            )
 
     return inner
 
 
+async def _resolve(host, port, timer, type_=socket.SOCK_STREAM, timeout=1):
+    addresses = await asyncio.wait_for(
+        resolver.cache.agetaddrinfo(host, port, type_), timeout=timeout
+    )
+    timer.mark("resolve")
+    return addresses
+
+
+async def _open_connection(host, port, timer, context=None, timeout=1, proxy=None):
+    """
+    Open a stream connection, wrapped in TLS if a `context` is given.
+
+    Resolving, connecting and the TLS handshake get timed separately.
+    Like `socket.create_connection`, all resolved addresses get tried in order.
+    With a `proxy` of host, port and Proxy-Authorization header (or None),
+    the connection is tunneled through it with CONNECT.
+    """
+    loop = asyncio.get_running_loop()
+    error = None
+    connect_host, connect_port = (host, port) if proxy is None else proxy[:2]
+    for family, type_, proto, _name, address in await _resolve(
+        connect_host, connect_port, timer, timeout=timeout
+    ):
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, address), timeout=timeout)
+            break
+        except OSError as exc:
+            sock.close()
+            error = exc
+    else:
+        raise error or OSError("No address found for {}".format(connect_host))
+    reader, writer = await asyncio.open_connection(sock=sock)
+    try:
+        if proxy is not None:
+            await asyncio.wait_for(
+                _tunnel(reader, writer, host, port, proxy[2]), timeout=timeout
+            )
+        timer.mark("connect")
+        if context is not None:
+            await asyncio.wait_for(
+                writer.start_tls(context, server_hostname=host), timeout=timeout
+            )
+            timer.mark("handshake")
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+
+async def _tunnel(reader, writer, host, port, proxy_auth):
+    """Ask the proxy at the other end of `writer` to CONNECT to host and port."""
+    if ":" in host:
+        host = "[{}]".format(host)
+    request = "CONNECT {0}:{1} HTTP/1.1\r\nHost: {0}:{1}\r\n".format(host, port)
+    if proxy_auth is not None:
+        request += "Proxy-Authorization: {}\r\n".format(proxy_auth)
+    writer.write((request + "\r\n").encode("ascii"))
+    await writer.drain()
+    status_line = await reader.readline()
+    while await reader.readline() not in (b"\r\n", b"\n", b""):
+        pass
+    if status_line.split(None, 2)[1:2] != [b"200"]:
+        raise OSError("Proxy refused to connect: {!r}".format(status_line.strip()))
+
+
+async def _close(writer):
+    """Close a stream without caring whether the peer plays along."""
+    writer.close()
+    try:
+        await asyncio.wait_for(writer.wait_closed(), timeout=1)
+    except (OSError, asyncio.TimeoutError):
+        pass
+
+
+@lru_cache(maxsize=None)
+def _ssl_context(verify, minimum_version=None):
+    """
+    Return a shared TLS client context.
+
+    Creating a context loads the CA store, which is expensive. Contexts are
+    safe to share between connections, so each variant is created once.
+    """
+    context = ssl.create_default_context()
+    if minimum_version is not None:
+        context.minimum_version = minimum_version
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class _UnverifiableEndpoints:
+    """
+    Remember endpoints whose certificate could not be verified.
+
+    Checking a certificate that can not be verified costs a failing handshake
+    on top of the handshake without verification. For endpoints known to fail,
+    tests go straight to the handshake without verification, and only check
+    the certificate again once `recheck_after` seconds passed.
+    """
+
+    def __init__(self, recheck_after=600):
+        self.recheck_after = recheck_after
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def should_verify(self, host, port):
+        with self._lock:
+            failed_at = self._endpoints.get((host, port))
+            if failed_at is None:
+                return True
+            if monotonic() - failed_at > self.recheck_after:
+                del self._endpoints[(host, port)]
+                return True
+            return False
+
+    def add(self, host, port):
+        with self._lock:
+            self._endpoints[(host, port)] = monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+_unverifiable_endpoints = _UnverifiableEndpoints()
+
+
+async def _open_tls_connection(host, port, timer, minimum_version=None, proxy=None):
+    """
+    Open a TLS connection, verify the certificate unless known to fail.
+
+    Return reader, writer and whether the certificate got verified.
+    If verification fails, the endpoint gets remembered and the connection
+    is made again, without verification.
+    """
+    if _unverifiable_endpoints.should_verify(host, port):
+        try:
+            reader, writer = await _open_connection(
+                host, port, timer, _ssl_context(True, minimum_version), proxy=proxy
+            )
+            return reader, writer, True
+        except ssl.SSLCertVerificationError:
+            _unverifiable_endpoints.add(host, port)
+    reader, writer = await _open_connection(
+        host, port, timer, _ssl_context(False, minimum_version), proxy=proxy
+    )
+    return reader, writer, False
+
+
 class ATestProtocol(Protocol):
     """Responsible for configuring a test object, and performing tests."""
 
@@ -88,71 +317,118 @@ class ATestProtocol(Protocol):
         """Perform the test and return the result as ATestResult."""
         ...
 
+    # Test types may additionally provide
+    # `async def atest(self, log) -> ATestResult`. The test manager prefers it
+    # over `test`, which then only gets used from synchronous callers.
+
+
+class _AsyncTest(ATestProtocol):
+    """Base for test types implementing `atest`."""
+
+    def test(self, log):
+        """See Test.test."""
+        return asyncio.run(self.atest(log))
+
+
+# MQTT 3.1.1 CONNECT with clean session, keepalive 1s and an empty client id,
+# and the matching DISCONNECT. That is all we need to see a CONNACK.
+_MQTT_CONNECT = b"\x10\x0c\x00\x04MQTT\x04\x02\x00\x01\x00\x00"
+_MQTT_DISCONNECT = b"\xe0\x00"
+_MQTT_CONNACK_TYPE = b"\x20"
+# Return codes of a CONNACK refusing the connection
+_MQTT_REFUSALS = {
+    1: "unacceptable protocol version",
+    2: "identifier rejected",
+    3: "server unavailable",
+    4: "bad user name or password",
+    5: "not authorized",
+}
+
 
 @attr.s
-class MQTTTest(ATestProtocol):
+class MQTTTest(_AsyncTest):
     """
     MQTT Test.
 
-    Checks that it can connect to the MQTT endpoint
+    Checks that it can connect to the MQTT endpoint.
+    The test is done, as soon as the broker answers with a CONNACK, and
+    passes if the CONNACK accepts the connection. It fails once `timeout`
+    seconds passed. With `measure_latency`, the reason tells
+    how long the TCP connect and the TLS handshake took.
     """
 
     host = attr.ib()
     port = attr.ib()
     description = attr.ib()
-    connected = False
+    measure_latency = attr.ib(default=False)
+    timeout = attr.ib(default=1.0)
     test_type = "MQTT Test"
 
     @property
     def _address(self):
         return "{}:{}".format(self.host, self.port)
 
-    def _on_connect(self, log, client, userdata, flags, rc):
-        log = log.bind(client=client, userdata=userdata, flags=flags, rc=rc)
-        log.info("Got connected")
-        self.connected = True
-
-    @staticmethod
-    def _on_message(log, client, userdata, msg):
-        log = log.bind(client=client, userdata=userdata, msg=msg)
-        log.info("Got a message")
-
+    @_timed
     @_handle_socket_errors
-    def test(self, log):
+    async def atest(self, log, timer):
         """See Test.test."""
         log = log.bind(address=self._address, test_type=self.test_type)
-        client = mqtt.Client()
-        client.on_connect = partial(self._on_connect, log)
-        client.on_message = partial(self._on_message, log)
-        client.tls_set()
-
         log.info("Connecting")
-        client.connect(self.host, self.port, 1)
-        wait_step = 0.01
-        for _i in range(int(1.0 / wait_step)):
-            if self.connected:
-                break
-            sleep(wait_step)
-            client.loop(timeout=1)
-        client.disconnect()
-        log.info("looped through")
-        if self.connected:
-            return ATestResult(
-                test_type=self.test_type,
+        try:
+            connack = await asyncio.wait_for(self._connect(timer), timeout=self.timeout)
+        except asyncio.IncompleteReadError:
+            connack = b""
+        if connack[:1] != _MQTT_CONNACK_TYPE:
+            log.info("No CONNACK", answer=connack)
+            return _make_timeout_error_result(
+                self.test_type, self._address, self.description
+            )
+        if connack[3] != 0:
+            log.info("Connection refused", connack=connack)
+            return ErrorResult(
+                self.test_type,
                 address=self._address,
-                status_code=200,
-                reason="OK",
-                passed=True,
+                status_code=500,
+                reason="Connection refused: {} ({})".format(
+                    connack[3], _MQTT_REFUSALS.get(connack[3], "unknown")
+                ),
                 description=self.description,
             )
-        else:
-            return _make_timeout_error_result(
-                self.test_type, self._address, self.description
+        log.info("Got connected", connack=connack, timings=timer.timings)
+        return self._make_connected_result(timer.timings)
+
+    async def _connect(self, timer):
+        reader, writer = await _open_connection(
+            self.host, self.port, timer, _ssl_context(True)
+        )
+        try:
+            writer.write(_MQTT_CONNECT)
+            await writer.drain()
+            connack = await reader.readexactly(4)
+            timer.mark("first_byte")
+            writer.write(_MQTT_DISCONNECT)
+        finally:
+            await _close(writer)
+        return connack
+
+    def _make_connected_result(self, timings):
+        reason = "OK"
+        if self.measure_latency:
+            reason = "OK, connect {:.0f} ms, TLS handshake {:.0f} ms".format(
+                timings["connect"], timings["handshake"]
             )
+        return ATestResult(
+            test_type=self.test_type,
+            address=self._address,
+            status_code=200,
+            reason=reason,
+            passed=True,
+            description=self.description,
+        )
 
 
 @attr.s
-class TCPTest:
+class TCPTest(_AsyncTest):
     """
     TCP Test.
 
@@ -171,27 +447,33 @@ class TCPTest:
     def _address(self):
         return "{}:{}".format(self.host, self.port)
 
+    @_timed
     @_handle_socket_errors
-    def test(self, log):
+    async def atest(self, log, timer):
         """See Test.test."""
         output_re = re.compile(self.output_re_str)
-        with socket.create_connection((self.host, self.port), timeout=1) as sock:
-            sock.sendall(self.input_data.encode("ascii"))
-            response = sock.recv(4096)
-            passed = bool(output_re.match(response.decode("ascii")))
-            log.info("TCP Response: {}".format(response))
-            return ATestResult(
-                test_type=self.test_type,
-                address=self._address,
-                status_code=200 if passed else 500,
-                reason="OK" if passed else "OUTPUT DOES NOT MATCH: {}".format(response),
-                passed=passed,
-                description=self.description,
-            )
+        reader, writer = await _open_connection(self.host, self.port, timer)
+        try:
+            writer.write(self.input_data.encode("ascii"))
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(4096), timeout=1)
+            timer.mark("first_byte")
+        finally:
+            await _close(writer)
+        passed = bool(output_re.match(response.decode("ascii")))
+        log.info("TCP Response: {}".format(response))
+        return ATestResult(
+            test_type=self.test_type,
+            address=self._address,
+            status_code=200 if passed else 500,
+            reason="OK" if passed else "OUTPUT DOES NOT MATCH: {}".format(response),
+            passed=passed,
+            description=self.description,
+        )
 
 
 @attr.s
-class SSLTest(ATestProtocol):
+class SSLTest(_AsyncTest):
     """
     SSL Test.
 
@@ -207,33 +489,21 @@ class SSLTest(ATestProtocol):
     def _address(self):
         return "{}:{}".format(self.host, self.port)
 
-    def _test_no_verify(self, log):
-        context = ssl.create_default_context()
-        context.minimum_version = ssl.TLSVersion.TLSv1_2
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
-        with socket.create_connection((self.host, self.port), timeout=1) as sock:
-            with context.wrap_socket(sock, server_hostname=self.host) as secure_sock:
-                ssl_version = secure_sock.version()
-                return self._evaluate_ssl_version_and_return_result(
-                    ssl_version, verified=False
-                )
-
+    @_timed
     @_handle_socket_errors
-    def test(self, log):
+    async def atest(self, log, timer):
         """See Test.test."""
-        context = ssl.create_default_context()
-        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        _reader, writer, verified = await _open_tls_connection(
+            self.host, self.port, timer, ssl.TLSVersion.TLSv1_2
+        )
         try:
-            with socket.create_connection((self.host, self.port), timeout=1) as sock:
-                with context.wrap_socket(sock, server_hostname=self.host) as secure_sock:
-                    ssl_version = secure_sock.version()
-                    log = log.bind(ssl_version=ssl_version)
-                    return self._evaluate_ssl_version_and_return_result(
-                        ssl_version, verified=True
-                    )
-        except ssl.SSLCertVerificationError:
-            return self._test_no_verify(log)
+            ssl_version = writer.get_extra_info("ssl_object").version()
+        finally:
+            await _close(writer)
+        log.info("Negotiated", ssl_version=ssl_version, verified=verified)
+        return self._evaluate_ssl_version_and_return_result(
+            ssl_version, verified=verified
+        )
 
     def _evaluate_ssl_version_and_return_result(self, data, verified):
         if data in ["TLSv1.3", "TLSv1.2"]:
@@ -258,58 +528,349 @@ class SSLTest(ATestProtocol):
             )
 
 
+class _HTTPError(Exception):
+    """The server did not answer like an HTTP server, or redirected endlessly."""
+
+
+class _HTTPConnectionClosed(_HTTPError):
+    """The server closed the connection instead of answering."""
+
+
+_HTTP_REDIRECTS = (301, 302, 303, 307, 308)
+_HTTP_MAX_REDIRECTS = 30
+
+
+class _HTTPConnectionPool:
+    """
+    Idle keep-alive HTTP connections, per origin and event loop.
+
+    Connections belong to the loop they were opened on, so only tests running
+    on the same loop can reuse them. Connections idle for longer than
+    `idle_timeout` seconds get closed instead of reused.
+    """
+
+    def __init__(self, idle_timeout=30, max_idle_per_origin=2):
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_origin = max_idle_per_origin
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, origin):
+        """Return reader, writer and verified flag of an idle connection, or None."""
+        key = (asyncio.get_running_loop(), origin)
+        with self._lock:
+            connections = self._idle.get(key, [])
+            while connections:
+                reader, writer, verified, since = connections.pop()
+                if (
+                    monotonic() - since < self.idle_timeout
+                    and not reader.at_eof()
+                    and not writer.is_closing()
+                ):
+                    return reader, writer, verified
+                writer.close()
+            return None
+
+    def put(self, origin, reader, writer, verified):
+        """Keep a connection for reuse."""
+        key = (asyncio.get_running_loop(), origin)
+        with self._lock:
+            # Forget connections of loops that are gone, like those of asyncio.run
+            for stale_key in [key for key in self._idle if key[0].is_closed()]:
+                del self._idle[stale_key]
+            connections = self._idle.setdefault(key, [])
+            connections.append((reader, writer, verified, monotonic()))
+            while len(connections) > self.max_idle_per_origin:
+                connections.pop(0)[1].close()
+
+    def discard(self, loop):
+        """Forget the connections of `loop`, return their writers to close."""
+        with self._lock:
+            writers = []
+            for key in [key for key in self._idle if key[0] is loop]:
+                for _reader, writer, _verified, _since in self._idle.pop(key):
+                    writers.append(writer)
+            return writers
+
+    def clear(self):
+        with self._lock:
+            for (loop, _origin), connections in self._idle.items():
+                for _reader, writer, _verified, _since in connections:
+                    if not loop.is_closed():
+                        loop.call_soon_threadsafe(writer.close)
+            self._idle.clear()
+
+
+_http_connection_pool = _HTTPConnectionPool()
+
+
+def _http_proxy(scheme, host):
+    """
+    Return host, port and Proxy-Authorization of the proxy to use, or None.
+
+    Like requests, the proxies come from `HTTP_PROXY`, `HTTPS_PROXY`,
+    `ALL_PROXY` and `NO_PROXY` of the environment. Only http proxies work.
+    """
+    proxies = getproxies()
+    proxy = proxies.get(scheme) or proxies.get("all")
+    if not proxy or proxy_bypass(host):
+        return None
+    parts = urlsplit(proxy if "://" in proxy else "http://" + proxy)
+    if parts.scheme != "http" or not parts.hostname:
+        raise _HTTPError("Unsupported proxy: {}".format(proxy))
+    proxy_auth = _http_auth(parts)
+    return parts.hostname, parts.port or 80, proxy_auth
+
+
+async def _http_open(origin, timer):
+    scheme, host, port, proxy = origin
+    if scheme == "https":
+        return await _open_tls_connection(host, port, timer, proxy=proxy)
+    if proxy is not None:
+        # Plain requests go to the proxy, naming the whole URL
+        host, port = proxy[:2]
+    reader, writer = await _open_connection(host, port, timer)
+    return reader, writer, True
+
+
+async def _http_exchange(connection, origin, request, keep_alive, timer):
+    """Send a HEAD `request`, read the answer, keep or close the connection."""
+    reader, writer, verified = connection
+    try:
+        writer.write(request)
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout=1)
+        if not status_line:
+            raise _HTTPConnectionClosed("Connection closed without an answer")
+        timer.mark("first_byte")
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=1)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            version, status_code, *reason = status_line.decode("latin-1").split(None, 2)
+            status_code = int(status_code)
+        except ValueError:
+            raise _HTTPError("Invalid status line: {!r}".format(status_line))
+    except BaseException:
+        await _close(writer)
+        raise
+    # Answers to HEAD requests have no body, the connection is ready for reuse
+    if (
+        keep_alive
+        and version == "HTTP/1.1"
+        and headers.get("connection", "").lower() != "close"
+    ):
+        _http_connection_pool.put(origin, reader, writer, verified)
+    else:
+        await _close(writer)
+    timer.skip()
+    reason = reason[0].strip() if reason else ""
+    return status_code, reason, headers, verified
+
+
+def _http_host(parts):
+    """Return the Host header of a split URL, without any credentials."""
+    host = parts.hostname
+    if ":" in host:
+        host = "[{}]".format(host)
+    if parts.port is not None:
+        host = "{}:{}".format(host, parts.port)
+    return host
+
+
+def _http_auth(parts):
+    """Return the Authorization header for credentials in a split URL, or None."""
+    if parts.username is None:
+        return None
+    credentials = "{}:{}".format(unquote(parts.username), unquote(parts.password or ""))
+    return "Basic {}".format(
+        base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+    )
+
+
+async def _http_head_once(url, timer, keep_alive, auth=None):
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise _HTTPError("Unsupported URL scheme: {}".format(parts.scheme))
+    if not parts.hostname:
+        raise _HTTPError("No host in URL: {}".format(url))
+    proxy = _http_proxy(parts.scheme, parts.hostname)
+    origin = (
+        parts.scheme,
+        parts.hostname,
+        parts.port or (443 if parts.scheme == "https" else 80),
+        proxy,
+    )
+    path = parts.path or "/"
+    if parts.query:
+        path = "{}?{}".format(path, parts.query)
+    headers = "Host: {}\r\nAccept: */*\r\n".format(_http_host(parts))
+    auth = _http_auth(parts) or auth
+    if auth is not None:
+        headers += "Authorization: {}\r\n".format(auth)
+    if proxy is not None and parts.scheme == "http":
+        path = "http://{}{}".format(_http_host(parts), path)
+        if proxy[2] is not None:
+            headers += "Proxy-Authorization: {}\r\n".format(proxy[2])
+    request = (
+        "HEAD {} HTTP/1.1\r\n{}Connection: {}\r\n\r\n".format(
+            path, headers, "keep-alive" if keep_alive else "close"
+        )
+    ).encode("ascii")
+
+    if keep_alive:
+        connection = _http_connection_pool.get(origin)
+        if connection is not None:
+            try:
+                answer = await _http_exchange(
+                    connection, origin, request, keep_alive, timer
+                )
+                timer.connection("warm")
+                return answer
+            except (ConnectionError, _HTTPConnectionClosed):
+                # The server closed the idle connection in the meantime,
+                # timeouts are failures like on new connections
+                timer.skip()
+    connection = await _http_open(origin, timer)
+    timer.connection("cold")
+    return await _http_exchange(connection, origin, request, keep_alive, timer)
+
+
+async def _http_head(url, timer, keep_alive=True):
+    """
+    Send a HEAD request, return status code, reason and if TLS got verified.
+
+    Redirects get followed, like `requests.request("HEAD", ...)` would do.
+    Credentials in the URL get sent as basic auth, also to redirects on the
+    same host, but not to other hosts.
+    The certificate counts as verified, only if it was verified on every hop.
+    With `keep_alive`, idle connections get reused and kept for reuse.
+    """
+    all_verified = True
+    auth = _http_auth(urlsplit(url))
+    for _i in range(_HTTP_MAX_REDIRECTS + 1):
+        status_code, reason, headers, verified = await _http_head_once(
+            url, timer, keep_alive, auth
+        )
+        all_verified = all_verified and verified
+        if status_code not in _HTTP_REDIRECTS or "location" not in headers:
+            return status_code, reason, all_verified
+        location = urljoin(url, headers["location"])
+        if urlsplit(location).hostname != urlsplit(url).hostname:
+            auth = None
+        url = location
+    raise _HTTPError("Exceeded {} redirects".format(_HTTP_MAX_REDIRECTS))
+
+
 @attr.s
-class HTTPTest(ATestProtocol):
+class HTTPTest(_AsyncTest):
     """
     HTTP Test.
 
-    Tries to connect to the URL and expects either 200 or 401
+    Tries to connect to the URL and expects either 200 or 401.
+    Connections are kept alive and reused by later runs, unless `keep_alive`
+    is disabled, then every run opens a new connection.
     """
 
     url = attr.ib()
     description = attr.ib()
+    keep_alive = attr.ib(default=True)
     test_type = "HTTP Test"
 
-    def _test_no_verify(self, log):
-        return self._test(log, broken_ssl=True)
+    @property
+    def _address(self):
+        return self.url
 
     def test(self, log):
-        """See Test.test."""
-        return self._test(log, broken_ssl=False)
+        """See Test.test, kept connections get closed before the loop ends."""
+        return asyncio.run(self._test_and_close(log))
 
-    def _test(self, log, broken_ssl):
+    async def _test_and_close(self, log):
+        try:
+            return await self.atest(log)
+        finally:
+            for writer in _http_connection_pool.discard(asyncio.get_running_loop()):
+                await _close(writer)
+
+    @_timed
+    async def atest(self, log, timer):
+        """See Test.test."""
         try:
-            req = requests.request("HEAD", self.url, timeout=1, verify=not broken_ssl)
-        except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout):
-            return _make_timeout_error_result(self.test_type, self.url, self.description)
-        except requests.exceptions.SSLError:
-            log.info("Failed to validate cert, no trying without validation")
-            return self._test_no_verify(log)
-        except requests.exceptions.ConnectionError as exc:
+            status_code, reason, verified = await _http_head(
+                self.url, timer, self.keep_alive
+            )
+        except asyncio.TimeoutError:
+            return _make_timeout_error_result(
+                self.test_type, self.url, self.description
+            )
+        except (OSError, _HTTPError) as exc:
             return _make_generic_error_result(
                 self.test_type, self.url, self.description, exc
             )
         except Exception:
             log.exception("Something went wrong and will bubble up now")
             raise
-
-        reason = (
-            req.reason + " but no SSL Verification possible"
-            if broken_ssl
-            else req.reason
-        )
+        if not verified:
+            log.info("Could not validate cert, tested without validation")
+            reason = reason + " but no SSL Verification possible"
         return ATestResult(
             test_type=self.test_type,
             address=self.url,
-            status_code=req.status_code,
+            status_code=status_code,
             reason=reason,
-            passed=req.status_code in [200, 401],
+            passed=status_code in [200, 401],
             description=self.description,
         )
 
 
+class _NTPClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, response):
+        self.response = response
+
+    def datagram_received(self, data, addr):
+        if not self.response.done():
+            self.response.set_result(data)
+
+    def error_received(self, exc):
+        if not self.response.done():
+            self.response.set_exception(exc)
+
+
+async def _ntp_request(host, version, timer, port=123, timeout=5):
+    """Asyncio version of `ntplib.NTPClient.request`."""
+    loop = asyncio.get_running_loop()
+    family, _type, _proto, _name, address = (
+        await _resolve(host, port, timer, type_=socket.SOCK_DGRAM, timeout=timeout)
+    )[0]
+    response = loop.create_future()
+    transport, _protocol = await loop.create_datagram_endpoint(
+        partial(_NTPClientProtocol, response), remote_addr=address, family=family
+    )
+    try:
+        query_packet = ntplib.NTPPacket(
+            mode=3, version=version, tx_timestamp=ntplib.system_to_ntp_time(time())
+        )
+        transport.sendto(query_packet.to_data())
+        try:
+            data = await asyncio.wait_for(response, timeout=timeout)
+        except asyncio.TimeoutError:
+            raise ntplib.NTPException("No response received from %s." % host)
+        timer.mark("first_byte")
+        dest_timestamp = ntplib.system_to_ntp_time(time())
+    finally:
+        transport.close()
+    stats = ntplib.NTPStats()
+    stats.from_data(data)
+    stats.dest_timestamp = dest_timestamp
+    return stats
+
+
 @attr.s
-class NTPTest(ATestProtocol):
+class NTPTest(_AsyncTest):
     """
     NTP Test.
 
@@ -324,12 +885,12 @@ class NTPTest(ATestProtocol):
     def _address(self):
         return "{}:123".format(self.host)
 
+    @_timed
     @_handle_socket_errors
-    def test(self, log):
+    async def atest(self, log, timer):
         """See Test.test."""
-        client = ntplib.NTPClient()
         try:
-            response = client.request(self.host, version=3)
+            response = await _ntp_request(self.host, 3, timer)
         except ntplib.NTPException as exc:
             return _make_generic_error_result(
                 self.test_type, self._address, self.description, exc
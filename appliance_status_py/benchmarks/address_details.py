@@ -0,0 +1,94 @@
+"""
+Time adding details to the addresses of 10k interfaces.
+
+Run with the package installed, see `make init`:
+
+    python benchmarks/address_details.py
+"""
+import copy
+import ipaddress
+import timeit
+
+from appliance_status import network
+
+INTERFACES = 10000
+REPEAT = 5
+NUMBER = 5
+
+
+def _interfaces():
+    """Return veth interfaces with an IPv4 and an IPv6 address each."""
+    return [
+        {
+            "ifname": "veth{}".format(index),
+            "addr_info": [
+                {
+                    "family": "inet",
+                    "local": "10.{}.{}.1".format(index // 256, index % 256),
+                    "prefixlen": 24 + index % 9,
+                },
+                {
+                    "family": "inet6",
+                    "local": "fd00:{:x}::1".format(index),
+                    "prefixlen": 64 + index % 65,
+                },
+            ],
+        }
+        for index in range(INTERFACES)
+    ]
+
+
+def _netmasks_only(interfaces, default_if):
+    """Add details like before, only IPv4 netmasks, one address at a time."""
+    for entry in interfaces:
+        entry["default"] = entry["ifname"] == default_if
+        entry["is_physical"] = network._is_physical_address_name(entry["ifname"])
+        for addr_info_entry in entry["addr_info"]:
+            if addr_info_entry["family"] == "inet":
+                addr_info_entry["netmask"] = network._prefix_to_netmask(
+                    addr_info_entry["prefixlen"]
+                )
+    return interfaces
+
+
+def _with_ipaddress(interfaces, default_if):
+    """Add the same details with the ipaddress module, one address at a time."""
+    for entry in interfaces:
+        entry["default"] = entry["ifname"] == default_if
+        entry["is_physical"] = network._is_physical_address_name(entry["ifname"])
+        for addr_info in entry["addr_info"]:
+            interface = ipaddress.ip_interface(
+                "{}/{}".format(addr_info["local"], addr_info["prefixlen"])
+            )
+            addr_info["network"] = str(interface.network.network_address)
+            addr_info["hosts"] = interface.network.num_addresses
+            if interface.version == 4:
+                addr_info["netmask"] = str(interface.netmask)
+                addr_info["broadcast"] = str(interface.network.broadcast_address)
+    return interfaces
+
+
+def _bench(name, function, interfaces):
+    copies = [copy.deepcopy(interfaces) for _ in range(REPEAT * NUMBER)]
+    best = min(
+        timeit.repeat(
+            lambda: function(copies.pop(), "veth0"), repeat=REPEAT, number=NUMBER
+        )
+    )
+    print("{:<40} {:8.2f} ms".format(name, best / NUMBER * 1000))
+
+
+def main():
+    """Compare the batched details with the netmask only loop and ipaddress."""
+    interfaces = _interfaces()
+    addresses = 2 * INTERFACES
+    for name, function in (
+        ("IPv4 netmasks only", _netmasks_only),
+        ("all details, ipaddress", _with_ipaddress),
+        ("all details, batched", network.add_details),
+    ):
+        _bench("{}, {} addresses".format(name, addresses), function, interfaces)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare the ways of reading the network configuration.
+
+Run with the package installed, see `make init`:
+
+    python benchmarks/network_backends.py
+"""
+import timeit
+
+from appliance_status import netlink, network
+
+REPEAT = 5
+NUMBER = 50
+
+
+def _bench(name, function):
+    try:
+        function()
+    except Exception as exc:
+        print("{:<32} not available: {}".format(name, exc))
+        return
+    best = min(timeit.repeat(function, repeat=REPEAT, number=NUMBER)) / NUMBER
+    print("{:<32} {:8.3f} ms".format(name, best * 1000))
+
+
+def _uncached(function):
+    """
+    Run `function` without the results `ip` returned shortly before.
+
+    Either way, ip runs its commands for interfaces and routes together.
+    """
+
+    def run():
+        network._ip_commands = network._IPCommands()
+        return function()
+
+    return run
+
+
+def main():
+    """Time every backend for interfaces and for the default route."""
+    _bench("interfaces: netlink", netlink.get_interfaces)
+    _bench("interfaces: sysfs", network._sysfs_get_interfaces)
+    _bench(
+        "interfaces: ip",
+        _uncached(lambda: network._ip_get_network_information("")),
+    )
+    _bench("default route: netlink", netlink.get_default_route)
+    _bench("default route: procfs", network._proc_get_default_route)
+    _bench("default route: ip", _uncached(network._ip_get_default_route))
+
+
+if __name__ == "__main__":
+    main()
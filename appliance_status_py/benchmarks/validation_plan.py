@@ -0,0 +1,101 @@
+"""
+Time validating a form of a schema with thousands of fields.
+
+Run with the package installed, see `make init`:
+
+    python benchmarks/validation_plan.py
+"""
+import string
+import timeit
+
+from appliance_status import config_manager
+
+FIELDS = 5000
+REPEAT = 5
+NUMBER = 5
+
+
+class _Discard:
+    """Stands in for the config on disk, forgets what gets written."""
+
+    config = None
+
+
+def _schema():
+    """Return a schema alternating between port and letter fields."""
+    return {
+        "version": 1,
+        "name": "Benchmark",
+        "schema": [
+            {
+                "name": "field{}".format(index),
+                "key": "field{}".format(index),
+                "type_normalizer": "port" if index % 2 else "az_az_upper",
+            }
+            for index in range(FIELDS)
+        ],
+    }
+
+
+def _form(schema):
+    return {
+        field["key"]: "8080" if field["type_normalizer"] == "port" else "Letters" * 100
+        for field in schema["schema"]
+    }
+
+
+def _az_az_upper_per_character(value):
+    """Check letters like before, one character at a time."""
+    value = str(value)
+    if len(value) > 1000:
+        raise ValueError("Too large")
+    for key in value:
+        if key not in string.ascii_letters:
+            raise ValueError("Character not ascii letter")
+    return value
+
+
+def _per_request(manager, form):
+    """Validate like before, resolving normalizers for every field."""
+    normalizers = {"az_az_upper": _az_az_upper_per_character}
+    new_data = []
+    written_fields = set()
+    for schema_field in manager.form_schema["schema"]:
+        written_fields.add(schema_field["key"])
+        name = schema_field["type_normalizer"]
+        normalizer = normalizers.get(name) or getattr(manager.normalizers, name)
+        new_data.append(
+            {"key": schema_field["key"], "value": normalizer(form[schema_field["key"]])}
+        )
+    if set(form.keys()) - set(written_fields):
+        raise ValueError("Form contained unknown fields")
+    manager.config_on_disk.config = {
+        "version": manager.form_schema["version"],
+        "schema": new_data,
+    }
+
+
+def _bench(name, function):
+    best = min(timeit.repeat(function, repeat=REPEAT, number=NUMBER))
+    print("{:<40} {:8.2f} ms".format(name, best / NUMBER * 1000))
+
+
+def main():
+    """Compare validation per request with the compiled plan."""
+    schema = _schema()
+    form = _form(schema)
+    manager = config_manager.ConfigManager(_Discard(), schema)
+    _bench(
+        "per request, {} fields".format(FIELDS), lambda: _per_request(manager, form)
+    )
+    _bench(
+        "compiled plan, {} fields".format(FIELDS), lambda: manager.update_config(form)
+    )
+    _bench(
+        "compiling the plan, {} fields".format(FIELDS),
+        lambda: config_manager.ConfigManager(_Discard(), schema),
+    )
+
+
+if __name__ == "__main__":
+    main()